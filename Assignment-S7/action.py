@@ -1,4 +1,4 @@
-from typing import Dict, Any, Union
+from typing import Dict, Any, Optional, Union
 from pydantic import BaseModel
 from mcp import ClientSession
 import ast
@@ -56,8 +56,13 @@ def parse_function_call(response: str) -> tuple[str, Dict[str, Any]]:
         raise
 
 
-async def execute_tool(session: ClientSession, tools: list[Any], response: str) -> ToolCallResult:
-    """Executes a FUNCTION_CALL via MCP tool session."""
+async def execute_tool(session: ClientSession, tools: list[Any], response: str,
+                       defaults: Optional[Dict[str, Any]] = None) -> ToolCallResult:
+    """Executes a FUNCTION_CALL via MCP tool session.
+
+    `defaults` fill in arguments the plan left out, for tools whose schema accepts them
+    (e.g. perception entities for search_documents).
+    """
     try:
         tool_name, arguments = parse_function_call(response)
 
@@ -65,6 +70,11 @@ async def execute_tool(session: ClientSession, tools: list[Any], response: str)
         if not tool:
             raise ValueError(f"Tool '{tool_name}' not found in registered tools")
 
+        accepted = (getattr(tool, "inputSchema", None) or {}).get("properties", {})
+        for key, value in (defaults or {}).items():
+            if key in accepted and key not in arguments and value:
+                arguments[key] = value
+
         log("tool", f"⚙️ Calling '{tool_name}' with: {arguments}")
         result = await session.call_tool(tool_name, arguments=arguments)
 
@@ -3,12 +3,14 @@ import logging
 import time
 import os
 import datetime
+import atexit
+import threading
 from perception import extract_perception
-from memory import MemoryManager, MemoryItem
+from memory import ShardedMemoryManager, MemoryItem, MEMORY_DIR, DEFAULT_SHARD
 from decision import generate_plan
 from action import execute_tool
 from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
+from session_pool import MCPSessionPool
 from flask_cors import CORS
 from flask import Flask, request, jsonify
 import re
@@ -30,6 +32,42 @@ def log(stage: str, msg: str):
     print(f"[{now}] [{stage}] {msg}")
 
 max_steps = 3
+# Each tenant gets its own memory directory, so only short, path-safe names are accepted from clients
+TENANT_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+# Warm tool-server sessions shared by all requests instead of one subprocess per query
+SESSION_POOL = MCPSessionPool(
+    StdioServerParameters(
+        command="python",
+        args=["example3.py"],
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    ),
+    size=int(os.getenv("MCP_POOL_SIZE", "2"))
+)
+atexit.register(SESSION_POOL.close)
+
+_memory = None
+_memory_lock = threading.Lock()
+
+
+def get_memory() -> ShardedMemoryManager:
+    """Persistent memory sharded by tenant, opened on first use.
+
+    Shards load on demand, idle ones go back to disk, and resident ones are
+    flushed and TTL-compacted in the background. Opening it lazily keeps
+    those threads in the process that serves requests: under the debug
+    reloader the module is also imported by the watching parent, which
+    must not write MEMORY_DIR too.
+    """
+    global _memory
+    with _memory_lock:
+        if _memory is None:
+            _memory = ShardedMemoryManager(MEMORY_DIR)
+            _memory.start_autoflush()
+            _memory.start_compactor()
+            atexit.register(_memory.close)
+        return _memory
+
 
 @app.route('/api/test', methods=['GET'])
 def test_endpoint():
@@ -37,6 +75,11 @@ def test_endpoint():
     print("Test endpoint called")
     return jsonify(success=True, message="API is working")
 
+@app.route('/api/memory_stats', methods=['GET'])
+def memory_stats():
+    """Report memory shard count, resident bytes and shard load latency."""
+    return jsonify(get_memory().stats())
+
 @app.route('/api/indexed_pages', methods=['GET'])
 def list_indexed_pages():
     """List all pages that have been indexed in FAISS."""
@@ -47,40 +90,18 @@ def list_indexed_pages():
     
     logging.info("Received request for indexed pages")
     try:
-        # Path to the FAISS metadata file
-        metadata_path = Path("faiss_index/metadata.json")
-        print(f"Looking for metadata file at: {metadata_path}")
-        
-        if not metadata_path.exists():
-            logging.warning("No metadata file found at: %s", metadata_path)
-            print(f"No metadata file found at: {metadata_path}")
-            return jsonify(
-                success=True,
-                stats={
-                    "total_pages": 0,
-                    "total_chunks": 0,
-                    "pages": []
-                }
-            )
-        
-        # Read the metadata file
-        with open(metadata_path, 'r') as f:
-            metadata = json.load(f)
-            print(f"Successfully loaded metadata file with {len(metadata)} entries")
-            logging.info("Successfully loaded metadata file with %d entries", len(metadata))
-        
-        # Extract unique documents and their chunk counts
+        # Per-document chunk counts from the chunk store
+        doc_counts = e3.CHUNK_STORE.doc_counts()
+        logging.info("Loaded chunk counts for %d documents", len(doc_counts))
+
         doc_stats = {}
-        for item in metadata:
-            doc_name = item['doc']
-            if doc_name not in doc_stats:
-                doc_stats[doc_name] = {
-                    'filename': doc_name,
-                    'chunk_count': 0,
-                    'last_modified': None
-                }
-            doc_stats[doc_name]['chunk_count'] += 1
-            
+        for doc_name, chunk_count in doc_counts.items():
+            doc_stats[doc_name] = {
+                'filename': doc_name,
+                'chunk_count': chunk_count,
+                'last_modified': None
+            }
+
             # Try to get file modification time
             try:
                 file_path = os.path.join('documents', doc_name)
@@ -120,15 +141,10 @@ def log_page():
     logging.info(f"Logging page for URL: {url}")
     try:
         # Check if URL is already indexed
-        metadata_path = Path("faiss_index/metadata.json")
-        if metadata_path.exists():
-            with open(metadata_path, 'r') as f:
-                metadata = json.load(f)
-                # Check if any document in metadata matches this URL
-                url_filename = re.sub(r'[^a-zA-Z0-9]', '_', url)[:50] + ".txt"
-                if any(item['doc'] == url or item['doc'] == url_filename for item in metadata):
-                    logging.info(f"URL already indexed: {url}")
-                    return jsonify(success=True, message="Page already indexed", already_indexed=True)
+        url_filename = re.sub(r'[^a-zA-Z0-9]', '_', url)[:50] + ".txt"
+        if e3.CHUNK_STORE.has_doc(url) or e3.CHUNK_STORE.has_doc(url_filename):
+            logging.info(f"URL already indexed: {url}")
+            return jsonify(success=True, message="Page already indexed", already_indexed=True)
 
         # If not indexed, proceed with indexing
         html = requests.get(url).text
@@ -160,30 +176,17 @@ def summary():
     url = request.json.get('url')
     logging.info(f"Generating summary for URL: {url}")
     try:
-        # Read the FAISS metadata
-        metadata_path = Path("faiss_index/metadata.json")
-        if not metadata_path.exists():
-            logging.error("Metadata file not found at: %s", metadata_path)
-            return jsonify(success=False, error="No index metadata found")
-            
-        with open(metadata_path, 'r') as f:
-            metadata = json.load(f)
-            logging.info(f"Successfully loaded metadata with {len(metadata)} entries")
-            
         # Find chunks for the given URL
-        chunks = []
         # Convert URL to filename format for comparison
         url_filename = re.sub(r'[^a-zA-Z0-9]', '_', url)[:50] + ".txt"
         logging.info(f"Looking for content with URL: {url} or filename: {url_filename}")
-        
-        for item in metadata:
-            # Check if the document name matches either the URL or the filename
-            if item['doc'] == url or item['doc'] == url_filename:
-                chunks.append(item['chunk'])
-                
+
+        # The document name may be either the URL or the filename
+        chunks = e3.CHUNK_STORE.chunks_for_doc(url) or e3.CHUNK_STORE.chunks_for_doc(url_filename)
+
         if not chunks:
             # Log the available documents for debugging
-            available_docs = set(item['doc'] for item in metadata)
+            available_docs = set(e3.CHUNK_STORE.doc_counts())
             logging.error(f"No content found. Available documents: {available_docs}")
             return jsonify(
                 success=False, 
@@ -204,7 +207,7 @@ def summary():
         logging.info("Calling main() with summarization query")
         
         try:
-            summary = asyncio.run(main(query))
+            summary = main(query)
             logging.info(f"Received summary response: {summary[:100]}...")  # Log first 100 chars
             
             # Extract the summary from the FINAL_ANSWER format
@@ -228,9 +231,12 @@ def summary():
 def user_query():
     """Answer user query using vector search."""
     query = request.json.get('query')
+    tenant = request.json.get('tenant') or DEFAULT_SHARD
+    if not isinstance(tenant, str) or not TENANT_PATTERN.fullmatch(tenant):
+        return jsonify(success=False, error="tenant must be 1-64 letters, digits, '_' or '-'", found_answer=False), 400
     logging.info(f"Received user query: {query}")
     try:
-        result = asyncio.run(main(query))
+        result = main(query, tenant)
         # Extract the actual answer from the FINAL_ANSWER format
         if result and result.startswith("FINAL_ANSWER:"):
             answer = result.replace("FINAL_ANSWER:", "").strip()
@@ -244,98 +250,71 @@ def user_query():
         logging.exception("Error processing query")
         return jsonify(success=False, error=str(e), found_answer=False)
 
-async def main(user_input: str):
-    try:
-        print("[agent] Starting agent...")
-        print(f"[agent] Current working directory: {os.getcwd()}")
-        
-        server_params = StdioServerParameters(
-            command="python",
-            args=["example3.py"],
-            cwd="C:/Users/shivs/Downloads/Assignment-S7"
-        )
+async def run_agent(session: ClientSession, tools: list, user_input: str, tenant: str = DEFAULT_SHARD):
+    """Agent loop on a warm pooled session; embeddings are awaited and blocking LLM calls run off the event loop."""
+    tool_descriptions = "\n".join(
+        f"- {tool.name}: {getattr(tool, 'description', 'No description')}" 
+        for tool in tools
+    )
+
+    log("agent", f"{len(tools)} tools loaded")
+
+    memory = get_memory()
+    session_id = f"session-{int(time.time())}"
+    query = user_input  # Store original intent
+    step = 0
+    final_result = None
+
+    while step < max_steps:
+        log("loop", f"Step {step + 1} started")
+
+        perception = await asyncio.to_thread(extract_perception, user_input)
+        log("perception", f"Intent: {perception.intent}, Tool hint: {perception.tool_hint}")
+
+        # Not session-filtered: tool outputs from earlier queries can save a repeat call
+        retrieved = await memory.aretrieve(query=user_input, top_k=3, tenant=tenant)
+        log("memory", f"Retrieved {len(retrieved)} relevant memories")
+
+        plan = await asyncio.to_thread(generate_plan, perception, [item for item, _ in retrieved],
+                                       tool_descriptions=tool_descriptions)
+        log("plan", f"Plan generated: {plan}")
+
+        if plan.startswith("FINAL_ANSWER:"):
+            log("agent", f"✅ FINAL RESULT: {plan}")
+            final_result = plan
+            break
 
         try:
-            async with stdio_client(server_params) as (read, write):
-                print("Connection established, creating session...")
-                try:
-                    async with ClientSession(read, write) as session:
-                        print("[agent] Session created, initializing...")
- 
-                        try:
-                            await session.initialize()
-                            print("[agent] MCP session initialized")
-
-                            # Your reasoning, planning, perception etc. would go here
-                            tools = await session.list_tools()
-                            print("Available tools:", [t.name for t in tools.tools])
-
-                            # Get available tools
-                            print("Requesting tool list...")
-                            tools_result = await session.list_tools()
-                            tools = tools_result.tools
-                            tool_descriptions = "\n".join(
-                                f"- {tool.name}: {getattr(tool, 'description', 'No description')}" 
-                                for tool in tools
-                            )
-
-                            log("agent", f"{len(tools)} tools loaded")
-
-                            memory = MemoryManager()
-                            session_id = f"session-{int(time.time())}"
-                            query = user_input  # Store original intent
-                            step = 0
-                            final_result = None
-
-                            while step < max_steps:
-                                log("loop", f"Step {step + 1} started")
-
-                                perception = extract_perception(user_input)
-                                log("perception", f"Intent: {perception.intent}, Tool hint: {perception.tool_hint}")
-
-                                retrieved = memory.retrieve(query=user_input, top_k=3, session_filter=session_id)
-                                log("memory", f"Retrieved {len(retrieved)} relevant memories")
-
-                                plan = generate_plan(perception, retrieved, tool_descriptions=tool_descriptions)
-                                log("plan", f"Plan generated: {plan}")
-
-                                if plan.startswith("FINAL_ANSWER:"):
-                                    log("agent", f"✅ FINAL RESULT: {plan}")
-                                    final_result = plan
-                                    break
-
-                                try:
-                                    result = await execute_tool(session, tools, plan)
-                                    log("tool", f"{result.tool_name} returned: {result.result}")
-
-                                    memory.add(MemoryItem(
-                                        text=f"Tool call: {result.tool_name} with {result.arguments}, got: {result.result}",
-                                        type="tool_output",
-                                        tool_name=result.tool_name,
-                                        user_query=user_input,
-                                        tags=[result.tool_name],
-                                        session_id=session_id
-                                    ))
-
-                                    user_input = f"Original task: {query}\nPrevious output: {result.result}\nWhat should I do next?"
-
-                                except Exception as e:
-                                    log("error", f"Tool execution failed: {e}")
-                                    final_result = f"FINAL_ANSWER: [Error: {str(e)}]"
-                                    break
-
-                                step += 1
-                        except Exception as e:
-                            print(f"[agent] Session initialization error: {str(e)}")
-                            final_result = f"FINAL_ANSWER: [Error: {str(e)}]"
-                except Exception as e:
-                    print(f"[agent] Session creation error: {str(e)}")
-                    final_result = f"FINAL_ANSWER: [Error: {str(e)}]"
+            result = await execute_tool(session, tools, plan, {"entities": perception.entities})
+            log("tool", f"{result.tool_name} returned: {result.result}")
+
+            await memory.aadd(MemoryItem(
+                text=f"Tool call: {result.tool_name} with {result.arguments}, got: {result.result}",
+                type="tool_output",
+                tool_name=result.tool_name,
+                user_query=user_input,
+                tags=[result.tool_name],
+                session_id=session_id
+            ), tenant)
+
+            user_input = f"Original task: {query}\nPrevious output: {result.result}\nWhat should I do next?"
+
         except Exception as e:
-            print(f"[agent] Connection error: {str(e)}")
+            log("error", f"Tool execution failed: {e}")
             final_result = f"FINAL_ANSWER: [Error: {str(e)}]"
+            break
+
+        step += 1
+
+    return final_result
+
+def main(user_input: str, tenant: str = DEFAULT_SHARD) -> str:
+    """Run one agent query on a pooled MCP session and return its FINAL_ANSWER string."""
+    print("[agent] Starting agent...")
+    try:
+        final_result = SESSION_POOL.run(lambda session, tools: run_agent(session, tools, user_input, tenant))
     except Exception as e:
-        print(f"[agent] Overall error: {str(e)}")
+        print(f"[agent] Session error: {str(e)}")
         final_result = f"FINAL_ANSWER: [Error: {str(e)}]"
 
     log("agent", "Agent session complete.")
@@ -0,0 +1,45 @@
+"""Time-to-first-list_tools for the example3.py MCP server.
+
+Spawns the server over stdio the same way agent.py does and measures how
+long initialize + list_tools take from process start. Usage:
+python benchmarks/bench_startup.py [--runs 5]
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+async def time_to_list_tools() -> tuple[float, int]:
+    server_params = StdioServerParameters(command=sys.executable, args=["example3.py"], cwd=str(ROOT))
+    start = time.perf_counter()
+    async with stdio_client(server_params) as (read, write):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            tools = await session.list_tools()
+            return time.perf_counter() - start, len(tools.tools)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    samples = []
+    for run in range(args.runs):
+        seconds, n_tools = asyncio.run(time_to_list_tools())
+        samples.append(seconds)
+        print(f"run {run + 1}: {seconds:6.2f}s to list {n_tools} tools")
+    print(f"mean {statistics.mean(samples):6.2f}s  min {min(samples):6.2f}s  max {max(samples):6.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# chunk_store.py
+
+import json
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+CHUNKS_NAME = "chunks.db"
+# Words too common to help a keyword match; dropped from queries, not from the index
+STOPWORDS = frozenset("""
+a an and are as at be by did do does for from had has have he her his how i in is it its me my of on or she so
+that the their them they this to was we were what when where which who whom why will with you your
+""".split())
+
+
+class ChunkStore:
+    """Chunk metadata for the FAISS index, addressed by FAISS id.
+
+    Rows are written once per new chunk and read back by id, so neither
+    indexing nor search has to load the whole corpus. An FTS5 full-text
+    index over the chunk text is kept in step by triggers and ranked with
+    BM25 (`keyword_search`). New ids come from `reserve_ids`, whose
+    high-water mark is kept in the same database so an id is never handed
+    out twice, even after the newest document is deleted.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " id INTEGER PRIMARY KEY, doc TEXT NOT NULL, chunk_id TEXT NOT NULL, chunk TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_doc ON chunks (doc)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._create_fts()
+        self._conn.commit()
+
+    def _create_fts(self):
+        """Create the full-text index and its sync triggers; backfill it for a store that predates them."""
+        exists = self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunks_fts'").fetchone()
+        self._conn.executescript("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                chunk, content='chunks', content_rowid='id', tokenize='porter unicode61');
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN
+                INSERT INTO chunks_fts (rowid, chunk) VALUES (new.id, new.chunk);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, chunk) VALUES ('delete', old.id, old.chunk);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_update AFTER UPDATE ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, chunk) VALUES ('delete', old.id, old.chunk);
+                INSERT INTO chunks_fts (rowid, chunk) VALUES (new.id, new.chunk);
+            END;
+        """)
+        if not exists:
+            self._conn.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('rebuild')")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def append(self, ids: Sequence[int], rows: Iterable[dict]):
+        """Write rows under the given FAISS ids; rows left over from an interrupted run are overwritten."""
+        values = [(int(i), r["doc"], r["chunk_id"], r["chunk"]) for i, r in zip(ids, rows)]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)", values)
+            self._conn.commit()
+
+    def replace_docs(self, docs: Iterable[str], ids: Sequence[int], rows: Iterable[dict]):
+        """Delete every row of `docs` and write `rows` under `ids` in one transaction.
+
+        Readers in any process see either the old documents or the new
+        ones. Deleting by document name also sweeps rows an interrupted
+        earlier run left outside the doc cache's ranges.
+        """
+        values = [(int(i), r["doc"], r["chunk_id"], r["chunk"]) for i, r in zip(ids, rows)]
+        with self._lock:
+            try:
+                self._conn.executemany("DELETE FROM chunks WHERE doc = ?", [(doc,) for doc in docs])
+                self._conn.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)", values)
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    def reserve_ids(self, n: int) -> int:
+        """Reserve `n` fresh FAISS ids and return the first; safe across processes sharing the database.
+
+        A store without a high-water mark yet starts one past its largest id.
+        """
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so two processes cannot read the same mark
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()
+                start = row[0] if row else self._conn.execute("SELECT COALESCE(MAX(id), -1) + 1 FROM chunks").fetchone()[0]
+                self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('next_id', ?)", (start + n,))
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        return start
+
+    def get(self, chunk_id: int) -> Optional[dict]:
+        return self.get_many([chunk_id])[0]
+
+    def get_many(self, ids: Sequence[int]) -> List[Optional[dict]]:
+        """Fetch rows by FAISS id, preserving order; unknown ids give None."""
+        ids = [int(i) for i in ids]
+        if not ids:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, doc, chunk_id, chunk FROM chunks WHERE id IN ({','.join('?' * len(ids))})", ids
+            ).fetchall()
+        by_id = {r[0]: {"doc": r[1], "chunk": r[3], "chunk_id": r[2]} for r in rows}
+        return [by_id.get(i) for i in ids]
+
+    def keyword_search(self, query: str, k: int = 20) -> List[Tuple[int, float]]:
+        """Return up to k (FAISS id, BM25 score) pairs for chunks sharing words with `query`, best first."""
+        terms = dict.fromkeys(t for t in re.findall(r"\w+", query.lower()) if t not in STOPWORDS)
+        if not terms:
+            return []
+        # Quoted terms are matched literally; OR lets BM25 weigh rare terms over common ones
+        match = " OR ".join(f'"{t}"' for t in terms)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT rowid, bm25(chunks_fts) FROM chunks_fts WHERE chunks_fts MATCH ?"
+                " ORDER BY bm25(chunks_fts) LIMIT ?", (match, k)
+            ).fetchall()
+        # FTS5's bm25() is negative, lower being better
+        return [(rowid, -score) for rowid, score in rows]
+
+    def chunks_for_doc(self, doc: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT chunk FROM chunks WHERE doc = ? ORDER BY id", (doc,)).fetchall()
+        return [r[0] for r in rows]
+
+    def doc_counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT doc, COUNT(*) FROM chunks GROUP BY doc").fetchall()
+        return dict(rows)
+
+    def ids_for_doc(self, doc: str) -> List[int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM chunks WHERE doc = ? ORDER BY id", (doc,)).fetchall()
+        return [r[0] for r in rows]
+
+    def id_docs(self) -> Dict[int, str]:
+        with self._lock:
+            return dict(self._conn.execute("SELECT id, doc FROM chunks").fetchall())
+
+    def delete(self, ids: Iterable[int]):
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(int(i),) for i in ids])
+            self._conn.commit()
+
+    def renumber(self, live_ids: Sequence[int]):
+        """Drop rows not in `live_ids` and renumber the rest to 0..n-1 in id order."""
+        live_ids = sorted(int(i) for i in live_ids)
+        with self._lock:
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS keep (id INTEGER PRIMARY KEY)")
+            self._conn.execute("DELETE FROM keep")
+            self._conn.executemany("INSERT INTO keep VALUES (?)", [(i,) for i in live_ids])
+            self._conn.execute("DELETE FROM chunks WHERE id NOT IN (SELECT id FROM keep)")
+            # Ascending order means each target id has already been vacated
+            self._conn.executemany("UPDATE chunks SET id = ? WHERE id = ?", list(enumerate(live_ids)))
+            self._conn.execute("DROP TABLE keep")
+            self._conn.commit()
+
+    def vacuum(self):
+        with self._lock:
+            self._conn.execute("VACUUM")
+
+    def has_doc(self, doc: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM chunks WHERE doc = ? LIMIT 1", (doc,)).fetchone() is not None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def migrate_metadata_json(store: ChunkStore, metadata_file: Path) -> int:
+    """One-shot import of a legacy metadata.json list (row i -> FAISS id i); renames the file afterwards."""
+    metadata_file = Path(metadata_file)
+    if not metadata_file.exists():
+        return 0
+    metadata = json.loads(metadata_file.read_text())
+    rows = [{"doc": m.get("doc") or m.get("url", ""), "chunk": m["chunk"], "chunk_id": m["chunk_id"]} for m in metadata]
+    store.append(range(len(rows)), rows)
+    metadata_file.rename(metadata_file.with_name(metadata_file.name + ".migrated"))
+    return len(rows)
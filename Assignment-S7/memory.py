@@ -1,87 +1,948 @@
 # memory.py
 
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
 import numpy as np
 import faiss
-import requests
-from typing import List, Optional, Literal
-from pydantic import BaseModel
-from datetime import datetime
+from array import array
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from doc_index import write_index_atomic, write_text_atomic
+from embeddings import get_client
+from index_factory import normalize, select_hits
+from typing import Dict, List, Optional, Literal, Sequence, Tuple
+from pydantic import BaseModel, Field
+from datetime import datetime, timedelta, timezone
+
+MEMORY_MIN_SCORE = 0.4  # cosine similarity below which a memory is not worth prompting with
+INITIAL_CAPACITY = 1024  # rows preallocated in the embedding buffer; doubled when full
+MEMORY_DIR = Path(__file__).parent.resolve() / "faiss_index" / "memory"
+FLUSH_INTERVAL = 30.0  # seconds between background saves
+META_NAME = "meta.json"  # written last: the count it records is what a load trusts
+ITEMS_NAME = "items.jsonl"
+EMBEDDINGS_NAME = "embeddings.f32"
+INDEX_NAME = "index.bin"
+COMPACT_INTERVAL = 300.0  # seconds between background TTL compactions
+# Seconds a memory of each type is kept; types not listed never expire
+DEFAULT_TTL = {"tool_output": 7 * 24 * 3600.0, "query": 24 * 3600.0}
+RECENCY_WEIGHT = 0.2  # share of the retrieval score that comes from recency
+RECENCY_HALF_LIFE = 24 * 3600.0  # seconds until the recency bonus halves
+RECENT_CANDIDATES = 32  # newest memories always reranked, whatever their similarity rank
+DEFAULT_SHARD = "default"
+MAX_RESIDENT_SHARDS = int(os.getenv("MEMORY_MAX_SHARDS", "64"))
+SHARD_KEY_NAME = "shard_key"  # holds the tenant/session a shard directory belongs to
+DEDUP_THRESHOLD = 0.95  # cosine similarity at which a new memory is merged into its nearest neighbour
+DEDUP_CANDIDATES = 4  # nearest same-type neighbours checked for a same-tool near-duplicate
 
 
 class MemoryItem(BaseModel):
     text: str
     type: Literal["preference", "tool_output", "fact", "query", "system"] = "fact"
-    timestamp: Optional[str] = datetime.now().isoformat()
+    timestamp: Optional[str] = Field(default_factory=lambda: datetime.now().isoformat())
     tool_name: Optional[str] = None
     user_query: Optional[str] = None
     tags: List[str] = []
     session_id: Optional[str] = None
+    hit_count: int = 1  # how many times this memory (or a near-duplicate of it) was added
+    merged_sessions: List[str] = []  # other sessions whose duplicates were merged into this memory
+
+
+TYPES = ("preference", "tool_output", "fact", "query", "system")  # MemoryItem.type, stored as uint8 codes
+EPOCH = datetime(1970, 1, 1)
+NO_TIMESTAMP = -1
+
+
+def _to_micros(timestamp: Optional[str]) -> int:
+    """ISO timestamp -> int64 microseconds since the epoch (aware times are taken as UTC)."""
+    if timestamp is None:
+        return NO_TIMESTAMP
+    dt = datetime.fromisoformat(timestamp)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+
+def _digest(text: str, type: str, tool_name: Optional[str]) -> int:
+    """64-bit key for exact-duplicate detection: same text, type and tool."""
+    key = "\0".join((type, tool_name or "", text)).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+def _now_micros() -> int:
+    return (datetime.now() - EPOCH) // timedelta(microseconds=1)
+
+
+def _from_micros(micros: int) -> Optional[str]:
+    return None if micros == NO_TIMESTAMP else (EPOCH + timedelta(microseconds=micros)).isoformat()
+
+
+class StringPool:
+    """Interns repeated strings (sessions, tools, tags) as small ints; None is -1."""
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self.ids: Dict[str, int] = {}
+
+    def intern(self, s: Optional[str]) -> int:
+        if s is None:
+            return -1
+        i = self.ids.get(s)
+        if i is None:
+            i = self.ids[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+    def lookup(self, i: int) -> Optional[str]:
+        return None if i < 0 else self.strings[i]
+
+
+class TextArena:
+    """Append-only UTF-8 buffer holding many strings back to back; None has length -1."""
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.starts = array("q")
+        self.lengths = array("i")
+
+    def append(self, s: Optional[str]):
+        self.starts.append(len(self.buf))
+        if s is None:
+            self.lengths.append(-1)
+            return
+        data = s.encode("utf-8")
+        self.lengths.append(len(data))
+        self.buf += data
+
+    def __getitem__(self, i: int) -> Optional[str]:
+        start, length = self.starts[i], self.lengths[i]
+        return None if length < 0 else self.buf[start:start + length].decode("utf-8")
+
+
+class MemoryTable:
+    """Columnar storage for MemoryItems.
+
+    Each field is a typed array (or a text arena), so a memory costs a few
+    dozen bytes plus its text instead of a Pydantic object, a list and
+    several strings. `table[i]` materializes a MemoryItem on demand.
+    """
+
+    def __init__(self):
+        self.strings = StringPool()
+        self.text = TextArena()
+        self.user_query = TextArena()
+        self.timestamp = array("q")  # microseconds since the epoch
+        self.type = array("B")  # index into TYPES
+        self.session = array("i")  # StringPool ids
+        self.tool = array("i")
+        self.tag_offsets = array("q", [0])  # tags of row i are tag_ids[tag_offsets[i]:tag_offsets[i + 1]]
+        self.tag_ids = array("i")
+        self.hits = array("I")
+        self.merged_sessions: Dict[int, List[int]] = {}  # row -> StringPool ids; sparse, most rows have none
+
+    def __len__(self) -> int:
+        return len(self.type)
+
+    def append(self, text: str, type: str = "fact", timestamp: Optional[str] = None, tool_name: Optional[str] = None,
+               user_query: Optional[str] = None, tags: Sequence[str] = (), session_id: Optional[str] = None,
+               hit_count: int = 1, merged_sessions: Sequence[str] = ()):
+        """Append one memory from its field values (MemoryItem field names)."""
+        self.text.append(text)
+        self.user_query.append(user_query)
+        self.timestamp.append(_to_micros(timestamp))
+        self.type.append(TYPES.index(type))
+        self.session.append(self.strings.intern(session_id))
+        self.tool.append(self.strings.intern(tool_name))
+        self.tag_ids.extend(self.strings.intern(tag) for tag in tags)
+        self.tag_offsets.append(len(self.tag_ids))
+        self.hits.append(hit_count)
+        if merged_sessions:
+            self.merged_sessions[len(self) - 1] = [self.strings.intern(s) for s in merged_sessions]
+
+    def append_item(self, item: "MemoryItem"):
+        self.append(item.text, item.type, item.timestamp, item.tool_name, item.user_query, item.tags, item.session_id,
+                    item.hit_count, item.merged_sessions)
+
+    def merge(self, i: int, timestamp: Optional[str], hit_count: int = 1,
+              sessions: Sequence[Optional[str]] = ()) -> List[str]:
+        """Fold a duplicate into row i: add its hits, keep the later timestamp and note its sessions.
+
+        Returns the sessions row i was not yet recorded under.
+        """
+        self.hits[i] += hit_count
+        self.timestamp[i] = max(self.timestamp[i], _to_micros(timestamp))
+        added = []
+        for session_id in sessions:
+            if session_id is None or session_id in self.sessions(i):
+                continue
+            self.merged_sessions.setdefault(i, []).append(self.strings.intern(session_id))
+            added.append(session_id)
+        return added
+
+    def type_name(self, i: int) -> str:
+        return TYPES[self.type[i]]
+
+    def session_id(self, i: int) -> Optional[str]:
+        return self.strings.lookup(self.session[i])
+
+    def tool_name(self, i: int) -> Optional[str]:
+        return self.strings.lookup(self.tool[i])
+
+    def sessions(self, i: int) -> List[str]:
+        """Every session row i belongs to: its own plus those merged into it."""
+        merged = [self.strings.strings[s] for s in self.merged_sessions.get(i, ())]
+        own = self.session_id(i)
+        return merged if own is None else [own] + merged
+
+    def tags(self, i: int) -> List[str]:
+        return [self.strings.strings[t] for t in self.tag_ids[self.tag_offsets[i]:self.tag_offsets[i + 1]]]
+
+    def record(self, i: int) -> dict:
+        """Field values of row i, keyed like MemoryItem."""
+        return dict(
+            text=self.text[i],
+            type=self.type_name(i),
+            timestamp=_from_micros(self.timestamp[i]),
+            tool_name=self.tool_name(i),
+            user_query=self.user_query[i],
+            tags=self.tags(i),
+            session_id=self.session_id(i),
+            hit_count=self.hits[i],
+            merged_sessions=[self.strings.strings[s] for s in self.merged_sessions.get(i, ())],
+        )
+
+    def take(self, rows: Sequence[int]) -> "MemoryTable":
+        """New table holding only `rows`, in order."""
+        table = MemoryTable()
+        for i in rows:
+            table.append(**self.record(int(i)))
+        return table
+
+    def nbytes(self) -> int:
+        """Bytes held by the columns, arenas and interned strings."""
+        columns = [self.text.starts, self.text.lengths, self.user_query.starts, self.user_query.lengths,
+                   self.timestamp, self.type, self.session, self.tool, self.tag_offsets, self.tag_ids, self.hits]
+        return (sum(len(c) * c.itemsize for c in columns) + len(self.text.buf) + len(self.user_query.buf)
+                + sum(len(s) for s in self.strings.strings))
+
+    def timestamps(self) -> np.ndarray:
+        """Copy of the timestamp column as int64 microseconds."""
+        return np.array(self.timestamp, dtype=np.int64)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        # Fields were validated on the way in; skip re-validation
+        return MemoryItem.model_construct(**self.record(int(i)))
 
 
 class MemoryManager:
-    def __init__(self, embedding_model_url="http://localhost:11434/api/embeddings", model_name="nomic-embed-text"):
+    """Agent memory searchable by cosine similarity.
+
+    With a `path`, memories persist across runs. Items and raw embeddings
+    are append-only files flushed by `save`, either explicitly or from a
+    background thread (`start_autoflush`). `load` memory-maps the embedding
+    matrix and rebuilds the flat index from it, so a save never rewrites
+    the whole index.
+
+    Memories older than their type's `ttl` are evicted by `compact`, which
+    can also run in the background (`start_compactor`).
+
+    Adding a memory that repeats one already stored (same text, or cosine
+    similarity of at least `dedup_threshold`, with the same type and tool)
+    bumps that memory's hit count and timestamp instead of adding a row, so
+    repetitive tool calls do not grow the index. Sessions are not part of
+    the key: the merged memory is recorded under every session that added
+    it, so `session_filter` still finds it.
+
+    `aadd`, `aretrieve` and `abulk_add` are coroutine versions for async
+    callers: embedding requests are awaited on the client's pooled async
+    HTTP connection, so concurrent agent sessions overlap them.
+    """
+
+    def __init__(self, embedding_model_url="http://localhost:11434/api/embeddings", model_name="nomic-embed-text",
+                 path: Optional[Path] = None, ttl: Optional[Dict[str, float]] = None,
+                 dedup_threshold: Optional[float] = DEDUP_THRESHOLD):
         self.embedding_model_url = embedding_model_url
         self.model_name = model_name
+        self.client = get_client(embedding_model_url, model_name)
         self.index = None
-        self.data: List[MemoryItem] = []
-        self.embeddings: List[np.ndarray] = []
+        self.data = MemoryTable()
+        self._buffer: Optional[np.ndarray] = None  # (capacity, dim) float32; rows [0, len(data)) are live
+        # Memory ids per filter value, kept in step with self.data so filters never scan items
+        self.session_ids: Dict[str, array] = defaultdict(lambda: array("q"))
+        self.type_ids: Dict[str, array] = defaultdict(lambda: array("q"))
+        self.tag_ids: Dict[str, array] = defaultdict(lambda: array("q"))
+        self.ttl = DEFAULT_TTL if ttl is None else ttl
+        self.dedup_threshold = dedup_threshold  # None merges exact duplicates only
+        self._digests: Dict[int, int] = {}  # _digest of each memory -> its id
+        self.path = Path(path) if path is not None else None
+        self._lock = threading.RLock()
+        self._saved = 0  # memories already on disk
+        self._merged = set()  # saved memories whose hit count or timestamp changed since the last save
+        self._files = (ITEMS_NAME, EMBEDDINGS_NAME)
+        self._generation = 0
+        self._rewrite = False  # set by compact: the next save writes fresh files
+        self._stop = threading.Event()
+        self._workers: Dict[str, threading.Thread] = {}
+        if self.path is not None and (self.path / META_NAME).exists():
+            self.load()
+
+    def nbytes(self) -> int:
+        """Approximate RAM held: embedding buffer (a memmap counts in full), index vectors and item columns."""
+        buffer = 0 if self._buffer is None else self._buffer.nbytes
+        index = 0 if self.index is None else self.index.ntotal * self.index.d * 4
+        return buffer + index + self.data.nbytes()
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """(n, dim) float32 view of the raw embeddings, one row per memory."""
+        if self._buffer is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._buffer[:len(self.data)]
 
     def _get_embedding(self, text: str) -> np.ndarray:
-        response = requests.post(
-            self.embedding_model_url,
-            json={"model": self.model_name, "prompt": text}
-        )
-        response.raise_for_status()
-        return np.array(response.json()["embedding"], dtype=np.float32)
+        return self.client.embed(text)
+
+    def _get_embeddings(self, texts: List[str]) -> np.ndarray:
+        return self.client.embed_many(texts)
 
-    def add(self, item: MemoryItem):
-        emb = self._get_embedding(item.text)
-        self.embeddings.append(emb)
-        self.data.append(item)
+    def _append_embeddings(self, embs: np.ndarray):
+        n = len(self.data)
+        if self._buffer is None:
+            self._buffer = np.empty((max(INITIAL_CAPACITY, len(embs)), embs.shape[1]), dtype=np.float32)
+        elif n + len(embs) > len(self._buffer):
+            # Amortized growth: copy once per doubling, not once per memory
+            grown = np.empty((max(2 * len(self._buffer), n + len(embs)), self._buffer.shape[1]), dtype=np.float32)
+            grown[:n] = self._buffer[:n]
+            self._buffer = grown
+        self._buffer[n:n + len(embs)] = embs
 
-        # Initialize or add to index
-        if self.index is None:
-            self.index = faiss.IndexFlatL2(len(emb))
-        self.index.add(np.stack([emb]))
+    def _index_items(self, items: List[MemoryItem], embs: np.ndarray) -> List[int]:
+        """Store, index and record filter ids for items whose embeddings are the rows of `embs`.
 
-    def retrieve(
+        Duplicates are merged rather than stored; returns the memory id each item ended up in.
+        """
+        with self._lock:
+            vecs = normalize(embs)
+            near = self._near_duplicates(items, vecs)
+            start = len(self.data)
+            fresh, targets, batch = [], [], {}
+            for i, item in enumerate(items):
+                key = _digest(item.text, item.type, item.tool_name)
+                target = self._digests.get(key)
+                if target is not None and self.data.text[target] != item.text:
+                    target = None  # digest collision
+                if target is None:
+                    target = batch.get(key, near[i])
+                if target is None:
+                    target = start + len(fresh)
+                    fresh.append(i)
+                batch.setdefault(key, target)
+                targets.append(target)
+
+            if fresh:
+                self._append_embeddings(embs[fresh])
+                # Initialize or add to index; normalized vectors make inner product a cosine score
+                if self.index is None:
+                    self.index = faiss.IndexFlatIP(embs.shape[1])
+                self.index.add(vecs[fresh])
+            # New ids are handed out in item order, so each one is appended before anything merges into it
+            for item, target in zip(items, targets):
+                if target == len(self.data):
+                    self.data.append_item(item)
+                else:
+                    added = self.data.merge(target, item.timestamp, item.hit_count,
+                                            [item.session_id, *item.merged_sessions])
+                    if target < start:
+                        for session_id in added:
+                            self.session_ids[session_id].append(target)
+                    if target < self._saved:
+                        self._merged.add(target)
+            self._record_ids(start)
+            return targets
+
+    def _near_duplicates(self, items: List[MemoryItem], vecs: np.ndarray) -> List[Optional[int]]:
+        """Per item, the id of a stored memory of the same type and tool at least `dedup_threshold` similar.
+
+        Each type is searched through its own id bitmap, so memories of other
+        types never crowd the candidates out.
+        """
+        matches: List[Optional[int]] = [None] * len(items)
+        if self.dedup_threshold is None or self.index is None or self.index.ntotal == 0:
+            return matches
+        rows_by_type: Dict[str, List[int]] = defaultdict(list)
+        for i, item in enumerate(items):
+            rows_by_type[item.type].append(i)
+        for type_name, rows in rows_by_type.items():
+            mask = self._filter_mask(type_filter=type_name)
+            if not mask.any():
+                continue
+            bitmap = np.packbits(mask, bitorder="little")
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap)))
+            D, I = self.index.search(vecs[rows], min(DEDUP_CANDIDATES, self.index.ntotal), params=params)
+            for row, scores, ids in zip(rows, D, I):
+                for score, idx in zip(scores, ids):
+                    if idx < 0 or score < self.dedup_threshold:
+                        break
+                    if self.data.tool_name(idx) == items[row].tool_name:
+                        matches[row] = int(idx)
+                        break
+        return matches
+
+    def _record_ids(self, start: int):
+        for memory_id in range(start, len(self.data)):
+            self._digests[_digest(self.data.text[memory_id], self.data.type_name(memory_id),
+                                  self.data.tool_name(memory_id))] = memory_id
+            self.type_ids[self.data.type_name(memory_id)].append(memory_id)
+            for tag in set(self.data.tags(memory_id)):
+                self.tag_ids[tag].append(memory_id)
+            for session_id in self.data.sessions(memory_id):
+                self.session_ids[session_id].append(memory_id)
+
+    def add(self, item: MemoryItem) -> int:
+        """Add one memory, or merge it into a stored duplicate; returns its memory id."""
+        return self._index_items([item], self._get_embedding(item.text)[None, :])[0]
+
+    async def aadd(self, item: MemoryItem) -> int:
+        """Coroutine version of `add`: awaits the embedding, then indexes in a worker thread."""
+        emb = await self.client.aembed(item.text)
+        return (await asyncio.to_thread(self._index_items, [item], emb[None, :]))[0]
+
+    def _filter_mask(
         self,
-        query: str,
-        top_k: int = 3,
         type_filter: Optional[str] = None,
         tag_filter: Optional[List[str]] = None,
         session_filter: Optional[str] = None
-    ) -> List[MemoryItem]:
-        if not self.index or len(self.data) == 0:
+    ) -> Optional[np.ndarray]:
+        """Boolean mask over memory ids matching every given filter (any of the tags), or None if unfiltered."""
+        groups = []
+        if type_filter:
+            groups.append([self.type_ids.get(type_filter)])
+        if tag_filter:
+            groups.append([self.tag_ids.get(tag) for tag in tag_filter])
+        if session_filter:
+            groups.append([self.session_ids.get(session_filter)])
+
+        mask = None
+        for id_sets in groups:
+            allowed = np.zeros(len(self.data), dtype=bool)
+            for ids in id_sets:
+                if ids:
+                    allowed[np.frombuffer(ids, dtype=np.int64)] = True
+            mask = allowed if mask is None else mask & allowed
+        return mask
+
+    def retrieve(self, query: str, top_k: int = 3, **kwargs) -> List[Tuple[MemoryItem, float]]:
+        """Embed `query` and return up to top_k (item, score) pairs, best first (see `retrieve_vector`)."""
+        return self.retrieve_vector(normalize(self._get_embedding(query)), top_k, **kwargs)
+
+    async def aretrieve(self, query: str, top_k: int = 3, **kwargs) -> List[Tuple[MemoryItem, float]]:
+        """Coroutine version of `retrieve`; the search runs in a worker thread, off the event loop."""
+        query_vec = normalize(await self.client.aembed(query))
+        return await asyncio.to_thread(self.retrieve_vector, query_vec, top_k, **kwargs)
+
+    def retrieve_vector(
+        self,
+        query_vec: np.ndarray,
+        top_k: int = 3,
+        type_filter: Optional[str] = None,
+        tag_filter: Optional[List[str]] = None,
+        session_filter: Optional[str] = None,
+        min_score: Optional[float] = MEMORY_MIN_SCORE,
+        max_gap: Optional[float] = None,
+        recency_weight: float = RECENCY_WEIGHT,
+        half_life: float = RECENCY_HALF_LIFE
+    ) -> List[Tuple[MemoryItem, float]]:
+        """Return up to top_k (item, score) pairs for a normalized (1, dim) query, dropping weak matches.
+
+        Filters are applied inside the FAISS search with an id bitmap, so the
+        top_k are exact among the matching memories however few there are.
+        `min_score` gates on cosine similarity. The returned score blends
+        similarity with a recency bonus that halves every `half_life`
+        seconds. The newest memories are reranked along with the nearest
+        ones, so a fresh tool output can win without a scan.
+        """
+        with self._lock:
+            if self.index is None or len(self.data) == 0:
+                return []
+
+            params = None
+            mask = self._filter_mask(type_filter, tag_filter, session_filter)
+            if mask is not None:
+                if not mask.any():
+                    return []
+                bitmap = np.packbits(mask, bitorder="little")
+                params = faiss.SearchParameters(sel=faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap)))
+
+            D, I = self.index.search(query_vec, top_k * 2 if recency_weight else top_k, params=params)
+            candidates = {int(idx): float(score) for idx, score in zip(I[0], D[0]) if idx >= 0}
+            if recency_weight:
+                # Ids are in insertion order, so the newest memories are the last ids
+                recent = np.arange(max(0, len(self.data) - RECENT_CANDIDATES), len(self.data))
+                if mask is not None:
+                    recent = recent[mask[recent]]
+                if len(recent):
+                    for idx, score in zip(recent, normalize(self.embeddings[recent]) @ query_vec[0]):
+                        candidates.setdefault(int(idx), float(score))
+            if min_score is not None:
+                candidates = {idx: score for idx, score in candidates.items() if score >= min_score}
+            if not candidates:
+                return []
+
+            ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            scores = np.fromiter(candidates.values(), dtype=np.float64, count=len(candidates))
+            if recency_weight:
+                scores = (1 - recency_weight) * scores + recency_weight * self._recency(ids, half_life)
+            hits = select_hits(list(zip(ids.tolist(), scores.tolist())), top_k, None, max_gap)
+            return [(self.data[idx], score) for idx, score in hits]
+
+    def _recency(self, ids: np.ndarray, half_life: float) -> np.ndarray:
+        """1.0 for a memory written now, halving every `half_life` seconds; 0.0 without a timestamp."""
+        # Zero-copy view of the column; the fancy index copies only the candidates' stamps
+        stamps = np.frombuffer(self.data.timestamp, dtype=np.int64)[ids]
+        age = np.maximum(_now_micros() - stamps, 0) / 1e6
+        return np.where(stamps == NO_TIMESTAMP, 0.0, 0.5 ** (age / half_life))
+
+    def _expired(self) -> np.ndarray:
+        """Boolean mask of memories older than their type's TTL."""
+        stamps = self.data.timestamps()
+        types = np.array(self.data.type, dtype=np.uint8)
+        expired = np.zeros(len(stamps), dtype=bool)
+        now = _now_micros()
+        for type_name, ttl in self.ttl.items():
+            if ttl is not None:
+                expired |= (types == TYPES.index(type_name)) & (stamps != NO_TIMESTAMP) & (stamps < now - ttl * 1e6)
+        return expired
+
+    def compact(self) -> int:
+        """Evict expired memories, rebuilding the table, index and filter id sets; returns how many went."""
+        with self._lock:
+            if len(self.data) == 0:
+                return 0
+            expired = self._expired()
+            evicted = int(expired.sum())
+            if not evicted:
+                return 0
+            keep = np.flatnonzero(~expired)
+            dim = self.index.d
+            self._buffer = np.array(self.embeddings[keep], dtype=np.float32).reshape(-1, dim)
+            self.data = self.data.take(keep)
+            self.index = faiss.IndexFlatIP(dim)
+            if len(keep):
+                self.index.add(normalize(self._buffer))
+            self.session_ids.clear()
+            self.type_ids.clear()
+            self.tag_ids.clear()
+            self._digests.clear()
+            self._record_ids(0)
+            # Surviving rows moved, so the append-only files are rewritten on the next save
+            self._saved = 0
+            self._merged.clear()
+            self._rewrite = True
+            return evicted
+
+    def bulk_add(self, items: List[MemoryItem]) -> List[int]:
+        """Embed all items in one batched call and index them as a single matrix; returns their memory ids."""
+        items = list(items)
+        if not items:
             return []
+        return self._index_items(items, self._get_embeddings([item.text for item in items]))
 
-        query_vec = self._get_embedding(query).reshape(1, -1)
-        D, I = self.index.search(query_vec, top_k * 2)  # Overfetch to allow filtering
+    async def abulk_add(self, items: List[MemoryItem]) -> List[int]:
+        """Coroutine version of `bulk_add`."""
+        items = list(items)
+        if not items:
+            return []
+        embs = await self.client.aembed_many([item.text for item in items])
+        return await asyncio.to_thread(self._index_items, items, embs)
 
-        results = []
-        for idx in I[0]:
-            if idx >= len(self.data):
-                continue
-            item = self.data[idx]
+    def save(self):
+        """Write memories added since the last save to `path`, then commit them in meta.json.
 
-            # Filter by type
-            if type_filter and item.type != type_filter:
-                continue
+        Normally this appends to the current files; hit counts merged into
+        already-saved memories are appended as small update records. After
+        a compaction it writes a new generation of files and removes the
+        old ones once meta.json points at the new ones.
+        """
+        if self.path is None:
+            return
+        with self._lock:
+            count = len(self.data)
+            if self.index is None or (count == self._saved and not self._rewrite and not self._merged):
+                return
+            self.path.mkdir(parents=True, exist_ok=True)
+            old_files = self._files
+            if self._rewrite:
+                self._generation += 1
+                files = (f"items.{self._generation}.jsonl", f"embeddings.{self._generation}.f32")
+                mode = "w"
+            else:
+                files, mode = old_files, "a"
+            updates = [] if self._rewrite else sorted(self._merged)
+            with open(self.path / files[0], mode, encoding="utf-8") as f:
+                f.write("".join(json.dumps({"row": i, "hit_count": self.data.hits[i],
+                                            "timestamp": _from_micros(self.data.timestamp[i]),
+                                            "merged_sessions": self.data.record(i)["merged_sessions"]}) + "\n"
+                                for i in updates))
+                f.write("".join(json.dumps(self.data.record(i)) + "\n" for i in range(self._saved, count)))
+                items_bytes = f.tell()
+            with open(self.path / files[1], mode + "b") as f:
+                f.write(np.ascontiguousarray(self.embeddings[self._saved:count]).tobytes())
+            # A flat index is just the normalized embeddings, so load rebuilds it from the memmap;
+            # only an index that cost training or graph building is worth writing out
+            if not isinstance(self.index, faiss.IndexFlat):
+                if count != self._saved or self._rewrite:
+                    write_index_atomic(self.index, self.path / INDEX_NAME)
+            else:
+                (self.path / INDEX_NAME).unlink(missing_ok=True)
+            meta = {"count": count, "dim": self.index.d, "items_bytes": items_bytes,
+                    "items": files[0], "embeddings": files[1], "generation": self._generation}
+            write_text_atomic(self.path / META_NAME, json.dumps(meta))
+            if files != old_files:
+                for name in old_files:
+                    (self.path / name).unlink(missing_ok=True)
+            self._files = files
+            self._saved = count
+            self._merged.clear()
+            self._rewrite = False
 
-            # Filter by tags
-            if tag_filter and not any(tag in item.tags for tag in tag_filter):
-                continue
+    def load(self):
+        """Load memories saved under `path`, dropping anything written after the last commit."""
+        meta = json.loads((self.path / META_NAME).read_text())
+        count, dim = meta["count"], meta["dim"]
+        files = (meta.get("items", ITEMS_NAME), meta.get("embeddings", EMBEDDINGS_NAME))
+        items_file, embeddings_file = self.path / files[0], self.path / files[1]
+        # A crash between the appends and meta.json leaves a tail that must not be reused
+        os.truncate(items_file, meta["items_bytes"])
+        os.truncate(embeddings_file, count * dim * 4)
 
-            # Filter by session
-            if session_filter and item.session_id != session_filter:
-                continue
+        with self._lock:
+            with open(items_file, encoding="utf-8") as f:
+                self.data = MemoryTable()
+                for line in f:
+                    record = json.loads(line)
+                    if "row" in record:  # a later duplicate merged into an earlier memory
+                        self.data.hits[record["row"]] = record["hit_count"]
+                        self.data.timestamp[record["row"]] = _to_micros(record["timestamp"])
+                        self.data.merge(record["row"], None, 0, record.get("merged_sessions", ()))
+                    else:
+                        self.data.append(**record)
+            # Read-only mapping; the first add copies it into a growable buffer
+            self._buffer = np.memmap(embeddings_file, dtype=np.float32, mode="r", shape=(count, dim)) if count else None
+            index_file = self.path / INDEX_NAME
+            self.index = faiss.read_index(str(index_file)) if index_file.exists() else None
+            if self.index is None or self.index.ntotal != count:
+                self.index = faiss.IndexFlatIP(dim)
+                if count:
+                    self.index.add(normalize(self._buffer))
+            self.session_ids.clear()
+            self.type_ids.clear()
+            self.tag_ids.clear()
+            self._digests.clear()
+            self._record_ids(0)
+            self._saved = count
+            self._merged.clear()
+            self._files = files
+            self._generation = meta.get("generation", 0)
+
+    def _start_worker(self, name: str, interval: float, job):
+        if name in self._workers:
+            return
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    job()
+                except Exception as e:
+                    print(f"[memory] Background {name} failed: {e}")
+
+        self._workers[name] = threading.Thread(target=loop, name=f"memory-{name}", daemon=True)
+        self._workers[name].start()
+
+    def start_autoflush(self, interval: float = FLUSH_INTERVAL):
+        """Save new memories every `interval` seconds on a daemon thread."""
+        if self.path is not None:
+            self._start_worker("flush", interval, self.save)
+
+    def start_compactor(self, interval: float = COMPACT_INTERVAL):
+        """Evict expired memories every `interval` seconds on a daemon thread."""
+        self._start_worker("compact", interval, self.compact)
 
-            results.append(item)
-            if len(results) >= top_k:
+    def close(self):
+        """Stop the background workers and save whatever is still pending."""
+        self._stop.set()
+        for worker in self._workers.values():
+            worker.join()
+        self._workers.clear()
+        self.save()
+
+
+def _shard_dir_name(key: str) -> str:
+    """Filesystem-safe, collision-free directory name for a shard key."""
+    safe = re.sub(r"[^A-Za-z0-9_.-]", "_", key)[:48]
+    return f"{safe}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]}"
+
+
+class ShardedMemoryManager:
+    """One MemoryManager per tenant (or session), each persisted in its own directory under `root`.
+
+    A shard is loaded on first use. Once more than `max_resident` are in
+    RAM, the least recently used idle shard is saved and dropped. Loads and
+    eviction saves happen outside the manager lock, so a slow shard only
+    holds up callers of that same shard. Queries
+    search only their own shard unless `cross_shard` is asked for, so one
+    tenant's growth does not slow the others. `stats` reports shard count,
+    resident bytes and load latency.
+    """
+
+    def __init__(self, root: Path, embedding_model_url="http://localhost:11434/api/embeddings",
+                 model_name="nomic-embed-text", max_resident: int = MAX_RESIDENT_SHARDS,
+                 ttl: Optional[Dict[str, float]] = None):
+        self.root = Path(root)
+        self.embedding_model_url = embedding_model_url
+        self.model_name = model_name
+        self.client = get_client(embedding_model_url, model_name)
+        self.max_resident = max(1, max_resident)
+        self.ttl = ttl
+        self._shards: "OrderedDict[str, MemoryManager]" = OrderedDict()  # resident, least recently used first
+        self._pins: Dict[str, int] = defaultdict(int)
+        self._pending: Dict[str, threading.Event] = {}  # shards being loaded, or saved after eviction
+        self._lock = threading.RLock()  # guards the bookkeeping only; loads and saves run outside it
+        self._stop = threading.Event()
+        self._workers: Dict[str, threading.Thread] = {}
+        self.loads = 0
+        self.evictions = 0
+        self._load_ms_total = 0.0
+        self._load_ms_max = 0.0
+        self._adopt_unsharded()
+
+    def _adopt_unsharded(self):
+        """Move a single-manager layout saved directly in `root` into the default shard."""
+        if not (self.root / META_NAME).exists():
+            return
+        shard_dir = self.root / _shard_dir_name(DEFAULT_SHARD)
+        shard_dir.mkdir(parents=True, exist_ok=True)
+        for path in list(self.root.iterdir()):
+            if path.is_file():
+                shutil.move(str(path), str(shard_dir / path.name))
+        (shard_dir / SHARD_KEY_NAME).write_text(DEFAULT_SHARD, encoding="utf-8")
+
+    def shard_keys(self) -> List[str]:
+        """Keys of every shard, on disk or resident."""
+        keys = set(self._shards)
+        if self.root.exists():
+            keys.update(p.read_text(encoding="utf-8") for p in self.root.glob(f"*/{SHARD_KEY_NAME}"))
+        return sorted(keys)
+
+    def _load(self, key: str) -> MemoryManager:
+        start = time.perf_counter()
+        shard_dir = self.root / _shard_dir_name(key)
+        shard_dir.mkdir(parents=True, exist_ok=True)
+        (shard_dir / SHARD_KEY_NAME).write_text(key, encoding="utf-8")
+        memory = MemoryManager(self.embedding_model_url, self.model_name, path=shard_dir, ttl=self.ttl)
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.loads += 1
+            self._load_ms_total += elapsed
+            self._load_ms_max = max(self._load_ms_max, elapsed)
+        return memory
+
+    def _evict_idle(self) -> List[Tuple[str, MemoryManager]]:
+        """Unlink idle shards beyond `max_resident`, least recently used first; call with the lock held.
+
+        Each evicted key stays pending until `_close_evicted` has saved it, so
+        a reload waits for the save instead of reading stale files.
+        """
+        evicted = []
+        for key in list(self._shards):
+            if len(self._shards) <= self.max_resident:
                 break
+            if not self._pins[key]:
+                self._pending[key] = threading.Event()
+                evicted.append((key, self._shards.pop(key)))
+                self.evictions += 1
+        return evicted
+
+    def _close_evicted(self, evicted: List[Tuple[str, MemoryManager]]):
+        for key, memory in evicted:
+            try:
+                memory.close()
+            finally:
+                with self._lock:
+                    self._pending.pop(key).set()
+
+    @contextmanager
+    def _use(self, key: str):
+        """Yield the shard for `key`, loading it if needed and keeping it resident until released.
+
+        Under the lock a missing shard only gets a pending Event; the load
+        runs outside it, and other callers of the same key wait on the Event.
+        """
+        while True:
+            with self._lock:
+                memory = self._shards.get(key)
+                pending = self._pending.get(key) if memory is None else None
+                if pending is None:
+                    self._pins[key] += 1
+                    if memory is None:
+                        loading = self._pending[key] = threading.Event()
+                    break
+            pending.wait()
+
+        if memory is None:
+            try:
+                memory = self._load(key)
+            except BaseException:
+                with self._lock:
+                    self._pins[key] -= 1
+                    del self._pending[key]
+                loading.set()
+                raise
+            with self._lock:
+                self._shards[key] = memory
+                del self._pending[key]
+            loading.set()
+        with self._lock:
+            self._shards.move_to_end(key)
+            evicted = self._evict_idle()
+        self._close_evicted(evicted)
+        try:
+            yield memory
+        finally:
+            with self._lock:
+                self._pins[key] -= 1
+                evicted = self._evict_idle()
+            self._close_evicted(evicted)
+
+    @staticmethod
+    def _key(tenant: Optional[str], session_id: Optional[str]) -> str:
+        return tenant or session_id or DEFAULT_SHARD
+
+    def add(self, item: MemoryItem, tenant: Optional[str] = None) -> int:
+        """Add to the tenant's shard, or the item's session shard when no tenant is given; returns its id there."""
+        with self._use(self._key(tenant, item.session_id)) as memory:
+            return memory.add(item)
+
+    async def aadd(self, item: MemoryItem, tenant: Optional[str] = None) -> int:
+        """Coroutine version of `add`: awaits the embedding, then loads the shard and indexes in a worker thread."""
+        emb = await self.client.aembed(item.text)
+
+        def index():
+            with self._use(self._key(tenant, item.session_id)) as memory:
+                return memory._index_items([item], emb[None, :])[0]
+
+        return await asyncio.to_thread(index)
+
+    def _index_grouped(self, items: List[MemoryItem], embs: np.ndarray, tenant: Optional[str]):
+        groups: Dict[str, List[int]] = defaultdict(list)
+        for i, item in enumerate(items):
+            groups[self._key(tenant, item.session_id)].append(i)
+        for key, rows in groups.items():
+            with self._use(key) as memory:
+                memory._index_items([items[i] for i in rows], embs[rows])
+
+    def bulk_add(self, items: List[MemoryItem], tenant: Optional[str] = None):
+        items = list(items)
+        if items:
+            self._index_grouped(items, self.client.embed_many([item.text for item in items]), tenant)
+
+    async def abulk_add(self, items: List[MemoryItem], tenant: Optional[str] = None):
+        """Coroutine version of `bulk_add`."""
+        items = list(items)
+        if items:
+            embs = await self.client.aembed_many([item.text for item in items])
+            await asyncio.to_thread(self._index_grouped, items, embs, tenant)
+
+    def retrieve(self, query: str, top_k: int = 3, tenant: Optional[str] = None, cross_shard: bool = False,
+                 **kwargs) -> List[Tuple[MemoryItem, float]]:
+        """Search the tenant's (or `session_filter`'s) shard; with `cross_shard`, every shard.
+
+        A cross-shard search loads each shard in turn, so it costs as much
+        as the whole store and can evict resident shards.
+        """
+        return self._retrieve_vector(normalize(self.client.embed(query)), top_k, tenant, cross_shard, **kwargs)
+
+    async def aretrieve(self, query: str, top_k: int = 3, tenant: Optional[str] = None, cross_shard: bool = False,
+                        **kwargs) -> List[Tuple[MemoryItem, float]]:
+        """Coroutine version of `retrieve`; shard loads and searches run in a worker thread."""
+        query_vec = normalize(await self.client.aembed(query))
+        return await asyncio.to_thread(self._retrieve_vector, query_vec, top_k, tenant, cross_shard, **kwargs)
+
+    def _retrieve_vector(self, query_vec: np.ndarray, top_k: int, tenant: Optional[str], cross_shard: bool,
+                         **kwargs) -> List[Tuple[MemoryItem, float]]:
+        if not cross_shard:
+            with self._use(self._key(tenant, kwargs.get("session_filter"))) as memory:
+                return memory.retrieve_vector(query_vec, top_k, **kwargs)
+
+        hits = []
+        for key in self.shard_keys():
+            with self._use(key) as memory:
+                hits.extend(memory.retrieve_vector(query_vec, top_k, **kwargs))
+        return select_hits(hits, top_k, None, kwargs.get("max_gap"))
+
+    def save(self):
+        with self._lock:
+            shards = list(self._shards.values())
+        for memory in shards:
+            memory.save()
+
+    def compact(self) -> int:
+        with self._lock:
+            shards = list(self._shards.values())
+        return sum(memory.compact() for memory in shards)
+
+    def stats(self) -> dict:
+        """Shard count, resident shards and bytes, and shard load latency."""
+        with self._lock:
+            return {
+                "shards": len(self.shard_keys()),
+                "resident_shards": len(self._shards),
+                "resident_bytes": sum(memory.nbytes() for memory in self._shards.values()),
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "load_ms_avg": self._load_ms_total / self.loads if self.loads else 0.0,
+                "load_ms_max": self._load_ms_max,
+            }
+
+    def _start_worker(self, name: str, interval: float, job):
+        if name in self._workers:
+            return
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    job()
+                except Exception as e:
+                    print(f"[memory] Background {name} failed: {e}")
+
+        self._workers[name] = threading.Thread(target=loop, name=f"memory-shards-{name}", daemon=True)
+        self._workers[name].start()
+
+    def start_autoflush(self, interval: float = FLUSH_INTERVAL):
+        """Save every resident shard every `interval` seconds on one daemon thread."""
+        self._start_worker("flush", interval, self.save)
 
-        return results
+    def start_compactor(self, interval: float = COMPACT_INTERVAL):
+        """Evict expired memories from every resident shard every `interval` seconds."""
+        self._start_worker("compact", interval, self.compact)
 
-    def bulk_add(self, items: List[MemoryItem]):
-        for item in items:
-            self.add(item)
+    def close(self):
+        """Stop the background workers and save and release every resident shard."""
+        self._stop.set()
+        for worker in self._workers.values():
+            worker.join()
+        self._workers.clear()
+        with self._lock:
+            pending = list(self._pending.values())
+        for event in pending:
+            event.wait()
+        with self._lock:
+            while self._shards:
+                self._shards.popitem(last=False)[1].close()
@@ -0,0 +1,198 @@
+# session_pool.py
+
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Callable, List, Optional
+
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+
+# Put on the idle queue when a slot is discarded, so a waiting acquirer wakes up and spawns into the freed room
+_FREED = object()
+
+
+class _Slot:
+    """One tool-server subprocess and its initialized session, owned by a single holder task."""
+
+    def __init__(self):
+        self.session: Optional[ClientSession] = None
+        self.ready = asyncio.Event()
+        self.closing = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.error: Optional[BaseException] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and self.task is not None and not self.task.done()
+
+
+class MCPSessionPool:
+    """Long-lived pool of initialized MCP client sessions for synchronous (Flask) callers.
+
+    A private event loop runs on a background thread. Sessions are spawned on
+    demand up to `size`, pinged before reuse and by a periodic health check,
+    and respawned when their server dies. The tool list is fetched once and
+    shared by every session.
+    """
+
+    def __init__(self, server_params: StdioServerParameters, size: int = 2,
+                 health_interval: float = 30.0, ping_timeout: float = 5.0, acquire_timeout: float = 120.0):
+        self.server_params = server_params
+        self.size = max(1, size)
+        self.health_interval = health_interval
+        self.ping_timeout = ping_timeout
+        self.acquire_timeout = acquire_timeout
+        self.tools: Optional[List[Any]] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._idle: Optional[asyncio.Queue] = None
+        self._slots: List[_Slot] = []
+        self._health_task: Optional[asyncio.Task] = None
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="mcp-session-pool", daemon=True)
+            self._thread.start()
+            asyncio.run_coroutine_threadsafe(self._setup(), self._loop).result()
+
+    async def _setup(self):
+        self._idle = asyncio.Queue()
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def _hold(self, slot: _Slot):
+        # stdio_client/ClientSession must be entered and exited in the same task
+        try:
+            async with stdio_client(self.server_params) as (read, write):
+                async with ClientSession(read, write) as session:
+                    await session.initialize()
+                    if self.tools is None:
+                        self.tools = (await session.list_tools()).tools
+                    slot.session = session
+                    slot.ready.set()
+                    await slot.closing.wait()
+        except BaseException as e:
+            slot.error = e
+        finally:
+            slot.session = None
+            slot.ready.set()
+
+    async def _spawn(self) -> _Slot:
+        slot = _Slot()
+        self._slots.append(slot)
+        slot.task = asyncio.create_task(self._hold(slot))
+        try:
+            await slot.ready.wait()
+        except asyncio.CancelledError:
+            # The acquire timed out mid-start: give the room back and stop the half-started server
+            self._slots.remove(slot)
+            self._idle.put_nowait(_FREED)
+            slot.closing.set()
+            slot.task.cancel()
+            raise
+        if slot.session is None:
+            self._slots.remove(slot)
+            raise RuntimeError(f"Failed to start MCP tool server: {slot.error}")
+        logging.info("MCP session started (%d/%d)", len(self._slots), self.size)
+        return slot
+
+    async def _discard(self, slot: _Slot):
+        if slot in self._slots:
+            self._slots.remove(slot)
+            self._idle.put_nowait(_FREED)
+        slot.closing.set()
+        if slot.task is not None:
+            try:
+                await asyncio.wait_for(slot.task, timeout=self.ping_timeout)
+            except Exception:
+                slot.task.cancel()
+
+    async def _healthy(self, slot: _Slot) -> bool:
+        if not slot.alive:
+            return False
+        try:
+            await asyncio.wait_for(slot.session.send_ping(), timeout=self.ping_timeout)
+            return True
+        except Exception:
+            return False
+
+    async def _acquire(self) -> _Slot:
+        while True:
+            if self._idle.empty() and len(self._slots) < self.size:
+                return await self._spawn()
+            slot = await self._idle.get()
+            if slot is _FREED:
+                continue
+            try:
+                healthy = await self._healthy(slot)
+            except asyncio.CancelledError:
+                # The acquire timed out during the ping; the next acquirer pings the slot again
+                self._idle.put_nowait(slot)
+                raise
+            if healthy:
+                return slot
+            logging.warning("Dropping dead MCP session; respawning")
+            await self._discard(slot)
+
+    async def _release(self, slot: _Slot):
+        if slot.alive:
+            self._idle.put_nowait(slot)
+        else:
+            await self._discard(slot)
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            for _ in range(self._idle.qsize()):
+                slot = self._idle.get_nowait()
+                if slot is _FREED:
+                    continue  # nobody waits while the queue is non-empty
+                if await self._healthy(slot):
+                    self._idle.put_nowait(slot)
+                else:
+                    logging.warning("Health check failed; respawning MCP session")
+                    await self._discard(slot)
+                    if len(self._slots) >= self.size:
+                        continue  # a waiter woken by the discard already took the room
+                    try:
+                        self._idle.put_nowait(await self._spawn())
+                    except Exception as e:
+                        logging.error("MCP session respawn failed: %s", e)
+
+    async def _run(self, fn: Callable[[ClientSession, List[Any]], Awaitable[Any]]):
+        slot = await asyncio.wait_for(self._acquire(), timeout=self.acquire_timeout)
+        try:
+            return await fn(slot.session, self.tools)
+        except Exception:
+            # A transport failure leaves the session unusable; tool errors do not
+            if not await self._healthy(slot):
+                await self._discard(slot)
+                slot = None
+            raise
+        finally:
+            if slot is not None:
+                await self._release(slot)
+
+    def run(self, fn: Callable[[ClientSession, List[Any]], Awaitable[Any]]) -> Any:
+        """Run `fn(session, tools)` on a warm session and block until it returns."""
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(self._run(fn), self._loop).result()
+
+    def close(self):
+        """Shut down every tool server and stop the pool's event loop."""
+        if self._loop is None:
+            return
+
+        async def shutdown():
+            self._health_task.cancel()
+            for slot in list(self._slots):
+                await self._discard(slot)
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
@@ -0,0 +1,79 @@
+"""Tests for MCPSessionPool capacity under acquire timeouts."""
+
+import asyncio
+import contextlib
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import session_pool  # noqa: E402
+from session_pool import MCPSessionPool  # noqa: E402
+
+TIMEOUT = 0.2
+
+
+class FakeServer:
+    """Stands in for the stdio transport and ClientSession; delays are set per test."""
+
+    start_delay = 0.0
+    ping_delay = 0.0
+
+    def __init__(self, read=None, write=None):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def initialize(self):
+        await asyncio.sleep(FakeServer.start_delay)
+
+    async def list_tools(self):
+        return type("Tools", (), {"tools": []})()
+
+    async def send_ping(self):
+        await asyncio.sleep(FakeServer.ping_delay)
+
+
+@contextlib.asynccontextmanager
+async def fake_stdio_client(params):
+    yield None, None
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(session_pool, "stdio_client", fake_stdio_client)
+    monkeypatch.setattr(session_pool, "ClientSession", FakeServer)
+    monkeypatch.setattr(FakeServer, "start_delay", 0.0)
+    monkeypatch.setattr(FakeServer, "ping_delay", 0.0)
+    pool = MCPSessionPool(None, size=1, health_interval=3600, ping_timeout=5, acquire_timeout=TIMEOUT)
+    yield pool
+    pool.close()
+
+
+async def ok(session, tools):
+    return "ok"
+
+
+def test_timeout_during_spawn_frees_the_slot(pool):
+    FakeServer.start_delay = 10 * TIMEOUT
+    for _ in range(3):
+        with pytest.raises((asyncio.TimeoutError, TimeoutError)):
+            pool.run(ok)
+    FakeServer.start_delay = 0.0
+    assert pool.run(ok) == "ok"
+    assert len(pool._slots) == 1
+
+
+def test_timeout_during_ping_returns_the_slot(pool):
+    assert pool.run(ok) == "ok"
+    FakeServer.ping_delay = 2 * TIMEOUT
+    with pytest.raises((asyncio.TimeoutError, TimeoutError)):
+        pool.run(ok)
+    FakeServer.ping_delay = 0.0
+    assert pool.run(ok) == "ok"
+    assert len(pool._slots) == 1
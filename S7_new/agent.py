@@ -3,7 +3,7 @@ import time
 import os
 import datetime
 from perception import extract_perception
-from memory import MemoryManager, MemoryItem
+from memory import MemoryManager, MemoryItem, MEMORY_DIR
 from decision import generate_plan
 from action import execute_tool
 from mcp import ClientSession, StdioServerParameters
@@ -56,7 +56,10 @@ async def main(user_input: str):
 
                             log("agent", f"{len(tools)} tools loaded")
 
-                            memory = MemoryManager()
+                            # Memories from earlier runs are loaded from disk, not rebuilt
+                            memory = MemoryManager(path=MEMORY_DIR)
+                            evicted = memory.compact()
+                            log("memory", f"Loaded {len(memory.data)} memories from previous runs ({evicted} expired)")
                             session_id = f"session-{int(time.time())}"
                             query = user_input  # Store original intent
                             step = 0
@@ -67,10 +70,11 @@ async def main(user_input: str):
                                 perception = extract_perception(user_input)
                                 log("perception", f"Intent: {perception.intent}, Tool hint: {perception.tool_hint}")
 
-                                retrieved = memory.retrieve(query=user_input, top_k=3, session_filter=session_id)
+                                # Not session-filtered: tool outputs from earlier runs can save a repeat call
+                                retrieved = await memory.aretrieve(query=user_input, top_k=3)
                                 log("memory", f"Retrieved {len(retrieved)} relevant memories")
 
-                                plan = generate_plan(perception, retrieved, tool_descriptions=tool_descriptions)
+                                plan = generate_plan(perception, [item for item, _ in retrieved], tool_descriptions=tool_descriptions)
                                 log("plan", f"Plan generated: {plan}")
 
                                 if plan.startswith("FINAL_ANSWER:"):
@@ -78,10 +82,10 @@ async def main(user_input: str):
                                     break
 
                                 try:
-                                    result = await execute_tool(session, tools, plan)
+                                    result = await execute_tool(session, tools, plan, {"entities": perception.entities})
                                     log("tool", f"{result.tool_name} returned: {result.result}")
 
-                                    memory.add(MemoryItem(
+                                    await memory.aadd(MemoryItem(
                                         text=f"Tool call: {result.tool_name} with {result.arguments}, got: {result.result}",
                                         type="tool_output",
                                         tool_name=result.tool_name,
@@ -97,6 +101,8 @@ async def main(user_input: str):
                                     break
 
                                 step += 1
+
+                            memory.save()
                         except Exception as e:
                             print(f"[agent] Session initialization error: {str(e)}")
                 except Exception as e:
@@ -0,0 +1,82 @@
+"""Recall@k vs. query latency for the index modes in index_factory.
+
+Exact Flat search over a synthetic clustered corpus gives the ground truth.
+Each ANN mode is built once and swept over its search-time knob (nprobe
+for IVF, efSearch for HNSW).
+
+Usage: python benchmarks/bench_ann.py [--vectors 1000000] [--dim 128] [--queries 200] [--k 10]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from index_factory import INDEX_MODES, build_index, populate  # noqa: E402
+
+SWEEPS = {"flat": [None], "ivf": [1, 4, 16, 64], "ivfpq": [1, 4, 16, 64], "hnsw": [16, 32, 64, 128]}
+
+
+def synthetic_corpus(n: int, dim: int, n_queries: int):
+    """Gaussian blobs, so neighbourhoods have structure an ANN index can exploit."""
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((max(1, n // 1000), dim)).astype(np.float32) * 4
+    corpus = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 100_000):
+        end = min(n, start + 100_000)
+        corpus[start:end] = centers[rng.integers(len(centers), size=end - start)]
+        corpus[start:end] += rng.standard_normal((end - start, dim)).astype(np.float32)
+    queries = centers[rng.integers(len(centers), size=n_queries)] + rng.standard_normal((n_queries, dim)).astype(np.float32)
+    return corpus, queries
+
+
+def set_knob(index, mode: str, value):
+    if mode in ("ivf", "ivfpq"):
+        index.nprobe = value
+    elif mode == "hnsw":
+        faiss.downcast_index(index.index).hnsw.efSearch = value
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--modes", default=",".join(INDEX_MODES))
+    args = parser.parse_args()
+
+    corpus, queries = synthetic_corpus(args.vectors, args.dim, args.queries)
+    ids = np.arange(args.vectors, dtype=np.int64)
+    print(f"corpus: {args.vectors} x {args.dim}, {args.queries} queries, k={args.k}")
+
+    truth = None
+    print(f"{'mode':<7} {'knob':>6} {'build s':>8} {'recall':>7} {'ms/query':>9}")
+    for mode in ["flat"] + [m for m in args.modes.split(",") if m != "flat"]:
+        start = time.perf_counter()
+        index = populate(build_index(args.dim, mode, args.vectors), ids, corpus)
+        build = time.perf_counter() - start
+        for knob in SWEEPS[mode]:
+            if knob is not None:
+                set_knob(index, mode, knob)
+            start = time.perf_counter()
+            for q in queries:  # one query at a time, like search_documents
+                index.search(q[None, :], args.k)
+            latency = (time.perf_counter() - start) * 1000 / len(queries)
+            _, found = index.search(queries, args.k)
+            if truth is None:
+                truth = found
+            print(f"{mode:<7} {knob if knob is not None else '-':>6} {build:8.1f} {recall_at_k(found, truth):7.3f} {latency:9.3f}")
+        del index
+
+
+if __name__ == "__main__":
+    main()
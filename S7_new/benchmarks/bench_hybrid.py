@@ -0,0 +1,101 @@
+"""search_documents retrieval quality: dense-only vs. BM25 keyword vs. RRF hybrid.
+
+Runs against the bundled index (faiss_index/index.bin with chunks.db, or the
+legacy metadata.json) and a small hand-labeled query set over documents/.
+A query is a hit when one of its labeled chunks is in the top 5. Latency
+covers the search only; query embeddings are computed once up front, so
+the dense and hybrid modes need the Ollama embedding server.
+
+Usage: python benchmarks/bench_hybrid.py [--k 5] [--candidates 20] [--min-score 0.4] [--max-gap 0.2]
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from chunk_store import ChunkStore  # noqa: E402
+from doc_index import IndexHolder  # noqa: E402
+from embeddings import EMBED_MODEL, EMBED_URL, get_client  # noqa: E402
+
+INDEX_DIR = Path(__file__).resolve().parent.parent / "faiss_index"
+
+# (query, chunk ids that answer it)
+LABELED = [
+    ("How much Anmol singh paid for his DLF apartment via Capbridge?", {"INVG67564_13", "INVG67564_14"}),
+    ("What is the relationship between Gensol and Go-Auto?",
+     {"INVG67564_9", "INVG67564_17", "INVG67564_18", "INVG67564_19", "INVG67564_20", "INVG67564_22"}),
+    ("Who is Lalit Solanki?", {"INVG67564_23"}),
+    ("How many electric vehicles did Gensol actually procure?", {"INVG67564_9"}),
+    ("Which bank gave Param Care an overdraft facility?", {"INVG67564_15"}),
+    ("Who signed the NSE circular, Sandesh Sawant?", {"INVG67564_1"}),
+    ("Who founded DLF?", {"dlf_0"}),
+    ("Robert Vadra CBI investigation", {"dlf_3"}),
+    ("What is the Corporate Identity Number of DLF Limited?", {"DLF_13072023190044_BRSR_1"}),
+    ("How long is a cricket pitch?", {"cricket_0"}),
+    ("What is the Twenty20 format?", {"cricket_1"}),
+    ("Who implemented backpropagation to run on computers?",
+     {"medium.com_@niharkanungo_train-a-basic-neural-network-manually-from-scratch-f44721380b9b_2"}),
+    ("How do I pipe a PDF into markitdown?", {"markitdown_2"}),
+    ("Who wrote the paper on Tesla Motors intellectual property and the carbon crisis?",
+     {"Tesla_Motors_IP_Open_Innovation_and_the_Carbon_Crisis_-_Matthew_Rimmer_0"}),
+    ("How often does the school board consult with the tribe?", {"SAMPLE-Indian-Policies-and-Procedures-January-2023_3"}),
+]
+
+
+def open_store(tmp: Path) -> ChunkStore:
+    """The app's chunk store if it exists, else a scratch copy of the legacy metadata.json."""
+    if (INDEX_DIR / "chunks.db").exists():
+        return ChunkStore(INDEX_DIR / "chunks.db")
+    store = ChunkStore(tmp / "chunks.db")
+    rows = json.loads((INDEX_DIR / "metadata.json").read_text())
+    store.append(range(len(rows)), [{"doc": r["doc"], "chunk": r["chunk"], "chunk_id": r["chunk_id"]} for r in rows])
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--candidates", type=int, default=20)
+    parser.add_argument("--min-score", type=float, default=0.4)
+    parser.add_argument("--max-gap", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = open_store(Path(tmp))
+        holder = IndexHolder(INDEX_DIR, store)
+        holder.get()
+        queries = [q for q, _ in LABELED]
+        try:
+            vectors = get_client(EMBED_URL, EMBED_MODEL).embed_many(queries)
+        except Exception as e:
+            print(f"Embedding server unavailable ({e}); running the keyword mode only")
+            vectors = None
+
+        methods = {"keyword": lambda i: [store.get(j) for j, _ in store.keyword_search(queries[i], args.k)]}
+        if vectors is not None:
+            methods["dense"] = lambda i: [row for row, _ in holder.search(
+                vectors[i:i + 1], args.k, args.min_score, args.max_gap)]
+            methods["hybrid"] = lambda i: [row for row, _ in holder.hybrid_search(
+                queries[i], vectors[i:i + 1], args.k, args.candidates, args.min_score, args.max_gap)]
+
+        print(f"{len(LABELED)} labeled queries over {len(store)} chunks")
+        print(f"{'method':<8} {'hit@' + str(args.k):>6} {'mean ms':>8} {'p95 ms':>7}")
+        for name, run in methods.items():
+            hits, samples = 0, []
+            for i, (_, expected) in enumerate(LABELED):
+                start = time.perf_counter()
+                rows = run(i)
+                samples.append((time.perf_counter() - start) * 1000)
+                hits += any(row is not None and row["chunk_id"] in expected for row in rows)
+            p95 = sorted(samples)[max(0, int(len(samples) * 0.95) - 1)]
+            print(f"{name:<8} {hits / len(LABELED):6.2f} {statistics.mean(samples):8.2f} {p95:7.2f}")
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
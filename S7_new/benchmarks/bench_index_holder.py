@@ -0,0 +1,83 @@
+"""Per-query latency: reload-per-call search vs. the resident IndexHolder.
+
+Usage: python benchmarks/bench_index_holder.py [--chunks 2000] [--queries 200]
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from chunk_store import ChunkStore, CHUNKS_NAME  # noqa: E402
+from doc_index import IndexHolder, INDEX_NAME, publish_generation  # noqa: E402
+
+DIM = 768  # nomic-embed-text
+METADATA_NAME = "metadata.json"  # legacy layout read by the reload-per-call path
+
+
+def build_corpus(index_dir: Path, n_chunks: int):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((n_chunks, DIM)).astype(np.float32)
+    index = faiss.IndexFlatL2(DIM)
+    index.add(vectors)
+    faiss.write_index(index, str(index_dir / INDEX_NAME))
+    words = ("lorem ipsum dolor sit amet consectetur adipiscing elit " * 32).strip()
+    metadata = [{"doc": f"doc{i // 50}.txt", "chunk": words, "chunk_id": f"doc{i // 50}_{i % 50}"} for i in range(n_chunks)]
+    (index_dir / METADATA_NAME).write_text(json.dumps(metadata, indent=2))
+    store = ChunkStore(index_dir / CHUNKS_NAME)
+    store.append(range(n_chunks), metadata)
+    publish_generation(index_dir)
+    return store
+
+
+def reload_per_call(index_dir: Path, query_vec):
+    index = faiss.read_index(str(index_dir / INDEX_NAME))
+    metadata = json.loads((index_dir / METADATA_NAME).read_text())
+    D, I = index.search(query_vec, k=5)
+    return [metadata[idx] for idx in I[0]]
+
+
+def timed(fn, queries):
+    samples = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{name:<16} mean={statistics.mean(samples):8.3f} ms  p50={statistics.median(samples):8.3f} ms  p95={p95:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index_dir = Path(tmp)
+        store = build_corpus(index_dir, args.chunks)
+        size_kb = (index_dir / METADATA_NAME).stat().st_size // 1024
+        print(f"corpus: {args.chunks} chunks, metadata.json {size_kb} KB")
+
+        queries = np.random.default_rng(1).standard_normal((args.queries, 1, DIM)).astype(np.float32)
+        holder = IndexHolder(index_dir, store)
+        holder.get()  # first load is paid once per process
+
+        report("reload-per-call", timed(lambda q: reload_per_call(index_dir, q), queries))
+        report("resident", timed(lambda q: holder.search(q, k=5), queries))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Indexing throughput: serial convert -> embed -> write vs. the staged ingest pipeline.
+
+Stage costs are simulated with sleeps so the run needs neither Ollama nor
+real documents. Usage: python benchmarks/bench_ingest.py [--files 500] [--workers 4]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from ingest import run_pipeline  # noqa: E402
+
+CONVERT_S = 0.020  # per file
+EMBED_S = 0.0005   # per chunk, amortized over a batch request
+WRITE_S = 0.0002   # per chunk
+CHUNKS_PER_FILE = 8
+DIM = 768
+
+
+def fake_convert(path: str) -> str:
+    time.sleep(CONVERT_S)
+    return " ".join(f"{path}-{i}" for i in range(CHUNKS_PER_FILE))
+
+
+def fake_chunker(text: str):
+    return text.split()
+
+
+def fake_embed_many(texts):
+    time.sleep(0.002 + EMBED_S * len(texts))
+    return np.zeros((len(texts), DIM), dtype=np.float32)
+
+
+def fake_write(file, chunks, vectors):
+    time.sleep(WRITE_S * len(chunks))
+
+
+def on_error(file, e):
+    print(f"error in {file}: {e}")
+
+
+def serial(files):
+    for file in files:
+        chunks = fake_chunker(fake_convert(str(file)))
+        fake_write(file, chunks, fake_embed_many(chunks))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    files = [Path(f"doc{i}.txt") for i in range(args.files)]
+
+    start = time.perf_counter()
+    serial(files)
+    serial_s = time.perf_counter() - start
+    print(f"serial    {serial_s:6.2f}s  {args.files / serial_s:7.1f} files/s")
+
+    start = time.perf_counter()
+    stats = run_pipeline(files, fake_chunker, fake_embed_many, fake_write, on_error,
+                         workers=args.workers, convert=fake_convert)
+    pipeline_s = time.perf_counter() - start
+    print(f"pipeline  {pipeline_s:6.2f}s  {args.files / pipeline_s:7.1f} files/s")
+    for stage in stats:
+        print(f"  {stage}")
+
+
+if __name__ == "__main__":
+    main()
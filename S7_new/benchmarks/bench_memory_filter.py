@@ -0,0 +1,95 @@
+"""Session-filtered memory retrieval: top_k*2 overfetch + Python filter vs. id-bitmap pre-filter.
+
+Memories are spread over many sessions, so each session holds a small
+fraction of them. Reports how many of the requested top_k come back,
+recall against the exact filtered top_k, and per-query latency.
+
+Usage: python benchmarks/bench_memory_filter.py [--memories 1000000] [--sessions 100] [--dim 128]
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from index_factory import normalize  # noqa: E402
+from memory import MemoryItem, MemoryManager  # noqa: E402
+
+
+class TableEmbedder:
+    """Stands in for the embedding server: looks texts up in a precomputed matrix."""
+
+    def __init__(self, vectors: np.ndarray, queries: np.ndarray):
+        self.vectors = vectors
+        self.queries = queries
+
+    def embed(self, text: str) -> np.ndarray:
+        kind, i = text.split(" ", 1)
+        return (self.queries if kind == "query" else self.vectors)[int(i)]
+
+    def embed_many(self, texts) -> np.ndarray:
+        return self.vectors[[int(text.split(" ", 1)[1]) for text in texts]]
+
+
+def overfetch_retrieve(memory: MemoryManager, query: str, top_k: int, session_id: str):
+    """The previous retrieve: search top_k*2 unfiltered, then drop other sessions' memories."""
+    D, I = memory.index.search(normalize(memory._get_embedding(query)), top_k * 2)
+    results = [memory.data[i] for i in I[0] if i >= 0 and memory.data.session_id(i) == session_id]
+    return results[:top_k]
+
+
+def exact_filtered(vectors: np.ndarray, sessions: np.ndarray, query_vec: np.ndarray, session: int, top_k: int):
+    ids = np.flatnonzero(sessions == session)
+    scores = vectors[ids] @ query_vec
+    return set(ids[np.argsort(-scores)[:top_k]].tolist())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--memories", type=int, default=1_000_000)
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = normalize(rng.standard_normal((args.memories, args.dim)))
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    sessions = rng.integers(args.sessions, size=args.memories)
+
+    memory = MemoryManager()
+    memory.client = TableEmbedder(vectors, queries)
+    start = time.perf_counter()
+    memory.bulk_add([MemoryItem(text=f"memory {i}", type="tool_output", session_id=f"session-{s}")
+                     for i, s in enumerate(sessions)])
+    print(f"{args.memories} memories over {args.sessions} sessions, dim {args.dim}: "
+          f"loaded in {time.perf_counter() - start:.1f} s")
+
+    print(f"{'method':<12} {'returned':>9} {'recall':>7} {'mean ms':>8} {'p95 ms':>7}")
+    for name in ("overfetch", "prefilter"):
+        returned, recalls, samples = [], [], []
+        for q in range(args.queries):
+            session = int(rng.integers(args.sessions))
+            text, session_id = f"query {q}", f"session-{session}"
+            start = time.perf_counter()
+            if name == "overfetch":
+                items = overfetch_retrieve(memory, text, args.top_k, session_id)
+            else:
+                items = [item for item, _ in memory.retrieve(text, args.top_k, session_filter=session_id, min_score=None,
+                                                         recency_weight=0)]
+            samples.append((time.perf_counter() - start) * 1000)
+            truth = exact_filtered(vectors, sessions, normalize(queries[q])[0], session, args.top_k)
+            returned.append(len(items))
+            recalls.append(len({int(item.text.split(" ", 1)[1]) for item in items} & truth) / len(truth))
+        p95 = sorted(samples)[int(len(samples) * 0.95) - 1]
+        print(f"{name:<12} {statistics.mean(returned):9.2f} {statistics.mean(recalls):7.3f} "
+              f"{statistics.mean(samples):8.2f} {p95:7.2f}")
+
+
+if __name__ == "__main__":
+    main()
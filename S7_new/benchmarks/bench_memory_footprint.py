@@ -0,0 +1,80 @@
+"""RAM and insert time: a list of MemoryItem models vs. the columnar MemoryTable.
+
+Records look like the agent's tool-output memories: a short text, one of
+a few tools (also the tag), a session id shared by many memories and an
+ISO timestamp.
+
+Usage: python benchmarks/bench_memory_footprint.py [--memories 200000] [--sessions 100]
+"""
+
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from memory import MemoryItem, MemoryTable  # noqa: E402
+
+TOOLS = ["add", "subtract", "multiply", "divide", "power", "search_documents", "strings_to_chars_to_int",
+         "int_list_to_exponential_sum"]
+
+
+def records(n: int, sessions: int):
+    start = datetime(2025, 1, 1)
+    for i in range(n):
+        tool = TOOLS[i % len(TOOLS)]
+        yield dict(
+            text=f"Tool call: {tool} with {{'a': {i}, 'b': {i % 97}}}, got: {i * 31 % 100003}",
+            type="tool_output",
+            timestamp=(start + timedelta(seconds=i)).isoformat(),
+            tool_name=tool,
+            user_query=f"Original task: question {i % 1000}",
+            tags=[tool],
+            session_id=f"session-{i % sessions}",
+        )
+
+
+def measure(name: str, build):
+    """Time one untraced build, then measure the RAM held by a second, traced one."""
+    gc.collect()
+    start = time.perf_counter()
+    build()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<18} {current / 2**20:9.1f} MiB {elapsed:8.2f} s  ({current / len(result):6.0f} B/memory)")
+    return result
+
+
+def build_table(rows):
+    table = MemoryTable()
+    for row in rows:
+        table.append(**row)
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--memories", type=int, default=200_000)
+    parser.add_argument("--sessions", type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{args.memories} memories over {args.sessions} sessions")
+    items = measure("List[MemoryItem]", lambda: [MemoryItem(**row) for row in records(args.memories, args.sessions)])
+    del items
+    table = measure("MemoryTable", lambda: build_table(records(args.memories, args.sessions)))
+
+    start = time.perf_counter()
+    for i in range(0, len(table), max(1, len(table) // 1000)):
+        table[i]
+    print(f"materialize one    {(time.perf_counter() - start) * 1e6 / 1000:9.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""search_documents rerank stage: first-stage top k vs. overfetch + rerank().
+
+Uses the labeled queries and bundled index of bench_hybrid.py. Candidates
+come from the hybrid search (or keyword search alone when the embedding
+server is down). Entities stand in for PerceptionResult.entities: the
+capitalized words of each query. Reports hit@1, hit@k and MRR, plus the
+rerank stage's own latency.
+
+The shipped rerank weights were picked on all of LABELED, so their score
+there is in-sample. Every third query is therefore held out: weights are
+grid-searched on the rest, and quality is reported on the held-out
+queries for the first stage, the shipped weights (still in-sample) and the
+weights tuned without them (out-of-sample).
+
+Usage: python benchmarks/bench_rerank.py [--k 5] [--overfetch 50] [--holdout-every 3]
+"""
+
+import argparse
+import itertools
+import re
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from bench_hybrid import INDEX_DIR, LABELED, open_store  # noqa: E402
+from doc_index import IndexHolder  # noqa: E402
+from embeddings import EMBED_MODEL, EMBED_URL, get_client  # noqa: E402
+from rerank import POSITION_WEIGHT, WEIGHTS, rerank  # noqa: E402
+
+GRID = [round(0.1 * i, 1) for i in range(7)]  # candidate rank, overlap and entity weights
+
+
+def entities_of(query: str):
+    return re.findall(r"\b[A-Z][\w-]+", query)
+
+
+def quality(rankings, labeled, k: int):
+    hit1 = hitk = rr = 0.0
+    for rows, (_, expected) in zip(rankings, labeled):
+        ranks = [i for i, row in enumerate(rows[:k]) if row["chunk_id"] in expected]
+        hit1 += bool(ranks) and ranks[0] == 0
+        hitk += bool(ranks)
+        rr += 1 / (ranks[0] + 1) if ranks else 0.0
+    n = len(labeled)
+    return hit1 / n, hitk / n, rr / n
+
+
+def rerank_all(queries, hits, k: int, weights):
+    return [[row for row, _ in rerank(q, h, k, entities_of(q), weights)] for q, h in zip(queries, hits)]
+
+
+def tune(queries, hits, labeled, k: int):
+    """Weights with the best MRR on `queries`; ties go to the first in grid order."""
+    best, best_mrr = WEIGHTS, -1.0
+    for rank_w, overlap_w, entity_w in itertools.product(GRID[1:], GRID, GRID):
+        weights = (rank_w, overlap_w, entity_w, POSITION_WEIGHT)
+        mrr = quality(rerank_all(queries, hits, k, weights), labeled, k)[2]
+        if mrr > best_mrr:
+            best, best_mrr = weights, mrr
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--overfetch", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--holdout-every", type=int, default=3, help="hold out every n-th labeled query")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = open_store(Path(tmp))
+        holder = IndexHolder(INDEX_DIR, store)
+        queries = [q for q, _ in LABELED]
+        try:
+            vectors = get_client(EMBED_URL, EMBED_MODEL).embed_many(queries)
+            source = "hybrid"
+            candidates = [[row for row, _ in holder.hybrid_search(q, vectors[i:i + 1], args.overfetch, args.overfetch)]
+                          for i, q in enumerate(queries)]
+        except Exception as e:
+            print(f"Embedding server unavailable ({e}); using keyword candidates")
+            source = "keyword"
+            candidates = [[store.get(j) for j, _ in store.keyword_search(q, args.overfetch)] for q in queries]
+        store.close()
+
+    hits = [[(row, 0.0) for row in rows] for rows in candidates]
+    held_out = [i % args.holdout_every == args.holdout_every - 1 for i in range(len(LABELED))]
+
+    def split(values, held):
+        return [v for v, h in zip(values, held_out) if h == held]
+
+    tuned = tune(split(queries, False), split(hits, False), split(LABELED, False), args.k)
+    test_queries, test_hits, test_labeled = split(queries, True), split(hits, True), split(LABELED, True)
+
+    samples = []
+    for _ in range(args.repeat):
+        for q, h in zip(queries, hits):
+            start = time.perf_counter()
+            rerank(q, h, args.k, entities_of(q))
+            samples.append((time.perf_counter() - start) * 1000)
+
+    print(f"{len(LABELED)} labeled queries ({len(test_queries)} held out), {source} candidates, "
+          f"overfetch {args.overfetch}")
+    print(f"weights (rank, overlap, entity, position): shipped {WEIGHTS}, tuned on the rest {tuned}")
+    print(f"{'held-out queries':<26} {'hit@1':>6} {'hit@' + str(args.k):>6} {'MRR':>6}")
+    stages = (
+        ("first stage", [[row for row, _ in h[:args.k]] for h in test_hits]),
+        ("rerank, shipped weights*", rerank_all(test_queries, test_hits, args.k, WEIGHTS)),
+        ("rerank, tuned weights", rerank_all(test_queries, test_hits, args.k, tuned)),
+    )
+    for name, rankings in stages:
+        hit1, hitk, mrr = quality(rankings, test_labeled, args.k)
+        print(f"{name:<26} {hit1:6.2f} {hitk:6.2f} {mrr:6.3f}")
+    print("* fit on all labeled queries, held-out ones included: in-sample")
+    p95 = sorted(samples)[int(len(samples) * 0.95) - 1]
+    print(f"rerank latency: mean {statistics.mean(samples):.2f} ms, p95 {p95:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
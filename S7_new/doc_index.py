@@ -0,0 +1,304 @@
+# doc_index.py
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from chunk_store import ChunkStore
+from index_factory import (build_index, export_vectors, index_mode, maybe_upgrade, normalize, rebuild, remove_ids,
+                           rrf_fuse, select_hits)
+
+INDEX_NAME = "index.bin"
+DOC_CACHE_NAME = "doc_index_cache.json"
+GENERATION_NAME = "generation"
+LOCK_NAME = "index.lock"
+METRIC = faiss.METRIC_INNER_PRODUCT  # over normalized vectors: scores are cosine similarities
+
+
+def new_index(dim: int):
+    """Empty document index that keeps caller-assigned chunk ids.
+
+    New indexes start flat; `index_factory.maybe_upgrade` switches them to
+    the configured ANN mode once the corpus is large enough. Vectors must be
+    `normalize`d before they are added.
+    """
+    return build_index(dim, "flat", metric=METRIC)
+
+
+def load_index(path: Path):
+    """Read the document index, upgrading older layouts in memory.
+
+    A legacy positional IndexFlatL2 (id == row) gets explicit ids, and any
+    L2 index is rebuilt as inner product over normalized vectors.
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+    index = faiss.read_index(str(path))
+    if isinstance(index, faiss.IndexFlat):
+        ids, vectors = np.arange(index.ntotal, dtype=np.int64), index.reconstruct_n(0, index.ntotal)
+    elif index.metric_type != METRIC:
+        ids, vectors = export_vectors(index)
+    else:
+        return index
+    return rebuild(index, ids, normalize(vectors).reshape(-1, index.d), metric=METRIC)
+
+
+def id_ranges(ids: Sequence[int]) -> List[List[int]]:
+    """Collapse ids into sorted, contiguous [start, end) ranges."""
+    ranges = []
+    for i in sorted(ids):
+        if ranges and ranges[-1][1] == i:
+            ranges[-1][1] = i + 1
+        else:
+            ranges.append([i, i + 1])
+    return ranges
+
+
+def expand_ranges(ranges: Sequence[Sequence[int]]) -> List[int]:
+    return [i for start, end in ranges for i in range(start, end)]
+
+
+def load_doc_cache(cache_file: Path, store: ChunkStore) -> Dict[str, dict]:
+    """Read doc_index_cache.json as {name: {"hash", "ranges"}}.
+
+    Legacy entries only hold the file hash; their ranges are recovered from
+    the chunk store. Re-processed files used to be appended again, so only the
+    newest contiguous run is kept and older copies are left for `compact`.
+    """
+    cache_file = Path(cache_file)
+    cache = json.loads(cache_file.read_text()) if cache_file.exists() else {}
+    for name, entry in cache.items():
+        if isinstance(entry, str):
+            cache[name] = {"hash": entry, "ranges": id_ranges(store.ids_for_doc(name))[-1:]}
+    return cache
+
+
+def commit_documents(index_dir: Path, store: ChunkStore, present: Iterable[str],
+                     indexed: Dict[str, Tuple[str, List[dict], np.ndarray]],
+                     log: Callable[[str, str], None] = lambda level, message: None) -> bool:
+    """Swap converted and embedded documents into the index, chunk store and doc cache.
+
+    `indexed` maps a document name to (file hash, chunk rows, embeddings).
+    Cached documents not in `present` are deleted. The slow convert and
+    embed work happens before this call, outside `index_lock`; here the
+    index and doc cache are reloaded inside the lock, and documents another
+    process has indexed at the same hash meanwhile are skipped.
+
+    Commit order: the doc cache records the new ids as "pending", the index
+    is published, the chunk store is switched in one transaction, and the
+    doc cache is written with the new hashes. A crash in between leaves
+    documents whose cached hash is stale, so the next run indexes them
+    again and removes both their old and their pending vectors and rows.
+    Returns whether anything changed.
+    """
+    index_dir = Path(index_dir)
+    index_file, cache_file = index_dir / INDEX_NAME, index_dir / DOC_CACHE_NAME
+    present = set(present)
+    with index_lock(index_dir):
+        doc_cache = load_doc_cache(cache_file, store)
+        index = load_index(index_file)
+        deleted = [name for name in doc_cache if name not in present]
+        updated = {name: doc for name, doc in indexed.items() if doc_cache.get(name, {}).get("hash") != doc[0]}
+        if not deleted and not updated:
+            return False
+
+        docs = deleted + list(updated)
+        old_ids = {i for name in docs if name in doc_cache
+                   for i in expand_ranges(doc_cache[name]["ranges"] + doc_cache[name].get("pending", []))}
+        for name in docs:
+            old_ids.update(store.ids_for_doc(name))
+        removed = 0
+        if index is not None and old_ids:
+            index, removed = remove_ids(index, sorted(old_ids))
+
+        ids, rows, entries = [], [], {}
+        for name, (file_hash, chunks, vectors) in updated.items():
+            ranges = []
+            if len(chunks):
+                if index is None:
+                    index = new_index(vectors.shape[1])
+                start = store.reserve_ids(len(chunks))
+                new_ids = np.arange(start, start + len(chunks), dtype=np.int64)
+                index.add_with_ids(normalize(vectors), new_ids)
+                ids.extend(new_ids.tolist())
+                rows.extend(chunks)
+                ranges = [[start, start + len(chunks)]]
+            entries[name] = {"hash": file_hash, "ranges": ranges}
+        # Until the final write, a crash must not leave the new vectors owned by no document
+        staged = {name: dict(doc_cache.get(name, {"hash": None, "ranges": []}), pending=entry["ranges"])
+                  for name, entry in entries.items() if entry["ranges"]}
+        if staged:
+            write_text_atomic(cache_file, json.dumps({**doc_cache, **staged}, indent=2))
+        doc_cache.update(entries)
+        for name in deleted:
+            del doc_cache[name]
+            log("DELETE", f"Removed deleted file: {name}")
+
+        if index is not None:
+            mode = index_mode(index)
+            index = maybe_upgrade(index)
+            if index_mode(index) != mode:
+                log("INDEX", f"Switched to {index_mode(index)} index at {index.ntotal} vectors")
+            write_index_atomic(index, index_file)
+            publish_generation(index_dir)
+        store.replace_docs(docs, ids, rows)
+        # Only mark files as indexed once their vectors and rows are committed
+        write_text_atomic(cache_file, json.dumps(doc_cache, indent=2))
+    log("SUCCESS", f"Indexed {len(updated)} and deleted {len(deleted)} files; {removed} old vectors removed")
+    return True
+
+
+def compact(index, store: ChunkStore, doc_cache: Dict[str, dict]):
+    """Rebuild the index without stale vectors, renumbered to 0..n-1.
+
+    A vector is stale when it has no chunk row, or when its document is
+    tracked in `doc_cache` but the id is outside that document's ranges.
+    Rows of untracked documents (e.g. crawled pages) are kept. Also vacuums
+    the chunk store. Returns the new index; `doc_cache` ranges are rewritten
+    in place. Run it while no indexing is in progress.
+    """
+    owned = {i for entry in doc_cache.values() for i in expand_ranges(entry["ranges"])}
+    id_docs = store.id_docs()
+    ids, vectors = export_vectors(index)
+    position = {int(i): p for p, i in enumerate(ids)}
+    live = sorted(i for i in position if i in owned or (i in id_docs and id_docs[i] not in doc_cache))
+    new_ids = {old: new for new, old in enumerate(live)}
+
+    # Same index mode as before; IVF indexes are retrained on the surviving vectors
+    compacted = rebuild(index, np.arange(len(live), dtype=np.int64), vectors[[position[i] for i in live]])
+    store.renumber(live)
+    store.vacuum()
+
+    for entry in doc_cache.values():
+        entry.pop("pending", None)  # vectors of an interrupted commit are outside the ranges, so already dropped
+        entry["ranges"] = id_ranges(new_ids[i] for i in expand_ranges(entry["ranges"]) if i in new_ids)
+    return compacted
+
+
+def write_text_atomic(path: Path, text: str):
+    """Write text to a temp file next to `path` and rename it into place."""
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def write_index_atomic(index, path: Path):
+    """Write a FAISS index to a temp file next to `path` and rename it into place."""
+    tmp = path.with_name(path.name + ".tmp")
+    faiss.write_index(index, str(tmp))
+    os.replace(tmp, path)
+
+
+@contextmanager
+def index_lock(index_dir: Path):
+    """Exclusive lock, across processes and threads, for rewriting the index, chunk store and doc cache.
+
+    Every MCP server, pooled or respawned, and the Flask agent can index the
+    same faiss_index; whoever holds the lock must load the index inside it.
+    """
+    path = Path(index_dir) / LOCK_NAME
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after ~10 s; keep waiting for the indexer
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def publish_generation(index_dir: Path):
+    """Bump the generation stamp so resident readers reload the index."""
+    write_text_atomic(Path(index_dir) / GENERATION_NAME, str(time.time_ns()))
+
+
+class IndexHolder:
+    """Keeps one FAISS index resident for the whole process.
+
+    The index is reloaded only when the generation stamp written by
+    `publish_generation` changes, so tool calls share a single loaded copy.
+    Chunk metadata is looked up by id in the `ChunkStore`.
+    """
+
+    def __init__(self, index_dir: Path, store: ChunkStore):
+        self.index_dir = Path(index_dir)
+        self.store = store
+        self._lock = threading.Lock()
+        self._snapshot: Optional[Tuple[tuple, object]] = None
+
+    def _stamp(self) -> Optional[tuple]:
+        paths = [self.index_dir / GENERATION_NAME, self.index_dir / INDEX_NAME]
+        try:
+            return tuple((st.st_mtime_ns, st.st_size) for st in (p.stat() for p in paths if p.exists()))
+        except FileNotFoundError:
+            return None
+
+    def get(self):
+        """Return the resident index, reloading it on a new generation."""
+        stamp = self._stamp()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot[0] == stamp:
+            return snapshot[1]
+
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot[0] != stamp:
+                snapshot = (stamp, load_index(self.index_dir / INDEX_NAME))
+                # Swap the whole tuple so readers never see a stale stamp with a new index
+                self._snapshot = snapshot
+        return snapshot[1]
+
+    def invalidate(self):
+        """Drop the resident snapshot; the next `get` reloads from disk."""
+        with self._lock:
+            self._snapshot = None
+
+    def search(self, query_vec, k: int = 5, min_score: Optional[float] = None,
+               max_gap: Optional[float] = None) -> List[Tuple[dict, float]]:
+        """Return up to k (metadata row, cosine score) pairs for the query, best first (see `select_hits`)."""
+        D, I = self.get().search(normalize(query_vec), k)
+        hits = [(i, s) for i, s in zip(I[0], D[0]) if i >= 0]
+        rows = self.store.get_many([i for i, _ in hits])
+        return select_hits([(row, float(s)) for row, (_, s) in zip(rows, hits) if row is not None],
+                           k, min_score, max_gap)
+
+    def hybrid_search(self, query: str, query_vec, k: int = 5, candidates: int = 20, min_score: Optional[float] = None,
+                      max_gap: Optional[float] = None) -> List[Tuple[dict, float]]:
+        """Fuse dense and BM25 keyword rankings with RRF; returns up to k (metadata row, RRF score) pairs.
+
+        The dense list is gated by `min_score`/`max_gap` as in `search`. The
+        keyword list is not, so a chunk naming a rare entity the embedding
+        misses can still make the cut.
+        """
+        D, I = self.get().search(normalize(query_vec), candidates)
+        dense = select_hits([(int(i), float(s)) for i, s in zip(I[0], D[0]) if i >= 0], candidates, min_score, max_gap)
+        keyword = self.store.keyword_search(query, candidates)
+        fused = rrf_fuse([[i for i, _ in dense], [i for i, _ in keyword]])[:k]
+        rows = self.store.get_many([i for i, _ in fused])
+        return [(row, score) for row, (_, score) in zip(rows, fused) if row is not None]
@@ -0,0 +1,124 @@
+# embedding_cache.py
+
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_MAX_ENTRIES = 50_000  # ~150 MB of 768-d float32 vectors
+TOUCH_BATCH = 1000  # cache hits whose LRU stamps are buffered before a write
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent (model, sha256(text)) -> float32 vector cache in SQLite with LRU eviction.
+
+    A hit does not write: its last_used stamp is buffered and written with
+    the next `put_many` (before anything is evicted), every TOUCH_BATCH
+    hits, or on `close`.
+    """
+
+    def __init__(self, path: Path, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._touched: Dict[Tuple[str, str], int] = {}  # (model, digest) -> last_used not yet written
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, digest TEXT NOT NULL, vector BLOB NOT NULL, last_used INTEGER NOT NULL,"
+            " PRIMARY KEY (model, digest))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings (last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Look up each text; returns a vector or None per position and buffers LRU stamps of hits."""
+        digests = [text_digest(t) for t in texts]
+        found = {}
+        with self._lock:
+            unique = list(dict.fromkeys(digests))
+            # Stay under SQLite's bound-parameter limit
+            for i in range(0, len(unique), 500):
+                part = unique[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT digest, vector FROM embeddings WHERE model = ? AND digest IN ({','.join('?' * len(part))})",
+                    [model, *part],
+                ).fetchall()
+                found.update((d, np.frombuffer(v, dtype=np.float32)) for d, v in rows)
+            if found:
+                now = time.time_ns()
+                self._touched.update(((model, d), now) for d in found)
+                if len(self._touched) >= TOUCH_BATCH:
+                    self._write_touches()
+                    self._conn.commit()
+            result = [found.get(d) for d in digests]
+            hit_count = sum(v is not None for v in result)
+            self.hits += hit_count
+            self.misses += len(result) - hit_count
+        return result
+
+    def _write_touches(self):
+        """Write buffered LRU stamps; call with the lock held and commit afterwards."""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND digest = ?",
+                [(now, model, d) for (model, d), now in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: np.ndarray):
+        """Store vectors for texts, evicting the least recently used rows past `max_entries`."""
+        now = time.time_ns()
+        rows = [(model, text_digest(t), np.asarray(v, dtype=np.float32).tobytes(), now) for t, v in zip(texts, vectors)]
+        with self._lock:
+            # Eviction below must see the hits since the last write
+            self._write_touches()
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._count += self._conn.total_changes - before
+            overflow = self._count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (overflow,),
+                )
+                self._count -= overflow
+                self.evictions += overflow
+            self._conn.commit()
+
+    def put(self, model: str, text: str, vector: np.ndarray):
+        self.put_many(model, [text], [vector])
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": self._count,
+            "evictions": self.evictions,
+        }
+
+    def close(self):
+        with self._lock:
+            self._write_touches()
+            self._conn.commit()
+            self._conn.close()
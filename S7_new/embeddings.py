@@ -0,0 +1,241 @@
+# embeddings.py
+
+import asyncio
+import atexit
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple
+
+import httpx
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from embedding_cache import EmbeddingCache
+
+EMBED_URL = "http://localhost:11434/api/embeddings"
+EMBED_MODEL = "nomic-embed-text"
+RETRY_STATUS = {429, 500, 502, 503, 504}
+CACHE_PATH = Path(__file__).parent.resolve() / "faiss_index" / "embed_cache.db"
+
+
+class EmbeddingClient:
+    """Pooled, batched client for the Ollama embedding API.
+
+    Batches go to Ollama's `/api/embed` endpoint (one request per batch). If the
+    server does not have it, texts fall back to one `/api/embeddings` call each,
+    still spread over the worker pool. With a `cache`, only texts it has not
+    seen for this model go over the network.
+
+    `aembed` / `aembed_many` are coroutine versions on a pooled
+    `httpx.AsyncClient` (one per event loop), so embedding calls made from
+    async code overlap instead of blocking the loop.
+    """
+
+    def __init__(
+        self,
+        url: str = EMBED_URL,
+        model: str = EMBED_MODEL,
+        batch_size: int = 32,
+        max_workers: int = 4,
+        timeout: float = 30.0,
+        retries: int = 3,
+        backoff: float = 0.5,
+        cache: Optional[EmbeddingCache] = None,
+    ):
+        self.url = url
+        self.model = model
+        self.batch_size = max(1, batch_size)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache
+        self.batch_url = url.rsplit("/api/", 1)[0] + "/api/embed"
+        self._batch_supported = None  # probed on the first batch
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="embed")
+        self.max_workers = max_workers
+        # An AsyncClient's connections belong to the loop that opened them
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = \
+            weakref.WeakKeyDictionary()
+
+    def _post(self, url: str, payload: dict) -> dict:
+        """POST with timeout, retrying connection errors and 429/5xx with exponential backoff."""
+        error = None
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(url, json=payload, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    return response.json()
+                error = requests.HTTPError(f"{response.status_code} from {url}", response=response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if attempt < self.retries:
+                time.sleep(self.backoff * (2 ** attempt))
+        raise error
+
+    def _embed_one(self, text: str) -> np.ndarray:
+        data = self._post(self.url, {"model": self.model, "prompt": text})
+        return np.array(data["embedding"], dtype=np.float32)
+
+    def embed(self, text: str) -> np.ndarray:
+        """Embed a single text with the per-prompt endpoint."""
+        if self.cache is not None:
+            cached = self.cache.get(self.model, text)
+            if cached is not None:
+                return cached
+        vector = self._embed_one(text)
+        if self.cache is not None:
+            self.cache.put(self.model, text, vector)
+        return vector
+
+    def _embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        if self._batch_supported is not False:
+            try:
+                data = self._post(self.batch_url, {"model": self.model, "input": list(texts)})
+                self._batch_supported = True
+                return np.asarray(data["embeddings"], dtype=np.float32)
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code != 404:
+                    raise
+                self._batch_supported = False
+        return np.stack([self._embed_one(t) for t in texts])
+
+    def _embed_uncached(self, texts: Sequence[str]) -> np.ndarray:
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            return self._embed_batch(batches[0])
+        return np.concatenate(list(self._pool.map(self._embed_batch, batches)))
+
+    def embed_many(self, texts: Sequence[str]) -> np.ndarray:
+        """Embed `texts` in batches with several requests in flight; returns an (n, dim) float32 matrix."""
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        if self.cache is None:
+            return self._embed_uncached(texts)
+
+        vectors = self.cache.get_many(self.model, texts)
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        if missing:
+            fresh = self._embed_uncached(missing)
+            self.cache.put_many(self.model, missing, fresh)
+            by_text = dict(zip(missing, fresh))
+            vectors = [by_text[t] if v is None else v for t, v in zip(texts, vectors)]
+        return np.stack(vectors)
+
+    def _async_session(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            limits = httpx.Limits(max_connections=self.max_workers, max_keepalive_connections=self.max_workers)
+            client = self._async_clients[loop] = httpx.AsyncClient(timeout=self.timeout, limits=limits)
+        return client
+
+    async def _apost(self, url: str, payload: dict) -> dict:
+        """Async `_post`: same timeout, retry and backoff policy."""
+        error = None
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self._async_session().post(url, json=payload)
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                    return response.json()
+                error = httpx.HTTPStatusError(f"{response.status_code} from {url}", request=response.request,
+                                              response=response)
+            except httpx.TransportError as e:
+                error = e
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+        raise error
+
+    async def _aembed_one(self, text: str) -> np.ndarray:
+        data = await self._apost(self.url, {"model": self.model, "prompt": text})
+        return np.array(data["embedding"], dtype=np.float32)
+
+    async def aembed(self, text: str) -> np.ndarray:
+        """Coroutine version of `embed`; cache reads and writes run in a worker thread, off the event loop."""
+        if self.cache is not None:
+            cached = await asyncio.to_thread(self.cache.get, self.model, text)
+            if cached is not None:
+                return cached
+        vector = await self._aembed_one(text)
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put, self.model, text, vector)
+        return vector
+
+    async def _aembed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        if self._batch_supported is not False:
+            try:
+                data = await self._apost(self.batch_url, {"model": self.model, "input": list(texts)})
+                self._batch_supported = True
+                return np.asarray(data["embeddings"], dtype=np.float32)
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 404:
+                    raise
+                self._batch_supported = False
+        return np.stack(await asyncio.gather(*(self._aembed_one(t) for t in texts)))
+
+    async def aembed_many(self, texts: Sequence[str]) -> np.ndarray:
+        """Coroutine version of `embed_many`; batches are in flight together, bounded by the connection pool."""
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        if self.cache is not None:
+            vectors = await asyncio.to_thread(self.cache.get_many, self.model, texts)
+        else:
+            vectors = [None] * len(texts)
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        if missing:
+            batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+            fresh = np.concatenate(await asyncio.gather(*(self._aembed_batch(b) for b in batches)))
+            if self.cache is not None:
+                await asyncio.to_thread(self.cache.put_many, self.model, missing, fresh)
+            by_text = dict(zip(missing, fresh))
+            vectors = [by_text[t] if v is None else v for t, v in zip(texts, vectors)]
+        return np.stack(vectors)
+
+    async def aclose(self):
+        """Close the async client opened on the running loop."""
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        self.session.close()
+
+
+_clients: Dict[Tuple[str, str], EmbeddingClient] = {}
+_clients_lock = threading.Lock()
+
+
+_cache: Optional[EmbeddingCache] = None
+
+
+def get_cache() -> EmbeddingCache:
+    """Return the embedding cache shared by indexing, search and agent memory."""
+    global _cache
+    with _clients_lock:
+        if _cache is None:
+            _cache = EmbeddingCache(CACHE_PATH)
+            atexit.register(_cache.close)  # writes the buffered LRU stamps
+        return _cache
+
+
+def get_client(url: str = EMBED_URL, model: str = EMBED_MODEL) -> EmbeddingClient:
+    """Return the process-wide client for (url, model), creating it on first use."""
+    cache = get_cache()
+    with _clients_lock:
+        client = _clients.get((url, model))
+        if client is None:
+            client = _clients[(url, model)] = EmbeddingClient(url, model, cache=cache)
+        return client
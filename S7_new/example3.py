@@ -11,8 +11,13 @@ import faiss
 import numpy as np
 from pathlib import Path
 import requests
-from markitdown import MarkItDown
 import time
+from embeddings import get_client, get_cache
+from ingest import run_pipeline
+from chunk_store import ChunkStore, migrate_metadata_json
+from doc_index import (IndexHolder, write_index_atomic, publish_generation, load_index, load_doc_cache,
+                       commit_documents, compact, index_lock, write_text_atomic)
+from rerank import rerank
 from models import AddInput, AddOutput, SqrtInput, SqrtOutput, StringsToIntsInput, StringsToIntsOutput, ExpSumInput, ExpSumOutput
 from PIL import Image as PILImage
 from tqdm import tqdm
@@ -29,12 +34,23 @@ EMBED_URL = "http://localhost:11434/api/embeddings"
 EMBED_MODEL = "nomic-embed-text"
 CHUNK_SIZE = 256
 CHUNK_OVERLAP = 40
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "4"))
+SEARCH_TOP_K = int(os.getenv("SEARCH_TOP_K", "5"))
+SEARCH_MIN_SCORE = float(os.getenv("SEARCH_MIN_SCORE", "0.4"))  # cosine similarity
+SEARCH_MAX_GAP = float(os.getenv("SEARCH_MAX_GAP", "0.2"))  # drop hits this far below the best one
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "20"))  # per ranking (dense, keyword) fed to fusion
+SEARCH_RERANK = os.getenv("SEARCH_RERANK", "1") != "0"
+SEARCH_RERANK_CANDIDATES = int(os.getenv("SEARCH_RERANK_CANDIDATES", "50"))  # fused hits rescored by rerank()
 ROOT = Path(__file__).parent.resolve()
+CHUNK_STORE = ChunkStore(ROOT / "faiss_index" / "chunks.db")
+migrate_metadata_json(CHUNK_STORE, ROOT / "faiss_index" / "metadata.json")
+INDEX_HOLDER = IndexHolder(ROOT / "faiss_index", CHUNK_STORE)
 
 def get_embedding(text: str) -> np.ndarray:
-    response = requests.post(EMBED_URL, json={"model": EMBED_MODEL, "prompt": text})
-    response.raise_for_status()
-    return np.array(response.json()["embedding"], dtype=np.float32)
+    return get_client(EMBED_URL, EMBED_MODEL).embed(text)
+
+def get_embeddings(texts: list[str]) -> np.ndarray:
+    return get_client(EMBED_URL, EMBED_MODEL).embed_many(texts)
 
 def chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
     words = text.split()
@@ -47,19 +63,30 @@ def mcp_log(level: str, message: str) -> None:
     sys.stderr.flush()
 
 @mcp.tool()
-def search_documents(query: str) -> list[str]:
-    """Search for relevant content from uploaded documents."""
+def search_documents(query: str, entities: list[str] | None = None) -> list[str]:
+    """Search for relevant content from uploaded documents.
+
+    Optional `entities` (names, keywords from the question) favour chunks that mention them.
+    """
     ensure_faiss_ready()
     mcp_log("SEARCH", f"Query: {query}")
     try:
-        index = faiss.read_index(str(ROOT / "faiss_index" / "index.bin"))
-        metadata = json.loads((ROOT / "faiss_index" / "metadata.json").read_text())
         query_vec = get_embedding(query).reshape(1, -1)
-        D, I = index.search(query_vec, k=5)
         results = []
-        for idx in I[0]:
-            data = metadata[idx]
-            results.append(f"{data['chunk']}\n[Source: {data['doc']}, ID: {data['chunk_id']}]")
+        # Dense and BM25 keyword rankings fused with RRF: rare names the embedding misses still surface
+        k = SEARCH_RERANK_CANDIDATES if SEARCH_RERANK else SEARCH_TOP_K
+        hits = INDEX_HOLDER.hybrid_search(query, query_vec, k=k, candidates=max(k, SEARCH_CANDIDATES),
+                                          min_score=SEARCH_MIN_SCORE, max_gap=SEARCH_MAX_GAP)
+        score_name = "rrf"  # rank fusion score, not a cosine similarity
+        if SEARCH_RERANK:
+            # Overfetched hits rescored on term overlap, entity mentions and chunk position
+            hits = rerank(query, hits, SEARCH_TOP_K, entities or ())
+            score_name = "rerank"
+        for data, score in hits:
+            results.append(f"{data['chunk']}\n[Source: {data['doc']}, ID: {data['chunk_id']}, {score_name}={score:.3f}]")
+        if not results:
+            results.append("No document chunks matched this query: none shares a keyword with it, and none has "
+                           f"cosine similarity of at least {SEARCH_MIN_SCORE} to it.")
         return results
     except Exception as e:
         return [f"ERROR: Failed to search: {str(e)}"]
@@ -218,7 +245,7 @@ def debug_error(error: str) -> list[base.Message]:
         base.AssistantMessage("I'll help debug that. What have you tried so far?"),
     ]
 
-def process_documents(url: str):
+def process_documents(url: str, workers: int = INDEX_WORKERS):
     """Fetch webpage, save to file, and process documents as before."""
     mcp_log("INFO", "Indexing document from webpage with MarkItDown...")
     ROOT = Path(__file__).parent.resolve()
@@ -226,18 +253,11 @@ def process_documents(url: str):
     INDEX_CACHE = ROOT / "faiss_index"
     INDEX_CACHE.mkdir(exist_ok=True)
     DOC_PATH.mkdir(exist_ok=True)
-    INDEX_FILE = INDEX_CACHE / "index.bin"
-    METADATA_FILE = INDEX_CACHE / "metadata.json"
     CACHE_FILE = INDEX_CACHE / "doc_index_cache.json"
 
     def file_hash(path):
         return hashlib.md5(Path(path).read_bytes()).hexdigest()
 
-    CACHE_META = json.loads(CACHE_FILE.read_text()) if CACHE_FILE.exists() else {}
-    metadata = json.loads(METADATA_FILE.read_text()) if METADATA_FILE.exists() else []
-    index = faiss.read_index(str(INDEX_FILE)) if INDEX_FILE.exists() else None
-    converter = MarkItDown()
-
     # Step 1: Fetch and save webpage as file
     try:
         response = requests.get(url)
@@ -254,51 +274,70 @@ def process_documents(url: str):
         mcp_log("ERROR", f"Failed to fetch or save URL {url}: {e}")
         return
 
+    # The lock is held only to read the doc cache here and to commit below, not while converting and embedding
+    with index_lock(INDEX_CACHE):
+        DOC_CACHE = load_doc_cache(CACHE_FILE, CHUNK_STORE)
+
     # Step 2: Process all files in the directory (as before)
+    present = {file.name for file in DOC_PATH.glob("*.*")}
+    file_hashes = {}
     for file in DOC_PATH.glob("*.*"):
         fhash = file_hash(file)
-        if file.name in CACHE_META and CACHE_META[file.name] == fhash:
+        entry = DOC_CACHE.get(file.name)
+        if entry and entry["hash"] == fhash:
             mcp_log("SKIP", f"Skipping unchanged file: {file.name}")
             continue
-
         mcp_log("PROC", f"Processing: {file.name}")
-        try:
-            result = converter.convert(str(file))
-            markdown = result.text_content
-            chunks = list(chunk_text(markdown))
-            embeddings_for_file = []
-            new_metadata = []
-            for i, chunk in enumerate(tqdm(chunks, desc=f"Embedding {file.name}")):
-                embedding = get_embedding(chunk)
-                embeddings_for_file.append(embedding)
-                new_metadata.append({"doc": file.name, "chunk": chunk, "chunk_id": f"{file.stem}_{i}"})
-            if embeddings_for_file:
-                if index is None:
-                    dim = len(embeddings_for_file[0])
-                    index = faiss.IndexFlatL2(dim)
-                index.add(np.stack(embeddings_for_file))
-                metadata.extend(new_metadata)
-            CACHE_META[file.name] = fhash
-        except Exception as e:
-            mcp_log("ERROR", f"Failed to process {file.name}: {e}")
-
-    CACHE_FILE.write_text(json.dumps(CACHE_META, indent=2))
-    METADATA_FILE.write_text(json.dumps(metadata, indent=2))
-    if index and index.ntotal > 0:
-        faiss.write_index(index, str(INDEX_FILE))
-        mcp_log("SUCCESS", "Saved FAISS index and metadata")
-    else:
+        file_hashes[file] = fhash
+
+    indexed = {}
+
+    def write_file(file, chunks, embeddings_for_file):
+        """Single writer: hold the file's chunks and vectors for the commit."""
+        new_metadata = [{"doc": file.name, "chunk": chunk, "chunk_id": f"{file.stem}_{i}"} for i, chunk in enumerate(chunks)]
+        indexed[file.name] = (file_hashes[file], new_metadata, embeddings_for_file)
+
+    def on_error(file, e):
+        mcp_log("ERROR", f"Failed to process {file.name}: {e}")
+
+    stats = run_pipeline(list(file_hashes), lambda text: list(chunk_text(text)), get_embeddings,
+                         write_file, on_error, workers=workers)
+    for stage in stats:
+        mcp_log("STATS", str(stage))
+
+    mcp_log("CACHE", f"Embedding cache: {get_cache().stats()}")
+    if not commit_documents(INDEX_CACHE, CHUNK_STORE, present, indexed, log=mcp_log):
+        # Nothing to do, or another process indexed these files first; leave its index alone
         mcp_log("WARN", "No new documents or updates to process.")
 
 
+def compact_index():
+    """Drop stale vectors and close id gaps left by updated or deleted documents."""
+    INDEX_CACHE = ROOT / "faiss_index"
+    INDEX_FILE = INDEX_CACHE / "index.bin"
+    CACHE_FILE = INDEX_CACHE / "doc_index_cache.json"
+
+    with index_lock(INDEX_CACHE):
+        index = load_index(INDEX_FILE)
+        if index is None:
+            mcp_log("WARN", "No index to compact.")
+            return
+        doc_cache = load_doc_cache(CACHE_FILE, CHUNK_STORE)
+        before = index.ntotal
+        index = compact(index, CHUNK_STORE, doc_cache)
+        write_index_atomic(index, INDEX_FILE)
+        publish_generation(INDEX_CACHE)
+        write_text_atomic(CACHE_FILE, json.dumps(doc_cache, indent=2))
+    mcp_log("SUCCESS", f"Compacted index from {before} to {index.ntotal} vectors")
+
+
 def ensure_faiss_ready():
     from pathlib import Path
     print('I am inside this')
     index_path = ROOT / "faiss_index" / "index.bin"
     print('Index file path error')
-    meta_path = ROOT / "faiss_index" / "metadata.json"
     print('Meta file path error')
-    if not (index_path.exists() and meta_path.exists()):
+    if not (index_path.exists() and len(CHUNK_STORE)):
         mcp_log("INFO", "Index not found — running process_documents()...")
         url = "https://medium.com/@niharkanungo/train-a-basic-neural-network-manually-from-scratch-f44721380b9b"
         process_documents(url)
@@ -307,6 +346,10 @@ def ensure_faiss_ready():
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "compact":
+        compact_index()
+        sys.exit(0)
+
     print("STARTING THE SERVER AT AMAZING LOCATION")
 
     
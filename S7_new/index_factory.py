@@ -0,0 +1,192 @@
+# index_factory.py
+
+import math
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+INDEX_MODES = ("flat", "ivf", "ivfpq", "hnsw")
+INDEX_MODE = os.getenv("FAISS_INDEX_MODE", "flat")
+TRAIN_THRESHOLD = int(os.getenv("FAISS_TRAIN_THRESHOLD", "50000"))
+NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+HNSW_EF_SEARCH = int(os.getenv("FAISS_HNSW_EF_SEARCH", "64"))
+TRAIN_SAMPLE = 256  # training vectors per IVF list
+MIN_TRAIN = 10_000  # below this, trained modes fall back to flat (PQ codebooks alone need ~10k)
+RRF_K = 60  # reciprocal rank fusion damping: higher flattens the advantage of the very top ranks
+
+
+def nlist_for(n_vectors: int) -> int:
+    """~4*sqrt(n) lists, but never fewer than 39 training points per list."""
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39, 65536))
+
+
+def pq_subquantizers(dim: int) -> int:
+    """Largest divisor of dim giving sub-vectors of at least 8 dimensions."""
+    for m in range(dim // 8, 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def build_index(dim: int, mode: str = "flat", n_vectors: int = 0, metric: int = faiss.METRIC_L2):
+    """Empty index for `mode` that accepts add_with_ids and remove_ids (HNSW: see `remove_ids`).
+
+    With metric=faiss.METRIC_INNER_PRODUCT and `normalize`d vectors, scores are cosine similarities.
+    """
+    if mode == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlat(dim, metric))
+    if mode == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, HNSW_M, metric)
+        hnsw.hnsw.efSearch = HNSW_EF_SEARCH
+        return faiss.IndexIDMap2(hnsw)
+    if mode in ("ivf", "ivfpq"):
+        nlist = nlist_for(n_vectors)
+        quantizer = faiss.IndexFlat(dim, metric)
+        if mode == "ivf":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_subquantizers(dim), 8, metric)
+        # Hashtable direct map keeps reconstruct() working alongside remove_ids()
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        index.nprobe = min(NPROBE, nlist)
+        return index
+    raise ValueError(f"Unknown FAISS index mode: {mode} (expected one of {INDEX_MODES})")
+
+
+def index_mode(index) -> str:
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(index, faiss.IndexIDMap) and isinstance(faiss.downcast_index(index.index), faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def index_ids(index) -> np.ndarray:
+    """Every id stored in the index, in storage order."""
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.vector_to_array(index.id_map)
+    invlists = faiss.extract_index_ivf(index).invlists
+    ids = [faiss.rev_swig_ptr(invlists.get_ids(l), invlists.list_size(l)).copy()
+           for l in range(invlists.nlist) if invlists.list_size(l)]
+    return np.concatenate(ids).astype(np.int64) if ids else np.empty(0, dtype=np.int64)
+
+
+def export_vectors(index) -> Tuple[np.ndarray, np.ndarray]:
+    """(ids, vectors) for everything in the index; IVF-PQ vectors are PQ reconstructions."""
+    ids = index_ids(index)
+    if not len(ids):
+        return ids, np.empty((0, index.d), dtype=np.float32)
+    if isinstance(index, faiss.IndexIDMap):
+        return ids, index.index.reconstruct_n(0, index.ntotal)
+    return ids, np.vstack([index.reconstruct(int(i)) for i in ids]).astype(np.float32)
+
+
+def populate(index, ids: np.ndarray, vectors: np.ndarray):
+    """Train `index` if it needs it, then add the vectors under their ids."""
+    if not index.is_trained:
+        sample = vectors
+        limit = TRAIN_SAMPLE * faiss.extract_index_ivf(index).nlist
+        if len(vectors) > limit:
+            sample = vectors[np.random.default_rng(0).choice(len(vectors), limit, replace=False)]
+        index.train(np.ascontiguousarray(sample, dtype=np.float32))
+    if len(ids):
+        index.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), np.asarray(ids, dtype=np.int64))
+    return index
+
+
+def _trainable(mode: str, n_vectors: int) -> str:
+    return "flat" if mode in ("ivf", "ivfpq") and n_vectors < MIN_TRAIN else mode
+
+
+def rebuild(index, ids: np.ndarray, vectors: np.ndarray, mode: str = None, metric: int = None):
+    """Fresh index of the same (or given) mode and metric holding exactly `ids`/`vectors`."""
+    mode = _trainable(mode or index_mode(index), len(ids))
+    metric = index.metric_type if metric is None else metric
+    return populate(build_index(index.d, mode, len(ids), metric), ids, vectors)
+
+
+def remove_ids(index, ids: Sequence[int]):
+    """Delete `ids` from any supported index; returns (index, removed).
+
+    HNSW cannot delete in place, so it is rebuilt from its remaining vectors.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(ids):
+        return index, 0
+    if isinstance(index, faiss.IndexIVF):
+        # The hashtable direct map only accepts an explicit id array
+        selector = faiss.IDSelectorArray(len(ids), faiss.swig_ptr(ids))
+    else:
+        selector = faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+    try:
+        return index, index.remove_ids(selector)
+    except RuntimeError:
+        stored, vectors = export_vectors(index)
+        keep = ~np.isin(stored, ids)
+        return rebuild(index, stored[keep], vectors[keep]), int((~keep).sum())
+
+
+def search_params(index, sel):
+    """SearchParameters of the type `index` expects (IVF needs its own, carrying nprobe) restricted to `sel`."""
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=sel, nprobe=inner.nprobe)
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=inner.hnsw.efSearch)
+    return faiss.SearchParameters(sel=sel)
+
+
+def index_for_corpus(dim: int, ids: np.ndarray, vectors: np.ndarray, mode: str = INDEX_MODE,
+                     threshold: int = TRAIN_THRESHOLD, metric: int = faiss.METRIC_L2):
+    """Build an index over a whole corpus: `mode` at or above `threshold` vectors, flat below."""
+    mode = _trainable(mode, len(ids)) if len(ids) >= threshold else "flat"
+    return populate(build_index(dim, mode, len(ids), metric), ids, vectors)
+
+
+def maybe_upgrade(index, mode: str = INDEX_MODE, threshold: int = TRAIN_THRESHOLD):
+    """Switch a flat index to `mode` once it holds `threshold` vectors, training on its contents."""
+    if index is None or mode == "flat" or index_mode(index) == mode or index.ntotal < threshold:
+        return index
+    ids, vectors = export_vectors(index)
+    return rebuild(index, ids, vectors, mode)
+
+
+def normalize(vectors) -> np.ndarray:
+    """Row-wise L2-normalized float32 copy, so inner product equals cosine similarity."""
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2, order="C")
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def select_hits(hits: Sequence[Tuple[Any, float]], k: int, min_score: Optional[float] = None,
+                max_gap: Optional[float] = None) -> List[Tuple[Any, float]]:
+    """Keep up to k (item, score) hits, best first, that clear `min_score` and are within `max_gap` of the best.
+
+    The gap rule gives a dynamic k: one strong match is returned alone
+    instead of being padded with weak neighbours.
+    """
+    hits = sorted(hits, key=lambda hit: hit[1], reverse=True)
+    if not hits:
+        return []
+    cutoff = hits[0][1] - max_gap if max_gap is not None else -np.inf
+    if min_score is not None:
+        cutoff = max(cutoff, min_score)
+    return [hit for hit in hits[:k] if hit[1] >= cutoff]
+
+
+def rrf_fuse(rankings: Sequence[Sequence[Any]], k: int = RRF_K) -> List[Tuple[Any, float]]:
+    """Reciprocal rank fusion of several best-first id lists into (id, score) pairs, best first.
+
+    Each list contributes 1 / (k + rank) per id, so only ranks matter and
+    scores on different scales (cosine, BM25) can be combined.
+    """
+    fused: Dict[Any, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, 1):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda hit: hit[1], reverse=True)
@@ -0,0 +1,237 @@
+# ingest.py
+
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+_converter = None
+_DONE = object()
+
+
+def convert_file(path: str) -> str:
+    """Convert one document to markdown with MarkItDown; runs in a worker process."""
+    global _converter
+    if _converter is None:
+        from markitdown import MarkItDown
+        _converter = MarkItDown()
+    return _converter.convert(path).text_content
+
+
+def _timed(convert, path):
+    start = time.perf_counter()
+    return convert(path), time.perf_counter() - start
+
+
+class StageStats:
+    """Item count and busy time of one pipeline stage."""
+
+    def __init__(self, name: str, unit: str, concurrency: int = 1):
+        self.name = name
+        self.unit = unit
+        self.concurrency = concurrency
+        self.items = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items: int, seconds: float):
+        with self._lock:
+            self.items += items
+            self.busy += seconds
+
+    @property
+    def rate(self) -> float:
+        """Items per second while the stage was busy, across all its workers."""
+        return self.items * self.concurrency / self.busy if self.busy else 0.0
+
+    def __str__(self):
+        return f"{self.name}: {self.items} {self.unit} in {self.busy:.2f}s busy ({self.rate:.1f} {self.unit}/s)"
+
+
+def run_pipeline(
+    files: Sequence[Path],
+    chunker: Callable[[str], List[str]],
+    embed_many: Callable[[List[str]], np.ndarray],
+    write: Callable[[Path, List[str], np.ndarray], None],
+    on_error: Callable[[Path, Exception], None],
+    workers: int = 4,
+    queue_size: int = 8,
+    batch_chunks: int = 64,
+    convert: Callable[[str], str] = convert_file,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> List[StageStats]:
+    """Convert, embed and write `files` as three overlapping stages.
+
+    Conversion runs on a process pool of `workers`, chunked files go through a
+    bounded queue to one embedding thread that batches chunks across small
+    files, and a single writer thread calls `write` so the index and chunk
+    store only ever see one writer. `on_progress(finished, total)` is called
+    as each file is written or fails. Returns per-stage stats.
+    """
+    convert_stats = StageStats("convert", "files", max(1, workers))
+    embed_stats = StageStats("embed", "chunks")
+    write_stats = StageStats("write", "chunks")
+    embed_q: queue.Queue = queue.Queue(maxsize=queue_size)
+    write_q: queue.Queue = queue.Queue(maxsize=queue_size)
+    total = len(files)
+    finished = 0
+    finished_lock = threading.Lock()
+
+    def file_finished():
+        nonlocal finished
+        with finished_lock:
+            finished += 1
+            count = finished
+        if on_progress is not None:
+            on_progress(count, total)
+
+    def fail(file, e):
+        on_error(file, e)
+        file_finished()
+
+    def embed_stage():
+        done = False
+        while not done:
+            group = [embed_q.get()]
+            if group[0] is _DONE:
+                break
+            # Coalesce queued small files into one embedding batch
+            while sum(len(chunks) for _, chunks in group) < batch_chunks:
+                try:
+                    item = embed_q.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _DONE:
+                    done = True
+                    break
+                group.append(item)
+
+            texts = [chunk for _, chunks in group for chunk in chunks]
+            start = time.perf_counter()
+            try:
+                vectors = embed_many(texts) if texts else np.empty((0, 0), dtype=np.float32)
+            except Exception as e:
+                for file, _ in group:
+                    fail(file, e)
+                continue
+            embed_stats.add(len(texts), time.perf_counter() - start)
+            offset = 0
+            for file, chunks in group:
+                write_q.put((file, chunks, vectors[offset:offset + len(chunks)]))
+                offset += len(chunks)
+        write_q.put(_DONE)
+
+    def write_stage():
+        while True:
+            item = write_q.get()
+            if item is _DONE:
+                return
+            file, chunks, vectors = item
+            start = time.perf_counter()
+            try:
+                write(file, chunks, vectors)
+            except Exception as e:
+                fail(file, e)
+                continue
+            write_stats.add(len(chunks), time.perf_counter() - start)
+            file_finished()
+
+    if on_progress is not None:
+        on_progress(0, total)
+    embed_thread = threading.Thread(target=embed_stage, name="ingest-embed", daemon=True)
+    write_thread = threading.Thread(target=write_stage, name="ingest-write", daemon=True)
+    embed_thread.start()
+    write_thread.start()
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else ThreadPoolExecutor(max_workers=1)
+    try:
+        remaining = iter(files)
+        pending = {}
+        while True:
+            # Keep a bounded number of conversions in flight
+            while len(pending) < max(1, workers) * 2:
+                file = next(remaining, None)
+                if file is None:
+                    break
+                pending[pool.submit(_timed, convert, str(file))] = file
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                file = pending.pop(future)
+                try:
+                    markdown, seconds = future.result()
+                    convert_stats.add(1, seconds)
+                    embed_q.put((file, chunker(markdown)))
+                except Exception as e:
+                    fail(file, e)
+    finally:
+        pool.shutdown()
+        embed_q.put(_DONE)
+        embed_thread.join()
+        write_thread.join()
+
+    return [convert_stats, embed_stats, write_stats]
+
+
+class IndexingJob:
+    """Runs one indexing function at a time on a background thread and tracks its progress.
+
+    `target` is called with an `on_progress(finished, total)` keyword argument.
+    """
+
+    def __init__(self, target: Callable[..., None]):
+        self.target = target
+        self.state = "idle"  # idle | indexing | ready | failed
+        self.finished = 0
+        self.total = 0
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> bool:
+        """Start the job unless it is already running; returns True if a new run started."""
+        with self._lock:
+            if self.state == "indexing":
+                return False
+            self.state, self.finished, self.total, self.error = "indexing", 0, 0, None
+            self._thread = threading.Thread(target=self._run, name="indexing-job", daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self):
+        try:
+            self.target(on_progress=self._progress)
+        except Exception as e:
+            with self._lock:
+                self.state, self.error = "failed", str(e)
+            return
+        with self._lock:
+            self.state = "ready"
+
+    def _progress(self, finished: int, total: int):
+        with self._lock:
+            self.finished, self.total = finished, total
+
+    @property
+    def running(self) -> bool:
+        return self.state == "indexing"
+
+    def wait(self, timeout: Optional[float] = None):
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def status(self) -> str:
+        """Human-readable readiness, e.g. "indexing 40%"."""
+        with self._lock:
+            if self.state == "indexing":
+                percent = int(100 * self.finished / self.total) if self.total else 0
+                return f"indexing {percent}%"
+            if self.state == "failed":
+                return f"failed: {self.error}"
+            return self.state
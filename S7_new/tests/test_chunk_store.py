@@ -0,0 +1,56 @@
+"""ChunkStore ids, transactions and BM25 keyword search."""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from chunk_store import ChunkStore  # noqa: E402
+
+
+def rows(doc, *texts):
+    return [{"doc": doc, "chunk": text, "chunk_id": f"{doc}_{i}"} for i, text in enumerate(texts)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ChunkStore(tmp_path / "chunks.db")
+    yield store
+    store.close()
+
+
+def test_reserved_ids_are_never_handed_out_again(tmp_path, store):
+    start = store.reserve_ids(3)
+    store.append(range(start, start + 3), rows("a", "x", "y", "z"))
+    store.delete(range(start, start + 3))
+    assert store.reserve_ids(2) == start + 3
+    # Another connection to the same database continues the same sequence
+    other = ChunkStore(tmp_path / "chunks.db")
+    assert other.reserve_ids(1) == start + 5
+    other.close()
+
+
+def test_replace_docs_swaps_rows_and_keyword_index_together(store):
+    store.append([0, 1], rows("a", "old alpha", "old beta"))
+    store.append([2], rows("b", "untouched gamma"))
+    store.replace_docs(["a"], [3], rows("a", "new alpha"))
+    assert store.ids_for_doc("a") == [3]
+    assert store.keyword_search("beta") == []
+    assert [i for i, _ in store.keyword_search("alpha")] == [3]
+    assert store.get(2)["chunk"] == "untouched gamma"
+
+
+def test_failed_replace_docs_leaves_the_old_rows(store):
+    store.append([0], rows("a", "old alpha"))
+    with pytest.raises(KeyError):
+        store.replace_docs(["a"], [1], [{"doc": "a", "chunk": "no chunk_id"}])
+    assert store.ids_for_doc("a") == [0]
+    assert [i for i, _ in store.keyword_search("alpha")] == [0]
+
+
+def test_keyword_search_ranks_rare_terms_and_ignores_stopwords(store):
+    store.append(range(4), rows("a", "the report", "the report on Gensol", "the weather", "a report"))
+    assert store.keyword_search("what is the") == []
+    assert store.keyword_search("Gensol report")[0][0] == 1
+    assert store.keyword_search("payments")[:1] == store.keyword_search("payment")[:1]
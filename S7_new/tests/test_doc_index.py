@@ -0,0 +1,104 @@
+"""Doc cache, FAISS index and chunk store stay in agreement across document updates and deletes."""
+
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from chunk_store import ChunkStore  # noqa: E402
+from doc_index import (DOC_CACHE_NAME, INDEX_NAME, IndexHolder, commit_documents, compact, expand_ranges,  # noqa: E402
+                       load_index)
+from index_factory import export_vectors  # noqa: E402
+
+DIM = 8
+
+
+def document(name: str, version: str, n: int):
+    rows = [{"doc": name, "chunk": f"{name} {version} chunk{i}", "chunk_id": f"{name}_{i}"} for i in range(n)]
+    vectors = np.random.default_rng(abs(hash((name, version))) % 2**32).standard_normal((n, DIM)).astype(np.float32)
+    return f"{name}-{version}", rows, vectors
+
+
+def assert_in_agreement(index_dir: Path, store: ChunkStore):
+    cache = json.loads((index_dir / DOC_CACHE_NAME).read_text())
+    cached = {name: set(expand_ranges(entry["ranges"])) for name, entry in cache.items()}
+    index_ids = set(export_vectors(load_index(index_dir / INDEX_NAME))[0].tolist())
+    id_docs = store.id_docs()
+    assert index_ids == set(id_docs) == set().union(*cached.values())
+    for name, ids in cached.items():
+        assert {i for i, doc in id_docs.items() if doc == name} == ids
+    return cache
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ChunkStore(tmp_path / "chunks.db")
+    yield store
+    store.close()
+
+
+def test_update_and_delete_keep_cache_index_and_store_in_agreement(tmp_path, store):
+    a, b = document("a.txt", "v1", 3), document("b.txt", "v1", 2)
+    assert commit_documents(tmp_path, store, {"a.txt", "b.txt"}, {"a.txt": a, "b.txt": b})
+    assert set(assert_in_agreement(tmp_path, store)) == {"a.txt", "b.txt"}
+
+    # a.txt shrinks, b.txt is removed from documents/
+    assert commit_documents(tmp_path, store, {"a.txt"}, {"a.txt": document("a.txt", "v2", 2)})
+    cache = assert_in_agreement(tmp_path, store)
+    assert set(cache) == {"a.txt"}
+    assert cache["a.txt"]["hash"] == "a.txt-v2"
+    assert store.keyword_search("v1") == []
+    assert store.keyword_search("b") == []
+
+
+def test_same_hash_is_not_committed_twice(tmp_path, store):
+    a = document("a.txt", "v1", 3)
+    assert commit_documents(tmp_path, store, {"a.txt"}, {"a.txt": a})
+    # Another process indexed a.txt at this hash while we were embedding it
+    assert not commit_documents(tmp_path, store, {"a.txt"}, {"a.txt": a})
+    assert len(store) == 3
+
+
+def test_crash_before_the_store_commit_is_repaired_by_the_next_run(tmp_path, store, monkeypatch):
+    assert commit_documents(tmp_path, store, {"a.txt"}, {"a.txt": document("a.txt", "v1", 3)})
+
+    def crash(*args):
+        raise RuntimeError("killed")
+
+    with monkeypatch.context() as m:
+        m.setattr(store, "replace_docs", crash)
+        with pytest.raises(RuntimeError):
+            commit_documents(tmp_path, store, {"a.txt"}, {"a.txt": document("a.txt", "v2", 4)})
+    # The doc cache still has the old hash, so the file is indexed again
+    assert json.loads((tmp_path / DOC_CACHE_NAME).read_text())["a.txt"]["hash"] == "a.txt-v1"
+
+    assert commit_documents(tmp_path, store, {"a.txt"}, {"a.txt": document("a.txt", "v2", 4)})
+    cache = assert_in_agreement(tmp_path, store)
+    assert cache["a.txt"]["hash"] == "a.txt-v2"
+    assert len(store) == 4
+
+
+def test_compact_drops_stale_vectors_and_renumbers(tmp_path, store):
+    assert commit_documents(tmp_path, store, {"a.txt", "b.txt"},
+                            {"a.txt": document("a.txt", "v1", 3), "b.txt": document("b.txt", "v1", 2)})
+    assert commit_documents(tmp_path, store, {"a.txt", "b.txt"}, {"a.txt": document("a.txt", "v2", 2)})
+    cache = json.loads((tmp_path / DOC_CACHE_NAME).read_text())
+
+    index = compact(load_index(tmp_path / INDEX_NAME), store, cache)
+    assert sorted(export_vectors(index)[0].tolist()) == list(range(4))
+    assert sorted(store.id_docs()) == list(range(4))
+    assert sorted(i for entry in cache.values() for i in expand_ranges(entry["ranges"])) == list(range(4))
+
+
+def test_hybrid_search_finds_a_rare_term_by_keyword(tmp_path, store):
+    a, b = document("a.txt", "v1", 3), document("b.txt", "v1", 2)
+    b[1][1]["chunk"] = "the Capbridge transfer"
+    assert commit_documents(tmp_path, store, {"a.txt", "b.txt"}, {"a.txt": a, "b.txt": b})
+    holder = IndexHolder(tmp_path, store)
+    # The query vector points at a.txt; only the keyword ranking knows about Capbridge
+    hits = holder.hybrid_search("who used Capbridge", a[2][:1], k=5, candidates=5)
+    assert "b.txt_1" in [row["chunk_id"] for row, _ in hits]
+    assert holder.search(a[2][:1], k=1)[0][0]["chunk_id"] == "a.txt_0"
@@ -0,0 +1,44 @@
+"""Regression tests for the ingest pipeline."""
+
+import sys
+import threading
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from ingest import run_pipeline  # noqa: E402
+
+QUEUE_SIZE = 2
+
+
+def convert(path: str) -> str:
+    if path.endswith("bad.txt"):
+        raise ValueError("cannot convert")
+    return f"text of {path}"
+
+
+def test_pipeline_finishes_more_files_than_queue_size_with_a_failure():
+    files = [Path(f"doc{i}.txt") for i in range(20)] + [Path("bad.txt")]
+    written, failed, progress = [], [], []
+
+    def run():
+        run_pipeline(
+            files,
+            chunker=lambda text: [text],
+            embed_many=lambda texts: np.zeros((len(texts), 4), dtype=np.float32),
+            write=lambda file, chunks, vectors: written.append(file),
+            on_error=lambda file, e: failed.append(file),
+            workers=1,
+            queue_size=QUEUE_SIZE,
+            convert=convert,
+            on_progress=lambda finished, total: progress.append((finished, total)),
+        )
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=30)
+    assert not thread.is_alive(), "pipeline deadlocked"
+    assert sorted(written) == sorted(files[:-1])
+    assert failed == [Path("bad.txt")]
+    assert progress[-1] == (len(files), len(files))
@@ -0,0 +1,122 @@
+"""MemoryManager persistence, TTL, dedup and shard eviction, with a deterministic fake embedder."""
+
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import memory  # noqa: E402
+from memory import META_NAME, MemoryItem, MemoryManager, ShardedMemoryManager, normalize  # noqa: E402
+
+DIM = 16
+
+
+class FakeClient:
+    """Vectors seeded by the text, so equal texts embed equally; 'x~' prefixes a near-duplicate."""
+
+    def embed(self, text: str) -> np.ndarray:
+        base = text.removeprefix("x~")
+        vec = np.random.default_rng(sum(base.encode())).standard_normal(DIM).astype(np.float32)
+        if text != base:
+            vec += 0.01 * np.random.default_rng(1).standard_normal(DIM).astype(np.float32)
+        return vec
+
+    def embed_many(self, texts):
+        return np.stack([self.embed(t) for t in texts])
+
+
+@pytest.fixture(autouse=True)
+def fake_client(monkeypatch):
+    monkeypatch.setattr(memory, "get_client", lambda *args: FakeClient())
+
+
+def query(text: str) -> np.ndarray:
+    return normalize(FakeClient().embed(text)[None, :])
+
+
+def test_save_and_load_round_trip(tmp_path):
+    m = MemoryManager(path=tmp_path)
+    m.bulk_add([MemoryItem(text=f"fact {i}", tags=["t"], session_id="s1") for i in range(5)])
+    m.save()
+    m.add(MemoryItem(text="fact 0", session_id="s2"))  # merged into a saved memory
+    m.add(MemoryItem(text="late fact", type="preference"))
+    m.save()
+
+    loaded = MemoryManager(path=tmp_path)
+    assert len(loaded.data) == 6
+    assert loaded.data.hits[0] == 2
+    assert loaded.data.sessions(0) == ["s1", "s2"]
+    assert np.array_equal(loaded.embeddings, m.embeddings)
+    hit, _ = loaded.retrieve_vector(query("late fact"), 1, type_filter="preference", recency_weight=0)[0]
+    assert hit.text == "late fact"
+    assert {i.text for i, _ in loaded.retrieve_vector(query("fact 0"), 5, session_filter="s2", min_score=None)} \
+        == {"fact 0"}
+
+
+def test_load_drops_a_tail_written_after_the_last_commit(tmp_path):
+    m = MemoryManager(path=tmp_path)
+    m.bulk_add([MemoryItem(text=f"fact {i}") for i in range(3)])
+    m.save()
+    meta = json.loads((tmp_path / META_NAME).read_text())
+    # A crash between the appends and meta.json: half a record and a partial vector
+    with open(tmp_path / meta["items"], "a", encoding="utf-8") as f:
+        f.write('{"text": "torn')
+    with open(tmp_path / meta["embeddings"], "ab") as f:
+        f.write(b"\0" * 10)
+
+    loaded = MemoryManager(path=tmp_path)
+    assert len(loaded.data) == 3
+    loaded.add(MemoryItem(text="after the crash"))
+    loaded.save()
+    reloaded = MemoryManager(path=tmp_path)
+    assert len(reloaded.data) == 4
+    assert reloaded.data[3].text == "after the crash"
+
+
+def test_compact_evicts_expired_memories_and_persists(tmp_path):
+    m = MemoryManager(path=tmp_path, ttl={"tool_output": 60.0})
+    m.add(MemoryItem(text="old output", type="tool_output", timestamp="2000-01-01T00:00:00"))
+    m.add(MemoryItem(text="a preference", type="preference", timestamp="2000-01-01T00:00:00"))
+    m.add(MemoryItem(text="new output", type="tool_output"))
+    m.save()
+    assert m.compact() == 1
+    m.save()
+
+    loaded = MemoryManager(path=tmp_path)
+    assert sorted(loaded.data[i].text for i in range(len(loaded.data))) == ["a preference", "new output"]
+    assert loaded.index.ntotal == 2
+
+
+def test_near_duplicates_merge_across_sessions_but_not_across_tools(tmp_path):
+    m = MemoryManager()
+    first = m.add(MemoryItem(text="weather is sunny", type="tool_output", tool_name="weather", session_id="a"))
+    assert m.add(MemoryItem(text="x~weather is sunny", type="tool_output", tool_name="weather",
+                            session_id="b")) == first
+    assert m.add(MemoryItem(text="weather is sunny", type="tool_output", tool_name="other")) != first
+    assert m.add(MemoryItem(text="weather is sunny", type="fact")) != first
+    assert m.data.hits[first] == 2
+    assert m.data.sessions(first) == ["a", "b"]
+
+
+def test_type_filter_selects_ids_past_the_first_bitmap_byte():
+    m = MemoryManager()
+    types = ["fact" if i % 3 else "preference" for i in range(13)]
+    m.bulk_add([MemoryItem(text=f"memory {i}", type=t) for i, t in enumerate(types)])
+    hits = m.retrieve_vector(query("memory 12"), 13, type_filter="preference", min_score=None, recency_weight=0)
+    assert sorted(item.text for item, _ in hits) == sorted(f"memory {i}" for i in range(0, 13, 3))
+
+
+def test_evicted_shard_is_saved_and_reloaded(tmp_path):
+    shards = ShardedMemoryManager(tmp_path, max_resident=1)
+    shards.add(MemoryItem(text="alpha"), tenant="a")
+    shards.add(MemoryItem(text="beta"), tenant="b")  # evicts tenant a
+    assert shards.stats()["resident_shards"] == 1
+    assert shards.evictions == 1
+    hit, _ = shards.retrieve("alpha", 1, tenant="a", recency_weight=0)[0]
+    assert hit.text == "alpha"
+    assert shards.loads == 3
+    assert shards.shard_keys() == ["a", "b"]
+    shards.close()
@@ -0,0 +1,40 @@
+"""Feature scoring of the lightweight rerank stage."""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from rerank import chunk_position, rerank, terms  # noqa: E402
+
+
+def hit(chunk_id, text):
+    return {"doc": "d", "chunk_id": chunk_id, "chunk": text}, 0.0
+
+
+def test_terms_drop_stopwords():
+    assert terms("What is the Capbridge payment?") == {"capbridge", "payment"}
+
+
+def test_chunk_position_from_chunk_id():
+    assert chunk_position("INVG67564_13") == 13
+    assert chunk_position("no-number") == 0
+
+
+def test_entity_mention_beats_a_better_first_stage_rank():
+    hits = [hit("d_1", "an unrelated paragraph"), hit("d_2", "Anmol Singh paid Capbridge")]
+    ranked = rerank("how much was paid", hits, 2, entities=["Capbridge"])
+    assert [row["chunk_id"] for row, _ in ranked] == ["d_2", "d_1"]
+
+
+def test_keeps_k_best_first():
+    hits = [hit(f"d_{i}", "payment" if i % 2 else "other") for i in range(6)]
+    ranked = rerank("payment", hits, 3)
+    # Term overlap lifts d_3 above d_2 but not above the first-stage leader d_0
+    assert [row["chunk_id"] for row, _ in ranked] == ["d_1", "d_0", "d_3"]
+    assert [s for _, s in ranked] == sorted((s for _, s in ranked), reverse=True)
+
+
+def test_weights_override_the_defaults():
+    hits = [hit("d_0", "other"), hit("d_1", "payment")]
+    only_rank = rerank("payment", hits, 2, weights=(1.0, 0.0, 0.0, 0.0))
+    assert only_rank[0][0]["chunk_id"] == "d_0"
@@ -11,6 +11,9 @@ from tqdm import tqdm
 import faiss
 import numpy as np
 from markitdown import MarkItDown
+from chunk_store import ChunkStore, migrate_metadata_json
+from doc_index import write_index_atomic, write_text_atomic, publish_generation, new_index, load_index
+from index_factory import maybe_upgrade, normalize
 from google.generativeai import GenerativeModel
 import os
 from dotenv import load_dotenv
@@ -32,8 +35,10 @@ class WebCrawler:
         self.index_cache = Path("faiss_index")
         self.index_cache.mkdir(exist_ok=True)
         self.index_file = self.index_cache / "index.bin"
-        self.metadata_file = self.index_cache / "metadata.json"
         self.cache_file = self.index_cache / "url_index_cache.json"
+        self.store = ChunkStore(self.index_cache / "chunks.db")
+        migrate_metadata_json(self.store, self.index_cache / "metadata.json")
+        self.index = load_index(self.index_file)
 
     def is_valid_url(self, url: str) -> bool:
         """Check if URL is valid and should be crawled"""
@@ -138,11 +143,8 @@ class WebCrawler:
             markdown = result.text_content
             chunks = list(self.chunk_text(markdown))
             
-            # Load existing index and metadata
             cache_meta = json.loads(self.cache_file.read_text()) if self.cache_file.exists() else {}
-            metadata = json.loads(self.metadata_file.read_text()) if self.metadata_file.exists() else []
-            index = faiss.read_index(str(self.index_file)) if self.index_file.exists() else None
-            
+
             # Generate embeddings and update index
             embeddings_for_page = []
             new_metadata = []
@@ -151,26 +153,24 @@ class WebCrawler:
                 embedding = self.get_embedding(chunk)
                 embeddings_for_page.append(embedding)
                 new_metadata.append({
-                    "url": url,
+                    "doc": url,
                     "chunk": chunk,
                     "chunk_id": f"{hashlib.md5(url.encode()).hexdigest()}_{i}"
                 })
 
             if embeddings_for_page:
-                if index is None:
+                if self.index is None:
                     dim = len(embeddings_for_page[0])
-                    index = faiss.IndexFlatL2(dim)
-                index.add(np.stack(embeddings_for_page))
-                metadata.extend(new_metadata)
-            
-            # Update cache and save
+                    self.index = new_index(dim)
+                # Only this page's rows are written; the index is saved once in crawl()
+                start = self.store.reserve_ids(len(new_metadata))
+                self.store.append(range(start, start + len(new_metadata)), new_metadata)
+                self.index.add_with_ids(normalize(embeddings_for_page),
+                                        np.arange(start, start + len(new_metadata), dtype=np.int64))
+
             cache_meta[url] = hashlib.md5(text.encode()).hexdigest()
-            self.cache_file.write_text(json.dumps(cache_meta, indent=2))
-            self.metadata_file.write_text(json.dumps(metadata, indent=2))
-            
-            if index and index.ntotal > 0:
-                faiss.write_index(index, str(self.index_file))
-            
+            write_text_atomic(self.cache_file, json.dumps(cache_meta, indent=2))
+
             self.pages_processed += 1
 
             # Get links and process them
@@ -185,7 +185,17 @@ class WebCrawler:
         except Exception as e:
             print(f"Error processing {url}: {e}")
 
+    def save_index(self):
+        """Write the in-memory index to disk and notify resident readers"""
+        if self.index is not None and self.index.ntotal > 0:
+            self.index = maybe_upgrade(self.index)
+            write_index_atomic(self.index, self.index_file)
+            publish_generation(self.index_cache)
+
     def crawl(self):
         """Start the crawling process"""
-        self.process_url(self.start_url)
+        try:
+            self.process_url(self.start_url)
+        finally:
+            self.save_index()
         print(f"Crawling completed. Processed {self.pages_processed} pages.") 
\ No newline at end of file
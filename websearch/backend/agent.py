@@ -4,6 +4,7 @@ Main Flask agent application for vector store assistant.
 """
 
 import os
+import atexit
 import faiss
 import numpy as np
 import requests as req
@@ -45,6 +46,11 @@ CORS(app, resources={
 
 # Initialize memory manager (handles embeddings and FAISS)
 memory_manager = MemoryManager()
+# Deleted pages' vectors are removed from FAISS in the background
+memory_manager.start_compactor()
+# Page logs are flushed to disk in the background too, and once more at exit
+memory_manager.start_persister()
+atexit.register(memory_manager.close)
 
 class URLRequest(BaseModel):
     """URLRequest model for URL requests."""
@@ -133,7 +139,7 @@ def summary():
     request_model = SummaryRequest(**data)
     url = request_model.url
     # Find all chunks for the url
-    chunks = [c["chunk"] for c in memory_manager.chunks if c["url"] == url]
+    chunks = memory_manager.page_chunks(url)
     if not chunks:
         return jsonify({"error": "No content found for this URL. Please index it first."})
     context = "\n\n".join(chunks)
@@ -191,7 +197,7 @@ def list_pages():
     A list of unique URLs.
     """
     # Return unique URLs indexed
-    urls = list({c["url"] for c in memory_manager.chunks})
+    urls = memory_manager.urls()
     return jsonify({"urls": urls})
 
 @app.route("/delete_page", methods=["POST"])
@@ -205,21 +211,9 @@ def delete_page():
     data = request.get_json()
     request_model = DeletePageRequest(**data)
     url = request_model.url
-    # Remove all chunks for this URL and rebuild index
-    old_indices = [i for i, c in enumerate(memory_manager.chunks) if c["url"] == url]
-    if not old_indices:
+    # Only this page's chunk ids are touched; its vectors leave FAISS at the next compaction
+    if not memory_manager.delete_page(url):
         return jsonify({"status": "not_found", "url": url})
-    keep_indices = [i for i in range(len(memory_manager.chunks)) if i not in old_indices]
-    if keep_indices:
-        kept_embs = [memory_manager.chunks[i]["embedding"] for i in keep_indices]
-        memory_manager.index = faiss.IndexFlatL2(memory_manager.model.get_sentence_embedding_dimension())
-        if kept_embs:
-            memory_manager.index.add(np.array(kept_embs).astype('float32'))
-        memory_manager.chunks = [memory_manager.chunks[i] for i in keep_indices]
-    else:
-        memory_manager.index = faiss.IndexFlatL2(memory_manager.model.get_sentence_embedding_dimension())
-        memory_manager.chunks = []
-    memory_manager._save_index()
     return jsonify({"status": "deleted", "url": url})
 
 @app.route("/health", methods=["GET"])
@@ -252,7 +246,9 @@ def faiss_stats():
         return jsonify({
             "faiss_vectors": num_vecs,
             "embedding_dim": dim,
-            "num_chunks": len(memory_manager.chunks),
+            "num_chunks": len(memory_manager.store),
+            "pending_deletes": len(memory_manager.deleted),
+            "persistence": memory_manager.persist_stats(),
             "faiss_index_type": type(memory_manager.index).__name__
         })
     except Exception as e:
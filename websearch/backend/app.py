@@ -9,6 +9,7 @@ import hashlib
 import os
 import json
 import numpy as np
+from index_factory import build_index, index_mode, maybe_upgrade, remove_ids
 
 # === Logging Configuration ===
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -17,9 +18,11 @@ app = Flask(__name__)
 CORS(app)
 
 # === In-memory storage ===
-index = faiss.IndexFlatL2(384)  # For model 'all-MiniLM-L6-v2'
+EMBED_DIM = 384  # For model 'all-MiniLM-L6-v2'
+index = build_index(EMBED_DIM)  # Flat until FAISS_TRAIN_THRESHOLD vectors
 page_data = {}  # URL -> list of (chunk, vector)
-url_map = {}    # URL -> [chunk indices in index]
+url_map = {}    # URL -> [chunk ids in index]
+id_map = []     # chunk id -> (URL, offset into page_data[URL]), None once deleted; ids are never reused
 
 # === Load embedding model ===
 model = SentenceTransformer('all-MiniLM-L6-v2')
@@ -40,6 +43,15 @@ def embed_chunks(chunks):
     """Generate embeddings for each chunk."""
     return model.encode(chunks, show_progress_bar=False)
 
+def drop_page(url):
+    """Remove a page's vectors from the index and forget its chunks."""
+    global index
+    ids = url_map.pop(url, [])
+    index, _ = remove_ids(index, ids)
+    for i in ids:
+        id_map[i] = None
+    page_data.pop(url, None)
+
 # === Routes ===
 @app.route('/health')
 def health():
@@ -50,6 +62,7 @@ def health():
 @app.route('/log_page', methods=['POST'])
 def log_page():
     """Logs a page's content by URL and stores its embeddings."""
+    global index
     url = request.json.get('url')
     logging.info(f"Logging page for URL: {url}")
     try:
@@ -57,12 +70,16 @@ def log_page():
         text = clean_html(html)
         chunks = split_chunks(text)
         vectors = embed_chunks(chunks)
-        index.add(vectors)
+        # Re-logging a page replaces its earlier chunks
+        drop_page(url)
+        ids = list(range(len(id_map), len(id_map) + len(chunks)))
+        index.add_with_ids(vectors, np.array(ids, dtype=np.int64))
+        index = maybe_upgrade(index)
 
         # Store metadata
-        ids = list(range(index.ntotal - len(chunks), index.ntotal))
         page_data[url] = list(zip(chunks, vectors.tolist()))
         url_map[url] = ids
+        id_map.extend((url, offset) for offset in range(len(chunks)))
 
         logging.info(f"Successfully logged page: {url}")
         return jsonify(success=True, message="Page logged.")
@@ -97,12 +114,11 @@ def user_query():
         matched_chunks = []
         source_urls = []
         for i in I[0]:
-            for url, ids in url_map.items():
-                if i in ids:
-                    chunk_text = page_data[url][ids.index(i)][0]
-                    matched_chunks.append(chunk_text)
-                    source_urls.append(url)
-                    break
+            entry = id_map[i] if i >= 0 else None
+            if entry is not None:
+                url, offset = entry
+                matched_chunks.append(page_data[url][offset][0])
+                source_urls.append(url)
 
         answer = "\n\n".join(matched_chunks)
         return jsonify(answer=answer, found_answer=True, source_urls=list(set(source_urls)))
@@ -118,32 +134,14 @@ def list_pages():
 
 @app.route('/delete_page', methods=['POST'])
 def delete_page():
-    """Delete an indexed page and rebuild the FAISS index."""
+    """Delete an indexed page's vectors from the FAISS index."""
     url = request.json.get('url')
     logging.info(f"Request to delete page: {url}")
     if url in url_map:
         try:
-            # Rebuild index without deleted vectors
-            keep_chunks = []
-            for u, chunks in page_data.items():
-                if u != url:
-                    keep_chunks.extend([v for _, v in chunks])
-
-            global index
-            index = faiss.IndexFlatL2(384)
-            index.add(np.array(keep_chunks).astype('float32'))
-
-            # Update metadata
-            del page_data[url]
-            del url_map[url]
-            url_map.clear()
-            offset = 0
-            for u, chunks in page_data.items():
-                ids = list(range(offset, offset + len(chunks)))
-                url_map[u] = ids
-                offset += len(chunks)
-
-            logging.info(f"Successfully deleted and rebuilt index excluding: {url}")
+            # Only this page's ids go; every other id keeps its place in id_map
+            drop_page(url)
+            logging.info(f"Successfully deleted page from index: {url}")
             return jsonify(success=True)
         except Exception as e:
             logging.exception("Error deleting page")
@@ -157,7 +155,8 @@ def faiss_stats():
     return jsonify(
         num_chunks=index.ntotal,
         embedding_dim=index.d,
-        faiss_index_type=str(type(index).__name__)
+        faiss_index_type=str(type(index).__name__),
+        index_mode=index_mode(index)
     )
 
 if __name__ == '__main__':
@@ -0,0 +1,95 @@
+"""Indexing throughput (chunks/sec) of websearch MemoryManager on CPU.
+
+A synthetic corpus of --pages pages (3-8 chunks of CHUNK_SIZE characters
+each) is indexed three ways:
+
+  per-chunk   the previous add_to_index: encode(chunk) and a one-row FAISS add per chunk
+  per-page    add_to_index: one micro-batched encode and one FAISS add per page
+  add_pages   one call over the whole corpus, with --workers encoder processes
+
+The per-chunk and per-page paths run on the first --sample pages only, so
+their rate is measured, not extrapolated. per-chunk also rewrites a full
+snapshot after every page, as the old chunks.pkl save did.
+
+Usage: python benchmarks/bench_add_to_index.py [--pages 10000] [--sample 200] [--workers 4]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")  # CPU only
+
+import numpy as np  # noqa: E402
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from memory import CHUNK_SIZE, MemoryManager  # noqa: E402
+
+
+def corpus(pages: int, seed: int = 0):
+    rng = random.Random(seed)
+    vocab = [f"{rng.choice('bcdfghklmnprstvz')}{rng.choice('aeiou')}{rng.choice('lmnrst')}{i % 97}" for i in range(5000)]
+    for p in range(pages):
+        text = " ".join(rng.choice(vocab) for _ in range(rng.randint(3, 8) * CHUNK_SIZE // 6))
+        yield f"https://example.com/page/{p}", text
+
+
+def per_chunk(memory: MemoryManager, url: str, chunks):
+    embs, ids = [], []
+    for chunk in chunks:
+        emb = np.array([memory.embed(chunk)]).astype("float32")
+        chunk_id = np.array([memory.next_id], dtype=np.int64)
+        memory.next_id += 1
+        memory.index.add_with_ids(emb, chunk_id)
+        embs.append(emb)
+        ids.append(chunk_id)
+    memory.store.add(url, np.concatenate(ids), chunks, np.concatenate(embs))
+
+
+def report(name: str, n_chunks: int, elapsed: float):
+    print(f"{name:<10} {n_chunks:>8} chunks {elapsed:8.1f} s {n_chunks / elapsed:9.1f} chunks/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=10_000)
+    parser.add_argument("--sample", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        def fresh(name):
+            return MemoryManager(os.path.join(tmp, name))
+
+        memory = fresh("setup")
+        pages = {url: memory.chunk_text(text) for url, text in corpus(args.pages)}
+        sample = dict(list(pages.items())[:args.sample])
+        print(f"{len(pages)} pages, {sum(map(len, pages.values()))} chunks; "
+              f"per-chunk/per-page on {len(sample)} pages")
+
+        memory = fresh("per_chunk")
+        start = time.perf_counter()
+        for url, chunks in sample.items():
+            per_chunk(memory, url, chunks)
+            memory.store.checkpoint(memory.index)
+        report("per-chunk", len(memory.store), time.perf_counter() - start)
+
+        memory = fresh("per_page")
+        start = time.perf_counter()
+        for url, chunks in sample.items():
+            memory.add_to_index(url, chunks)
+        report("per-page", len(memory.store), time.perf_counter() - start)
+
+        for workers in sorted({1, args.workers}):
+            memory = fresh(f"add_pages_{workers}")
+            start = time.perf_counter()
+            memory.add_pages(pages, workers=workers)
+            report(f"add_pages/{workers}", len(memory.store), time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
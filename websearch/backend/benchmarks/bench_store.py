@@ -0,0 +1,103 @@
+"""Persistence cost of websearch chunk storage: chunks.pkl vs. PageStore.
+
+A synthetic store of --chunks chunks (random vectors, CHUNK_SIZE-character
+texts) is saved and reopened both ways:
+
+  pickle     the previous format: every chunk dict, embedding included, pickled on each save
+  pagestore  snapshot (.npy matrix + columnar metadata) plus write-ahead log
+
+Reported: time to append one more page (incremental save), bytes that
+append writes, and time to open the store at startup.
+
+Usage: python benchmarks/bench_store.py [--chunks 100000] [--dim 384]
+"""
+
+import argparse
+import os
+import pickle
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from page_store import PageStore  # noqa: E402
+
+CHUNK_SIZE = 1000
+CHUNKS_PER_PAGE = 5
+
+
+def pages(n_chunks: int, dim: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    text = "lorem ipsum " * (CHUNK_SIZE // 12)
+    for p in range(0, n_chunks, CHUNKS_PER_PAGE):
+        n = min(CHUNKS_PER_PAGE, n_chunks - p)
+        yield f"https://example.com/page/{p}", list(range(p, p + n)), [text] * n, \
+            rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def bench_pickle(tmp: Path, args):
+    path = tmp / "chunks.pkl"
+    chunks = {}
+    for url, ids, texts, vectors in pages(args.chunks, args.dim):
+        for position, (i, text, vec) in enumerate(zip(ids, texts, vectors)):
+            chunks[i] = {"url": url, "chunk": text, "embedding": vec, "position": position}
+    with open(path, "wb") as f:
+        pickle.dump(chunks, f)
+
+    def append():
+        chunks[args.chunks] = {"url": "new", "chunk": "x", "embedding": np.zeros(args.dim, np.float32), "position": 0}
+        with open(path, "wb") as f:
+            pickle.dump(chunks, f)
+
+    _, save = timed(append)
+    written = path.stat().st_size
+
+    def load():
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    _, startup = timed(load)
+    return save, written, startup
+
+
+def bench_pagestore(tmp: Path, args):
+    store = PageStore(tmp / "store", args.dim)
+    for page in pages(args.chunks, args.dim):
+        store.add(*page)
+    store.checkpoint()
+    before = store.wal_bytes()
+    _, save = timed(lambda: store.add("new", [args.chunks], ["x"], np.zeros((1, args.dim), np.float32)))
+    written = store.wal_bytes() - before
+    store.close()
+
+    reopened, startup = timed(lambda: PageStore(tmp / "store", args.dim))
+    assert len(reopened) == args.chunks + 1
+    reopened.close()
+    return save, written, startup
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=384)
+    args = parser.parse_args()
+
+    print(f"{args.chunks} chunks, dim {args.dim}")
+    print(f"{'format':<10} {'append+save':>12} {'bytes written':>14} {'startup':>10}")
+    for name, bench in (("pickle", bench_pickle), ("pagestore", bench_pagestore)):
+        with tempfile.TemporaryDirectory() as tmp:
+            save, written, startup = bench(Path(tmp), args)
+        print(f"{name:<10} {save * 1000:10.1f}ms {written:>14,} {startup * 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
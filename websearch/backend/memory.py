@@ -1,20 +1,62 @@
 import os
+import threading
+import time
 import faiss
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from typing import List, Dict
 import pickle
+from index_factory import build_index, index_for_corpus, index_ids, index_mode, maybe_upgrade, remove_ids, search_params
+from page_store import PageStore
 
 CHUNK_SIZE = 1000  # tokens
 MODEL_NAME = "all-MiniLM-L6-v2"
-FAISS_INDEX_PATH = os.path.join(os.path.dirname(__file__), "faiss.index")
-CHUNKS_PATH = os.path.join(os.path.dirname(__file__), "chunks.pkl")
+STORE_DIR = os.path.join(os.path.dirname(__file__), "store")
+# Pre-PageStore save files, imported once into an empty store next to them
+FAISS_INDEX_NAME = "faiss.index"
+CHUNKS_NAME = "chunks.pkl"
+WAL_CHECKPOINT_BYTES = int(os.getenv("WAL_CHECKPOINT_BYTES", str(64 * 2**20)))  # log size that triggers a snapshot
+FLUSH_INTERVAL = float(os.getenv("FLUSH_INTERVAL", "1.0"))  # max seconds buffered log appends wait for the persister
+FLUSH_BYTES = int(os.getenv("FLUSH_BYTES", str(2**20)))  # buffered log bytes that wake the persister early
+ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", "64"))  # chunks per SentenceTransformer forward pass
+ENCODE_WORKERS = int(os.getenv("ENCODE_WORKERS", "1"))  # encoder processes used by add_pages
+COMPACT_INTERVAL = float(os.getenv("COMPACT_INTERVAL", "60"))  # seconds between background compactions
 
 class MemoryManager:
-    def __init__(self):
+    """Page chunks and their FAISS index, addressed by stable chunk ids.
+
+    Deleting or re-indexing a URL only touches that page's ids: its chunks
+    are dropped from the store and the ids are tombstoned, which hides them
+    from search. `compact` removes tombstoned vectors from FAISS in one
+    batch, periodically from a background thread (`start_compactor`).
+
+    Chunks live in a PageStore under `path`; adds and deletes are appended
+    to its write-ahead log, and the FAISS index is only written when the log
+    is folded into a snapshot (past WAL_CHECKPOINT_BYTES, and on close).
+    A flat index is not saved at all: load rebuilds it from the mmapped matrix.
+
+    With `start_persister`, requests only buffer their log appends; a
+    background thread flushes them every FLUSH_INTERVAL seconds or once
+    FLUSH_BYTES pile up, and writes snapshots outside the lock. A crash
+    loses at most the appends of the last interval.
+    """
+
+    def __init__(self, path: str = STORE_DIR):
         self.model = SentenceTransformer(MODEL_NAME)
-        self.index = faiss.IndexFlatL2(self.model.get_sentence_embedding_dimension())
-        self.chunks = []  # List[Dict]: {"url", "chunk", "embedding", "position"}
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.path = path
+        self.index = build_index(self.dim)
+        self.store = PageStore(path, self.dim)
+        self.deleted = set()  # ids still in the FAISS index whose chunks are gone
+        self.next_id = 0
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._compactor = None
+        self._persister = None
+        self._wake = threading.Event()
+        self._dirty_since = None  # monotonic time of the oldest unflushed change
+        self.persisted = {"flushes": 0, "checkpoints": 0, "bytes_written": 0,
+                          "last_flush_lag_s": 0.0, "max_flush_lag_s": 0.0}
         self._load_index()
 
     def chunk_text(self, text: str) -> List[str]:
@@ -26,46 +68,231 @@ class MemoryManager:
         embedding = self.model.encode(text)
         return embedding
 
+    def embed_many(self, texts: List[str], workers: int = 1) -> np.ndarray:
+        """Encode texts in micro-batches of ENCODE_BATCH_SIZE; with workers > 1, across a pool of encoder processes."""
+        if not texts:
+            return np.empty((0, self.dim), dtype=np.float32)
+        if workers > 1:
+            # Each process loads its own copy of the model, so this only pays off for large imports
+            pool = self.model.start_multi_process_pool(["cpu"] * workers)
+            try:
+                embs = self.model.encode_multi_process(texts, pool, batch_size=ENCODE_BATCH_SIZE)
+            finally:
+                self.model.stop_multi_process_pool(pool)
+        else:
+            embs = self.model.encode(texts, batch_size=ENCODE_BATCH_SIZE, show_progress_bar=False)
+        return np.asarray(embs, dtype=np.float32).reshape(-1, self.dim)
+
     def add_to_index(self, url: str, chunks: List[str]):
-        # Remove existing chunks and embeddings for this URL (re-index/update)
-        old_indices = [i for i, c in enumerate(self.chunks) if c["url"] == url]
-        if old_indices:
-            # Remove from FAISS index and chunks (rebuild index)
-            keep_indices = [i for i in range(len(self.chunks)) if i not in old_indices]
-            if keep_indices:
-                kept_embs = np.array([self.chunks[i]["embedding"] for i in keep_indices]).astype('float32')
-                self.index = faiss.IndexFlatL2(self.model.get_sentence_embedding_dimension())
-                self.index.add(kept_embs)
-                self.chunks = [self.chunks[i] for i in keep_indices]
-            else:
-                self.index = faiss.IndexFlatL2(self.model.get_sentence_embedding_dimension())
-                self.chunks = []
-        # Add new chunks
-        for idx, chunk in enumerate(chunks):
-            emb = self.embed(chunk)
-            self.index.add(np.array([emb]).astype('float32'))
-            self.chunks.append({"url": url, "chunk": chunk, "embedding": emb, "position": idx})
-        self._save_index()
+        self.add_pages({url: chunks}, workers=1)
+
+    def add_pages(self, pages: Dict[str, List[str]], workers: int = ENCODE_WORKERS):
+        """Index (or re-index) several pages: one batched encode over all their chunks, one FAISS add, one save."""
+        pages = {url: list(chunks) for url, chunks in pages.items()}
+        texts = [chunk for chunks in pages.values() for chunk in chunks]
+        embs = self.embed_many(texts, workers)
+        with self._lock:
+            # Replace any earlier version of these URLs (re-index/update)
+            for url in pages:
+                self._remove_url(url)
+            if texts:
+                ids = np.arange(self.next_id, self.next_id + len(texts), dtype=np.int64)
+                self.next_id += len(texts)
+                self.index.add_with_ids(embs, ids)
+                start = 0
+                for url, chunks in pages.items():
+                    end = start + len(chunks)
+                    self.store.add(url, ids[start:end], chunks, embs[start:end])
+                    start = end
+            self.index = maybe_upgrade(self.index)
+            self._save_index()
+
+    def _remove_url(self, url: str) -> int:
+        ids = self.store.delete_url(url)
+        self.deleted.update(ids)
+        return len(ids)
+
+    def delete_page(self, url: str) -> int:
+        """Drop a page's chunks and hide its vectors until the next compaction; returns how many chunks went."""
+        with self._lock:
+            removed = self._remove_url(url)
+            if removed:
+                self._save_index()
+            return removed
+
+    def page_chunks(self, url: str) -> List[str]:
+        """Chunk texts of a page, in position order."""
+        with self._lock:
+            return self.store.page_chunks(url)
+
+    def urls(self) -> List[str]:
+        with self._lock:
+            return self.store.urls()
+
+    def compact(self) -> int:
+        """Remove tombstoned vectors from the FAISS index; returns how many went."""
+        with self._lock:
+            if not self.deleted:
+                return 0
+            self.index, removed = remove_ids(self.index, sorted(self.deleted))
+            self.deleted.clear()
+            self._save_index()
+            return removed
+
+    def start_compactor(self, interval: float = COMPACT_INTERVAL):
+        """Compact every `interval` seconds on a daemon thread."""
+        if self._compactor is not None:
+            return
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.compact()
+                except Exception as e:
+                    print(f"[memory] Background compaction failed: {e}")
+
+        self._compactor = threading.Thread(target=loop, name="memory-compact", daemon=True)
+        self._compactor.start()
+
+    def start_persister(self, interval: float = FLUSH_INTERVAL):
+        """Flush buffered log appends (and snapshot when due) on a daemon thread instead of inline."""
+        if self._persister is not None:
+            return
+
+        def loop():
+            while not self._stop.is_set():
+                self._wake.wait(interval)
+                self._wake.clear()
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"[memory] Background flush failed: {e}")
+
+        self._persister = threading.Thread(target=loop, name="memory-persist", daemon=True)
+        self._persister.start()
+
+    def close(self):
+        """Stop the background threads, compact once more and fold the log into a snapshot for a fast next start."""
+        self._stop.set()
+        self._wake.set()
+        for thread in (self._compactor, self._persister):
+            if thread is not None:
+                thread.join()
+        self._compactor = self._persister = None
+        self.compact()
+        with self._lock:
+            self._flush_log()
+            if self.store.wal_bytes():
+                self._checkpoint()
+            self.store.close()
+
+    def _rebuild_index(self):
+        """Rebuild the index from the stored chunk embeddings (Flat, or the configured ANN mode once large)."""
+        ids = self.store.live_ids()
+        self.index = index_for_corpus(self.dim, ids, self.store.vectors(ids))
+        self.deleted.clear()
 
     def search(self, query: str, k: int = 5):
         q_emb = self.embed(query)
-        D, I = self.index.search(np.array([q_emb]).astype('float32'), k)
-        results = []
-        for i in I[0]:
-            if 0 <= i < len(self.chunks):
-                chunk = self.chunks[i].copy()
-                if "embedding" in chunk:
-                    del chunk["embedding"]
-                results.append(chunk)
-        return results
+        with self._lock:
+            params = None
+            if self.deleted:
+                dead = np.fromiter(self.deleted, dtype=np.int64, count=len(self.deleted))
+                batch = faiss.IDSelectorBatch(len(dead), faiss.swig_ptr(dead))
+                params = search_params(self.index, faiss.IDSelectorNot(batch))
+            D, I = self.index.search(np.array([q_emb]).astype('float32'), k, params=params)
+            results = []
+            for i in I[0]:
+                chunk = self.store.chunk(int(i))
+                if chunk is not None:
+                    results.append(chunk)
+            return results
 
     def _save_index(self):
-        faiss.write_index(self.index, FAISS_INDEX_PATH)
-        with open(CHUNKS_PATH, "wb") as f:
-            pickle.dump(self.chunks, f)
+        """Mark the store dirty; the persister flushes it later, or it is flushed here when none runs."""
+        if self._dirty_since is None:
+            self._dirty_since = time.monotonic()
+        if self._persister is None:
+            self.flush()
+        elif self.store.unflushed >= FLUSH_BYTES or self.store.wal_bytes() > WAL_CHECKPOINT_BYTES:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """Flush buffered log appends, then snapshot if the log has outgrown WAL_CHECKPOINT_BYTES; returns bytes written."""
+        with self._lock:
+            written = self._flush_log()
+            due = self.store.wal_bytes() > WAL_CHECKPOINT_BYTES
+        if due:
+            written += self._checkpoint()
+        return written
+
+    def _flush_log(self) -> int:
+        if self._dirty_since is None:
+            return 0
+        lag = time.monotonic() - self._dirty_since
+        written = self.store.flush()
+        self._dirty_since = None
+        self.persisted["flushes"] += 1
+        self.persisted["bytes_written"] += written
+        self.persisted["last_flush_lag_s"] = lag
+        self.persisted["max_flush_lag_s"] = max(self.persisted["max_flush_lag_s"], lag)
+        return written
+
+    def _checkpoint(self) -> int:
+        # Only copying state out and switching over need the lock; adds carry on while the files are written.
+        # Callers are the persister, close() after it stopped, or a caller already holding the lock.
+        with self._lock:
+            self._flush_log()
+            # A flat index holds nothing the embedding matrix doesn't, so it is rebuilt on load rather than saved
+            snapshot = self.store.begin_checkpoint(None if index_mode(self.index) == "flat" else self.index)
+        written = self.store.write_snapshot(snapshot)
+        with self._lock:
+            self._flush_log()
+            self.store.finish_checkpoint(snapshot)
+            self.persisted["checkpoints"] += 1
+            self.persisted["bytes_written"] += written
+        return written
+
+    def persist_stats(self) -> dict:
+        """Flush counters, bytes written, and how long the oldest unflushed change has waited."""
+        with self._lock:
+            lag = time.monotonic() - self._dirty_since if self._dirty_since is not None else 0.0
+            return {**self.persisted, "flush_lag_s": lag, "unflushed_bytes": self.store.unflushed,
+                    "wal_bytes": self.store.wal_bytes(), "generation": self.store.generation}
 
     def _load_index(self):
-        if os.path.exists(FAISS_INDEX_PATH) and os.path.exists(CHUNKS_PATH):
-            self.index = faiss.read_index(FAISS_INDEX_PATH)
-            with open(CHUNKS_PATH, "rb") as f:
-                self.chunks = pickle.load(f)
+        legacy_chunks = os.path.join(os.path.dirname(os.path.abspath(self.path)), CHUNKS_NAME)
+        if self.store.generation == 0 and not len(self.store) and os.path.exists(legacy_chunks):
+            self._import_legacy(legacy_chunks)
+        elif self.store.index_file() is not None:
+            self.index = faiss.read_index(str(self.store.index_file()))
+        # Chunks logged after the snapshot are not in its index yet; chunks deleted since are
+        stored = index_ids(self.index)
+        live = self.store.live_ids()
+        missing = np.setdiff1d(live, stored)
+        if len(missing):
+            self.index.add_with_ids(self.store.vectors(missing), missing)
+            self.index = maybe_upgrade(self.index)
+        self.deleted = set(np.setdiff1d(stored, live).tolist())
+        self.next_id = max(int(stored.max()) + 1 if len(stored) else 0, self.store.max_id + 1)
+
+    def _import_legacy(self, chunks_path: str):
+        """Move a chunks.pkl/faiss.index save into the store and snapshot it; the old files are left untouched."""
+        with open(chunks_path, "rb") as f:
+            chunks = pickle.load(f)
+        # Older saves kept a list whose positions were the ids
+        chunks = dict(enumerate(chunks)) if isinstance(chunks, list) else chunks
+        pages = {}
+        for chunk_id, c in sorted(chunks.items(), key=lambda item: item[1]["position"]):
+            pages.setdefault(c["url"], []).append(chunk_id)
+        for url, ids in pages.items():
+            embs = np.array([chunks[i]["embedding"] for i in ids], dtype=np.float32).reshape(-1, self.dim)
+            self.store.add(url, ids, [chunks[i]["chunk"] for i in ids], embs)
+        index_path = os.path.join(os.path.dirname(chunks_path), FAISS_INDEX_NAME)
+        if os.path.exists(index_path):
+            self.index = faiss.read_index(index_path)
+        if isinstance(self.index, faiss.IndexFlat) or not os.path.exists(index_path):
+            # Indexes saved before the index factory cannot take explicit ids
+            self._rebuild_index()
+        self._checkpoint()
+        print(f"[memory] Imported {len(self.store)} chunks from {chunks_path}")
@@ -0,0 +1,344 @@
+"""
+Page chunk storage for MemoryManager: snapshot files plus a write-ahead log.
+
+A snapshot (generation g) is
+  embeddings.g.npy   float32 (n, dim) matrix, memory-mapped on load
+  chunks.g.npz       columns: ids, url codes, positions, text offsets/lengths, url table
+  text.g.bin         UTF-8 chunk texts back to back, memory-mapped on load
+  index.g.faiss      the FAISS index as of the snapshot, unless it is just the matrix again (flat)
+and manifest.json names the current generation. Adds and deletes since the
+snapshot are appended to wal.w.jsonl (records) and wal.w.f32 (vectors), w >= g,
+so a save writes only what changed; appends are buffered until `flush`.
+`checkpoint` folds the log into a new snapshot, dropping deleted rows. Every
+file is written under a .tmp name and renamed into place.
+"""
+
+import json
+import os
+import re
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import faiss
+import numpy as np
+
+MANIFEST_NAME = "manifest.json"
+INITIAL_CAPACITY = 1024  # rows preallocated for vectors added after the snapshot; doubled when full
+
+
+class PageStore:
+    """Chunks (url, text, position, vector) by stable chunk id, persisted as snapshot + WAL."""
+
+    def __init__(self, path: str, dim: int):
+        self.path = Path(path)
+        self.dim = dim
+        self.generation = 0  # snapshot in use
+        self.wal_generation = 0  # log being appended to
+        self.unflushed = 0  # bytes appended since the last flush
+        self._wal_records = None
+        self._wal_vectors = None
+        self._open_snapshot(self._read_manifest())
+        self._replay_wal()
+        self._open_wal(max(self._wal_generations(), default=self.generation))
+        self._remove_old_generations()
+
+    # === In-memory columns ===
+    def _reset(self):
+        # One row per chunk added since the snapshot was written; deleted rows linger until the next checkpoint
+        self.ids = array("q")
+        self.url_codes = array("i")
+        self.positions = array("i")
+        self.text_starts = array("q")
+        self.text_lengths = array("i")
+        self.url_table: List[str] = []
+        self._url_code: Dict[str, int] = {}
+        self._snapshot_text = b""
+        self._tail_text = bytearray()
+        self._snapshot_vectors = np.empty((0, self.dim), dtype=np.float32)
+        self._tail_vectors: Optional[np.ndarray] = None
+        self._tail_count = 0
+        self.row_of: Dict[int, int] = {}  # live chunk id -> row
+        self.url_ids: Dict[str, List[int]] = {}  # url -> live chunk ids, in position order
+        self.max_id = -1
+
+    def __len__(self) -> int:
+        return len(self.row_of)
+
+    def _code(self, url: str) -> int:
+        code = self._url_code.get(url)
+        if code is None:
+            code = self._url_code[url] = len(self.url_table)
+            self.url_table.append(url)
+        return code
+
+    def _text(self, row: int) -> str:
+        start, length = self.text_starts[row], self.text_lengths[row]
+        split = len(self._snapshot_text)
+        if start < split:
+            return bytes(self._snapshot_text[start:start + length]).decode("utf-8")
+        return self._tail_text[start - split:start - split + length].decode("utf-8")
+
+    def _apply_add(self, url: str, ids: Sequence[int], chunks: Sequence[str], vectors: np.ndarray):
+        code = self._code(url)
+        n = self._tail_count
+        if self._tail_vectors is None:
+            self._tail_vectors = np.empty((max(INITIAL_CAPACITY, len(ids)), self.dim), dtype=np.float32)
+        elif n + len(ids) > len(self._tail_vectors):
+            grown = np.empty((max(2 * len(self._tail_vectors), n + len(ids)), self.dim), dtype=np.float32)
+            grown[:n] = self._tail_vectors[:n]
+            self._tail_vectors = grown
+        self._tail_vectors[n:n + len(ids)] = vectors
+        self._tail_count += len(ids)
+        page_ids = self.url_ids.setdefault(url, [])
+        for position, (chunk_id, chunk) in enumerate(zip(ids, chunks)):
+            data = chunk.encode("utf-8")
+            self.row_of[chunk_id] = len(self.ids)
+            self.ids.append(chunk_id)
+            self.url_codes.append(code)
+            self.positions.append(position)
+            self.text_starts.append(len(self._snapshot_text) + len(self._tail_text))
+            self.text_lengths.append(len(data))
+            self._tail_text += data
+            page_ids.append(chunk_id)
+            self.max_id = max(self.max_id, chunk_id)
+
+    def _apply_delete(self, url: str) -> List[int]:
+        ids = self.url_ids.pop(url, [])
+        for chunk_id in ids:
+            del self.row_of[chunk_id]
+        return ids
+
+    # === Reads ===
+    def chunk(self, chunk_id: int) -> Optional[dict]:
+        row = self.row_of.get(chunk_id)
+        if row is None:
+            return None
+        return {"url": self.url_table[self.url_codes[row]], "chunk": self._text(row), "position": self.positions[row]}
+
+    def page_chunks(self, url: str) -> List[str]:
+        return [self._text(self.row_of[i]) for i in self.url_ids.get(url, [])]
+
+    def urls(self) -> List[str]:
+        return list(self.url_ids)
+
+    def live_ids(self) -> np.ndarray:
+        return np.fromiter(self.row_of, dtype=np.int64, count=len(self.row_of))
+
+    def vectors(self, ids: Sequence[int]) -> np.ndarray:
+        """(len(ids), dim) float32 copy of the vectors of live chunk ids."""
+        rows = np.array([self.row_of[int(i)] for i in ids], dtype=np.int64)
+        out = np.empty((len(rows), self.dim), dtype=np.float32)
+        split = len(self._snapshot_vectors)
+        old = rows < split
+        out[old] = self._snapshot_vectors[rows[old]]
+        if (~old).any():
+            out[~old] = self._tail_vectors[rows[~old] - split]
+        return out
+
+    # === Writes ===
+    def add(self, url: str, ids: Sequence[int], chunks: Sequence[str], vectors: np.ndarray):
+        """Append a page's chunks: vectors first, then the record that commits them."""
+        ids = [int(i) for i in ids]
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        self._wal_vectors.write(vectors.tobytes())
+        self.unflushed += vectors.nbytes
+        self._write_record({"op": "add", "url": url, "ids": ids, "chunks": list(chunks)})
+        self._apply_add(url, ids, chunks, vectors)
+
+    def delete_url(self, url: str) -> List[int]:
+        """Drop a page's chunks; returns their ids."""
+        if url not in self.url_ids:
+            return []
+        self._write_record({"op": "delete", "url": url})
+        return self._apply_delete(url)
+
+    def wal_bytes(self) -> int:
+        return self._wal_records.tell() + self._wal_vectors.tell()
+
+    def _write_record(self, record: dict):
+        line = json.dumps(record) + "\n"
+        self._wal_records.write(line)
+        self.unflushed += len(line)
+
+    def flush(self) -> int:
+        """Hand buffered log appends to the OS, vectors before the records that need them; returns the bytes."""
+        self._wal_vectors.flush()
+        self._wal_records.flush()
+        flushed, self.unflushed = self.unflushed, 0
+        return flushed
+
+    # === Files ===
+    def _name(self, kind: str, generation: int) -> Path:
+        return self.path / {
+            "embeddings": f"embeddings.{generation}.npy",
+            "chunks": f"chunks.{generation}.npz",
+            "text": f"text.{generation}.bin",
+            "index": f"index.{generation}.faiss",
+            "wal": f"wal.{generation}.jsonl",
+            "wal_vectors": f"wal.{generation}.f32",
+        }[kind]
+
+    def _read_manifest(self) -> int:
+        manifest = self.path / MANIFEST_NAME
+        return json.loads(manifest.read_text())["generation"] if manifest.exists() else 0
+
+    def _wal_generations(self) -> List[int]:
+        """Generations of the logs on top of the current snapshot, oldest first."""
+        found = (re.fullmatch(r"wal\.(\d+)\.jsonl", p.name) for p in self.path.glob("wal.*.jsonl"))
+        return sorted(g for g in (int(m.group(1)) for m in found if m) if g >= self.generation)
+
+    def _write_atomic(self, path: Path, write):
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+
+    def _open_snapshot(self, generation: int):
+        self._reset()
+        self.generation = generation
+        if not self._name("chunks", generation).exists():
+            return
+        with np.load(self._name("chunks", generation)) as columns:
+            self.ids = array("q", columns["ids"].astype(np.int64).tobytes())
+            self.url_codes = array("i", columns["url_codes"].astype(np.int32).tobytes())
+            self.positions = array("i", columns["positions"].astype(np.int32).tobytes())
+            self.text_starts = array("q", columns["text_starts"].astype(np.int64).tobytes())
+            self.text_lengths = array("i", columns["text_lengths"].astype(np.int32).tobytes())
+            self.url_table = columns["urls"].tolist()
+        self._url_code = {url: code for code, url in enumerate(self.url_table)}
+        if self._name("text", generation).stat().st_size:
+            self._snapshot_text = np.memmap(self._name("text", generation), dtype=np.uint8, mode="r")
+        if len(self.ids):
+            self._snapshot_vectors = np.load(self._name("embeddings", generation), mmap_mode="r")
+        self.row_of = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        for row, chunk_id in enumerate(self.ids):
+            # Snapshot rows are stored page by page in position order
+            self.url_ids.setdefault(self.url_table[self.url_codes[row]], []).append(chunk_id)
+        self.max_id = max(self.ids, default=-1)
+
+    def _replay_wal(self):
+        # A checkpoint that never committed leaves its log behind; it continues the older ones
+        for generation in self._wal_generations():
+            self._replay_log(generation)
+
+    def _replay_log(self, generation: int):
+        records, vectors_file = self._name("wal", generation), self._name("wal_vectors", generation)
+        vectors = np.empty((0, self.dim), dtype=np.float32)
+        if vectors_file.exists():
+            raw = np.fromfile(vectors_file, dtype=np.float32)
+            vectors = raw[:len(raw) - len(raw) % self.dim].reshape(-1, self.dim)
+        used, good_bytes = 0, 0
+        with open(records, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line) if line.endswith("\n") else None
+                except ValueError:
+                    record = None
+                if record is None:
+                    break  # torn final record: nothing after it was committed
+                if record["op"] == "add":
+                    n = len(record["ids"])
+                    if used + n > len(vectors):
+                        break
+                    self._apply_add(record["url"], record["ids"], record["chunks"], vectors[used:used + n])
+                    used += n
+                else:
+                    self._apply_delete(record["url"])
+                good_bytes += len(line.encode("utf-8"))
+        # Cut any torn tail so new records append after the last committed one
+        os.truncate(records, good_bytes)
+        if vectors_file.exists():
+            os.truncate(vectors_file, used * self.dim * 4)
+
+    def _open_wal(self, generation: int):
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.wal_generation = generation
+        self._wal_records = open(self._name("wal", generation), "a", encoding="utf-8")
+        self._wal_vectors = open(self._name("wal_vectors", generation), "ab")
+
+    def index_file(self) -> Optional[Path]:
+        path = self._name("index", self.generation)
+        return path if path.exists() else None
+
+    def checkpoint(self, index=None) -> int:
+        """Write live rows (and `index`, if given) as a new snapshot and switch to it; returns bytes written."""
+        snapshot = self.begin_checkpoint(index)
+        written = self.write_snapshot(snapshot)
+        self.finish_checkpoint(snapshot)
+        return written
+
+    def begin_checkpoint(self, index=None) -> dict:
+        """Copy out everything a snapshot needs and start a new log for later appends.
+
+        Only this step and `finish_checkpoint` need the caller's lock; `write_snapshot`
+        does the slow file writes without it while adds and deletes carry on.
+        """
+        self.flush()
+        # Group rows page by page so a load can rebuild url_ids in one pass
+        rows = sorted(self.row_of.values(), key=lambda r: (self.url_codes[r], self.positions[r]))
+        urls = sorted({self.url_codes[r] for r in rows})
+        recode = {code: i for i, code in enumerate(urls)}
+        texts = [self._text(r).encode("utf-8") for r in rows]
+        lengths = np.fromiter((len(t) for t in texts), dtype=np.int32, count=len(texts))
+        starts = np.concatenate([[0], np.cumsum(lengths[:-1], dtype=np.int64)]) if len(texts) else np.empty(0, np.int64)
+        ids = np.array([self.ids[r] for r in rows], dtype=np.int64)
+        snapshot = {
+            "generation": self.wal_generation + 1,
+            "vectors": self.vectors(ids),
+            "text": b"".join(texts),
+            "columns": {
+                "ids": ids,
+                "url_codes": np.array([recode[self.url_codes[r]] for r in rows], dtype=np.int32),
+                "positions": np.array([self.positions[r] for r in rows], dtype=np.int32),
+                "text_starts": starts.astype(np.int64),
+                "text_lengths": lengths,
+                "urls": np.array([self.url_table[c] for c in urls], dtype=str),
+            },
+            "index": faiss.serialize_index(index) if index is not None else None,
+        }
+        self.close()
+        self._open_wal(snapshot["generation"])
+        return snapshot
+
+    def write_snapshot(self, snapshot: dict) -> int:
+        """Write the snapshot files, then commit them by replacing the manifest; returns bytes written."""
+        generation = snapshot["generation"]
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._write_atomic(self._name("embeddings", generation), lambda f: np.save(f, snapshot["vectors"]))
+        self._write_atomic(self._name("text", generation), lambda f: f.write(snapshot["text"]))
+        self._write_atomic(self._name("chunks", generation), lambda f: np.savez(f, **snapshot["columns"]))
+        if snapshot["index"] is not None:
+            self._write_atomic(self._name("index", generation), lambda f: f.write(snapshot["index"].tobytes()))
+        written = sum(self._name(kind, generation).stat().st_size for kind in ("embeddings", "text", "chunks", "index")
+                      if self._name(kind, generation).exists())
+        # The manifest is the commit point; a crash before it leaves the old generation in charge
+        manifest = json.dumps({"generation": generation, "dim": self.dim}).encode("utf-8")
+        self._write_atomic(self.path / MANIFEST_NAME, lambda f: f.write(manifest))
+        return written + len(manifest)
+
+    def finish_checkpoint(self, snapshot: dict):
+        """Switch to the committed snapshot, replay what was logged meanwhile and delete older files."""
+        self.flush()
+        # Drops the memory maps of the old snapshot (reads only hand out copies), so its files can go
+        self._open_snapshot(snapshot["generation"])
+        self._replay_log(self.wal_generation)
+        self._remove_old_generations()
+
+    def _remove_old_generations(self):
+        """Delete the files of generations before the current snapshot."""
+        for path in self.path.iterdir():
+            m = re.fullmatch(r"\w+\.(\d+)\.\w+", path.name)
+            if m and int(m.group(1)) < self.generation:
+                try:
+                    path.unlink(missing_ok=True)
+                except PermissionError:
+                    # Windows refuses while a file is still open or mapped; the snapshot is already
+                    # committed, so leave the file for the next open or checkpoint to retry
+                    pass
+
+    def close(self):
+        for f in (self._wal_records, self._wal_vectors):
+            if f is not None:
+                f.close()
+        self._wal_records = self._wal_vectors = None
@@ -0,0 +1,144 @@
+"""PageStore recovery: WAL replay after a crash, torn tails and interrupted checkpoints."""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+from page_store import MANIFEST_NAME, PageStore  # noqa: E402
+
+DIM = 4
+
+
+def page(url: str, first_id: int, n: int):
+    vectors = np.arange(first_id * DIM, (first_id + n) * DIM, dtype=np.float32).reshape(n, DIM)
+    return url, list(range(first_id, first_id + n)), [f"{url} chunk {i}" for i in range(n)], vectors
+
+
+def assert_pages(store: PageStore, expected):
+    assert sorted(store.urls()) == sorted(expected)
+    for url, ids, chunks, vectors in expected.values():
+        assert store.page_chunks(url) == chunks
+        assert np.array_equal(store.vectors(ids), vectors)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "store"
+
+
+def test_flushed_log_is_replayed_without_a_checkpoint(path):
+    store = PageStore(path, DIM)
+    pages = {url: page(url, i * 10, 3) for i, url in enumerate(["a", "b", "c"])}
+    for p in pages.values():
+        store.add(*p)
+    store.delete_url("b")
+    store.flush()
+    # Crash: no close, no checkpoint
+    del pages["b"]
+    assert_pages(PageStore(path, DIM), pages)
+
+
+def test_torn_tail_is_cut_and_appends_continue_after_it(path):
+    store = PageStore(path, DIM)
+    a = page("a", 0, 2)
+    store.add(*a)
+    store.flush()
+    store.close()
+    with open(path / "wal.0.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"op": "add", "url": "torn", "ids": [9')
+    with open(path / "wal.0.f32", "ab") as f:
+        f.write(np.ones(DIM + 1, dtype=np.float32).tobytes())
+
+    store = PageStore(path, DIM)
+    assert_pages(store, {"a": a})
+    b = page("b", 5, 1)
+    store.add(*b)
+    store.close()
+    assert_pages(PageStore(path, DIM), {"a": a, "b": b})
+
+
+def test_record_without_its_vectors_is_not_replayed(path):
+    store = PageStore(path, DIM)
+    a = page("a", 0, 2)
+    store.add(*a)
+    store.flush()
+    store.close()
+    # A record whose vectors never reached the disk
+    with open(path / "wal.0.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"op": "add", "url": "b", "ids": [7], "chunks": ["lost"]}\n')
+    assert_pages(PageStore(path, DIM), {"a": a})
+
+
+def test_snapshot_plus_log_after_a_checkpoint(path):
+    store = PageStore(path, DIM)
+    a, b = page("a", 0, 3), page("b", 3, 2)
+    store.add(*a)
+    store.checkpoint()
+    store.add(*b)
+    store.delete_url("a")
+    store.flush()
+    reopened = PageStore(path, DIM)
+    assert reopened.generation == 1
+    assert_pages(reopened, {"b": b})
+    assert not (path / "wal.0.jsonl").exists()
+
+
+def test_checkpoint_interrupted_before_the_manifest_keeps_the_old_generation(path):
+    store = PageStore(path, DIM)
+    a, b = page("a", 0, 2), page("b", 2, 2)
+    store.add(*a)
+    store.flush()
+    snapshot = store.begin_checkpoint()
+    store.add(*b)  # lands in the new log while the snapshot is being written
+    store.flush()
+    # Crash before write_snapshot: old generation, both logs replayed
+    reopened = PageStore(path, DIM)
+    assert not (path / MANIFEST_NAME).exists()
+    assert snapshot["generation"] == 1
+    assert_pages(reopened, {"a": a, "b": b})
+
+
+def test_checkpoint_interrupted_after_the_manifest_uses_the_new_generation(path):
+    store = PageStore(path, DIM)
+    a, b = page("a", 0, 2), page("b", 2, 2)
+    store.add(*a)
+    snapshot = store.begin_checkpoint()
+    store.add(*b)
+    store.write_snapshot(snapshot)
+    store.flush()
+    # Crash before finish_checkpoint
+    reopened = PageStore(path, DIM)
+    assert reopened.generation == 1
+    assert_pages(reopened, {"a": a, "b": b})
+
+
+def test_old_generation_that_cannot_be_deleted_is_removed_on_the_next_open(path, monkeypatch):
+    store = PageStore(path, DIM)
+    pages = {"a": page("a", 0, 3)}
+    store.add(*pages["a"])
+    store.checkpoint()
+    store.close()
+
+    def still_mapped(self, missing_ok=False):
+        # What Windows raises for a file that is still open or memory-mapped
+        raise PermissionError(13, "The process cannot access the file", str(self))
+
+    unlink = Path.unlink
+    monkeypatch.setattr(Path, "unlink", still_mapped)
+    store = PageStore(path, DIM)
+    pages["b"] = page("b", 10, 2)
+    store.add(*pages["b"])
+    store.checkpoint()
+    assert store.generation == 2
+    assert_pages(store, pages)
+    store.close()
+    assert (path / "embeddings.1.npy").exists()
+
+    monkeypatch.setattr(Path, "unlink", unlink)
+    reopened = PageStore(path, DIM)
+    assert_pages(reopened, pages)
+    assert not any(p.name.split(".")[1] == "1" for p in path.iterdir())
+    reopened.close()